@@ -1,15 +1,53 @@
 import os
 from dotenv import load_dotenv
 import ssl
+import hashlib
+import json
+import time
+import click
+import uuid
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, g, has_request_context
 from functools import wraps
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import text, bindparam
+from sqlalchemy.exc import IntegrityError
 
 # Tải biến môi trường từ file .env trước khi import Config
 load_dotenv()
 from config import Config
+from services.masterdata_index import MasterDataIndex, MasterRecord
+from services import schema
+from services.claims import claim_cartons, run_stress
+from services import counters
+from services import events
+from services.events import EventBus
+from services.importer import ScanfileImporter, ImportFileError, iter_file_rows
+from services.masterdata_import import MasterdataImporter
+from services import exporter
+from services import labels
+from services import versions
+from services import stats
+from services import productivity
+from services import archive
+from services.archive import JobArchiver
+from services import pallets
+from services import jobs
+from services.jobs import JobListCache
+from services.response_cache import ResponseCache, open_store
+from services import server_profile
+from services import loadtest
+from services import metrics
+from services.slow_queries import SlowQueryLog, SlowQueryStore
+from services import scan_ledger
+from services.scan_ledger import ScanLedger
+from services.scan_queue import ScanQueue, ScanWriter, BUSY_MESSAGE
+from services import scanned_barcodes
+from services.scanned_barcodes import BarcodeFilters
+from services import barcode_parser
+from services.barcode_parser import BarcodeParser
 
 
 app = Flask(__name__)
@@ -23,6 +61,15 @@ if not db_url:
     db_url = 'sqlite:///local.db'
     app.config['SQLALCHEMY_DATABASE_URI'] = db_url
 
+# Kích thước pool và timeout query: gunicorn.conf.py tính theo số worker/thread (services/server_profile.py)
+pool_options, timeout_args = server_profile.engine_options(
+    db_url.split(':', 1)[0].split('+', 1)[0],
+    pool_size=app.config['DB_POOL_SIZE'],
+    max_overflow=app.config['DB_MAX_OVERFLOW'],
+    pool_timeout=app.config['DB_POOL_TIMEOUT'],
+    statement_timeout=app.config['DB_STATEMENT_TIMEOUT'],
+)
+
 # Xử lý SSL và Pooling cho Aiven (MySQL)
 if db_url and 'mysql' in db_url:
     # Loại bỏ tham số ssl-mode cũ nếu có để tránh xung đột
@@ -36,12 +83,20 @@ if db_url and 'mysql' in db_url:
 
     app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
         "connect_args": {
-            "ssl": ssl_ctx
+            "ssl": ssl_ctx,
+            **timeout_args
         },
         "pool_recycle": 280,  # Refresh connection trước 300s (timeout của Aiven)
-        "pool_pre_ping": True # Auto reconnect nếu mất kết nối
+        "pool_pre_ping": True, # Auto reconnect nếu mất kết nối
+        **pool_options
     }
     app.config['SQLALCHEMY_DATABASE_URI'] = db_url
+elif db_url.startswith('postgresql'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        "connect_args": timeout_args,
+        "pool_pre_ping": True,
+        **pool_options
+    }
 
 db = SQLAlchemy(app)
 
@@ -74,18 +129,302 @@ def init_local_db():
                     )
                 """))
                 # Tạo bảng masterdata
-                db.session.execute(text("CREATE TABLE IF NOT EXISTS masterdata (sku TEXT PRIMARY KEY, refix TEXT, weight REAL)"))
+                db.session.execute(text("""
+                    CREATE TABLE IF NOT EXISTS masterdata (
+                        sku TEXT PRIMARY KEY, refix TEXT, weight REAL, length REAL, width REAL, height REAL, cbm REAL, cartonperpallet INTEGER, updated_at TIMESTAMP
+                    )
+                """))
                 
                 # Tạo admin mặc định (User: admin / Pass: 123456)
                 if not db.session.execute(text("SELECT id FROM users WHERE username = 'admin'")).fetchone():
                     db.session.execute(text("INSERT INTO users (username, password, role) VALUES ('admin', '123456', 'admin')"))
                 
                 db.session.commit()
+
+                # SQLite local: tự chạy migration (index, cột mới). MySQL/Postgres: dùng `flask db-upgrade`
+                schema.upgrade(db.engine)
             except Exception as e:
                 print(f"Lỗi khởi tạo DB Local: {e}")
 
 init_local_db()
 
+# --- CHỈ MỤC MASTERDATA TRONG RAM (prefix -> SKU) ---
+masterdata_index = MasterDataIndex(
+    refresh_interval=app.config['MASTERDATA_REFRESH_SECONDS'],
+    full_reload_interval=app.config['MASTERDATA_FULL_RELOAD_SECONDS']
+)
+
+def load_masterdata_index():
+    with app.app_context():
+        try:
+            size = masterdata_index.load(db.session)
+            print(f"Đã nạp {size} prefix masterdata vào RAM")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Lỗi nạp chỉ mục masterdata: {e}")
+
+load_masterdata_index()
+
+def lookup_masterdata(prefix):
+    """Trả về MasterRecord của prefix (None nếu không có), ưu tiên chỉ mục trong RAM."""
+    try:
+        masterdata_index.refresh(db.session)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Lỗi làm mới chỉ mục masterdata: {e}")
+
+    if masterdata_index.loaded:
+        return masterdata_index.lookup(prefix)
+
+    # Chưa nạp được chỉ mục (mất kết nối lúc khởi động) -> truy vấn trực tiếp như cũ
+    row = db.session.execute(text("SELECT sku, weight FROM masterdata WHERE refix = :refix"), {'refix': prefix}).fetchone()
+    return MasterRecord(row[0], row[1], None, None, None, None) if row else None
+
+# --- ĐỌC MÃ VẠCH TRONG RAM (GS1 AI, số kiểm tra SSCC/GTIN, quy tắc prefix theo nhà cung cấp) ---
+# Quy tắc biên dịch một lần khi khởi động (sai cấu hình -> lỗi ngay); mã quét lỗi bị từ chối trước khi tra masterdata
+barcode_reader = BarcodeParser(
+    app.config['BARCODE_PREFIX_RULES'],
+    min_length=app.config['BARCODE_MIN_LENGTH'],
+    max_length=scanned_barcodes.MAX_BARCODE,
+    symbologies=app.config['BARCODE_SYMBOLOGIES'],
+    check_digits=app.config['BARCODE_CHECK_DIGITS']
+)
+
+def parse_barcodes(raws):
+    parsed = barcode_reader.parse_many(raws)
+    for item in parsed:
+        if item.error:
+            worker_metrics.registry.inc('scan_barcode_rejected_total', {'reason': item.reason})
+    return parsed
+
+# --- DANH SÁCH JOB ĐANG MỞ (cache trong RAM, đọc lại khi phiên bản 'jobs' đổi) ---
+job_list_cache = JobListCache(ttl=app.config['JOBS_CACHE_SECONDS'])
+
+def active_job_types():
+    try:
+        return job_list_cache.active(db.session)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Lỗi khi lấy danh sách job: {e}")
+        return []
+
+# --- SỰ KIỆN ĐẨY TỚI TRÌNH DUYỆT (SSE) ---
+with app.app_context():
+    event_bus = EventBus(db.engine, poll_interval=app.config['EVENTS_POLL_SECONDS'],
+                         max_interval=app.config['EVENTS_POLL_MAX_SECONDS'])
+
+# --- SỐ LIỆU VẬN HÀNH (/metrics): thời gian request, số câu SQL/thời gian DB mỗi request, pool kết nối ---
+worker_metrics = metrics.WorkerMetrics(
+    app.config['METRICS_DIR'] or os.path.join(app.instance_path, 'metrics'),
+    flush_interval=app.config['METRICS_FLUSH_SECONDS']
+)
+with app.app_context():
+    worker_metrics.instrument(db.engine)
+
+@app.before_request
+def metrics_request_started():
+    g.metrics_started = time.perf_counter()
+    g.metrics_endpoint = request.endpoint or 'unknown'
+    worker_metrics.request_started(g.metrics_endpoint)
+
+@app.after_request
+def metrics_request_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+@app.teardown_request
+def metrics_request_finished(exc):
+    if 'metrics_started' in g:
+        worker_metrics.request_finished(g.metrics_endpoint, request.method, g.get('metrics_status', 500),
+                                        time.perf_counter() - g.metrics_started)
+
+# --- NHẬT KÝ QUERY CHẬM (kèm EXPLAIN, xem tại /slow-queries) ---
+slow_query_log = SlowQueryLog(
+    SlowQueryStore(app.config['SLOW_QUERY_DB'] or os.path.join(app.instance_path, 'slow_queries.db'),
+                   max_samples=app.config['SLOW_QUERY_MAX_SAMPLES']),
+    threshold_ms=app.config['SLOW_QUERY_MS'],
+    explain=app.config['SLOW_QUERY_EXPLAIN'],
+    route=lambda: (request.endpoint or 'unknown') if has_request_context() else 'background'
+)
+if app.config['SLOW_QUERY_MS'] > 0:
+    with app.app_context():
+        slow_query_log.instrument(db.engine)
+
+# --- TEM PDF PHÍA SERVER (process pool + cache trên đĩa) ---
+label_pool = labels.LabelPool(app.config['LABEL_WORKERS'], app.config['LABEL_POOL_MIN_PAGES'])
+label_cache = labels.LabelCache(
+    app.config['LABEL_CACHE_DIR'] or os.path.join(app.instance_path, 'label_cache'),
+    max_files=app.config['LABEL_CACHE_MAX_FILES']
+)
+
+# --- CACHE KẾT QUẢ API ĐỌC NHIỀU (dùng chung giữa các worker, khóa theo phiên bản job) ---
+response_cache = ResponseCache(open_store(
+    app.config['RESPONSE_CACHE_URL'],
+    os.path.join(app.instance_path, 'response_cache.db'),
+    max_entries=app.config['RESPONSE_CACHE_MAX_ENTRIES']
+))
+
+def cached_job_response(endpoint, job_type, compute, *parts, extra_versions=()):
+    # Đọc phiên bản trước khi tính: ghi xen giữa chỉ làm bản cache mới hơn khóa, không bao giờ cũ hơn
+    ensure_counters(job_type)
+    version = '.'.join(str(v) for v in (counters.job_version(db.session, job_type),) + tuple(extra_versions))
+    payload, status = response_cache.get_or_compute(response_cache.scope(endpoint, job_type, *parts), version, compute)
+    response = jsonify(payload)
+    response.headers['X-Response-Cache'] = status
+    return response
+
+# --- CHỐNG TRÙNG SCAN THEO scan_id (máy quét gửi lại sau khi mất mạng) ---
+scan_dedup = ScanLedger(ttl=app.config['SCAN_DEDUP_SECONDS'])
+
+def replayed_scans(scan_ids):
+    # Kết quả đã trả cho các scan_id đã xử lý -> trả lại nguyên kết quả, không gán thêm thùng
+    current_user = session.get('user')
+    replays = {}
+    for scan_id, (user, result) in scan_ledger.lookup(db.session, scan_ids).items():
+        if user != current_user:
+            replays[scan_id] = {'success': False, 'message': 'Lỗi: scan_id đã được dùng bởi tài khoản khác'}
+            continue
+        replays[scan_id] = dict(result, replayed=True)
+        worker_metrics.registry.inc('scan_replays_total', {})
+    return replays
+
+def purge_scan_ledger():
+    # Dọn sổ chống trùng định kỳ, trước khi gán thùng (lỗi ở đây không làm mất kết quả scan đã commit)
+    if scan_dedup.purge_due():
+        scan_dedup.purge(db.session)
+        db.session.commit()
+
+# --- CHỐNG QUÉT LẠI CÙNG MỘT THÙNG (sổ scanned_barcodes + Bloom filter theo job trong RAM) ---
+barcode_filters = BarcodeFilters(max_jobs=app.config['BARCODE_FILTER_JOBS'])
+
+def find_scanned(job_type, barcodes):
+    # {barcode: pallet} của các mã đã gán trong job - mã chưa từng thấy không tốn query
+    if not app.config['SCAN_REJECT_DUPLICATES']:
+        return {}
+    return barcode_filters.scanned(db.session, job_type, barcodes)
+
+def duplicate_result(barcode, pallet):
+    worker_metrics.registry.inc('scan_duplicates_total', {})
+    return {'success': False, 'duplicate': True, 'message': scanned_barcodes.duplicate_message(barcode, pallet)}
+
+# --- GHI NHẬN THAY ĐỔI SAU KHI GÁN/GỠ THÙNG (cùng transaction, caller commit) ---
+def record_claims(job_type, pallet_no, claimed):
+    counters.apply_claims(db.session, job_type, pallet_no, [row.sku for row in claimed])
+    stats.apply_claims(db.session, job_type, pallet_no, claimed)
+    productivity.apply_claims(db.session, job_type, claimed)
+    if claimed:
+        pallets.add_cartons(db.session, job_type, pallet_no, claimed[0].pallet_type, len(claimed))
+
+def record_releases(job_type, pallet_no, sku, qty, released):
+    # released: {(jobno, pallet_type): số thùng} đọc trước khi gỡ - lệch với rowcount (bị gỡ đồng thời) thì đọc lại pallet
+    counters.apply_releases(db.session, job_type, pallet_no, sku, qty)
+    pallets.remove_cartons(db.session, job_type, pallet_no, qty)
+    # Thùng gỡ khỏi pallet được quét lại -> bỏ các mã scan gần nhất của pallet + SKU khỏi sổ
+    barcodes = scanned_barcodes.release(db.session, job_type, pallet_no, sku, qty)
+    if scan_queue is not None:
+        scan_queue.forget_barcodes(job_type, barcodes)
+    if sum(released.values()) == qty:
+        stats.apply_releases(db.session, job_type, pallet_no, released)
+    else:
+        stats.resync_pallet(db.session, job_type, pallet_no, [jobno for jobno, _ in released])
+
+def record_import(importer):
+    # Thùng mới nạp -> cộng vào tổng chờ scan của từng job
+    for job_type, sku_counts in importer.per_job.items():
+        counters.add_totals(db.session, job_type, sku_counts)
+    stats.add_waiting(db.session, importer.per_jobno)
+    jobs.register(db.session, importer.per_jobno)
+
+def run_import(stream, filename, job_type=None, jobno=None, progress=None):
+    importer = ScanfileImporter(db.session, job_type=job_type, jobno=jobno,
+                                chunk_size=app.config['IMPORT_CHUNK_SIZE'], progress=progress)
+    summary = importer.run(iter_file_rows(stream, filename))
+    record_import(importer)
+    db.session.commit()
+    return summary
+
+def run_masterdata_import(stream, filename, allow_collisions=False, dry_run=False):
+    importer = MasterdataImporter(db.session, chunk_size=app.config['IMPORT_CHUNK_SIZE'], allow_collisions=allow_collisions)
+    summary = importer.run(iter_file_rows(stream, filename))
+    if dry_run:
+        # Chỉ kiểm tra (prefix trùng, dòng lỗi) - không ghi gì
+        db.session.rollback()
+        summary['dry_run'] = True
+        return summary
+    db.session.commit()
+    # Worker hiện tại nạp lại ngay; worker khác nhận thay đổi qua watermark updated_at
+    masterdata_index.load(db.session)
+    return summary
+
+def pallet_limit(job_type):
+    return pallets.pallet_limit(db.session, job_type, app.config['PALLETS_PER_JOB'])
+
+def pallet_options(job_type):
+    # Danh sách pallet của job kèm trạng thái (Trống/Đang dùng/Đã xong/Đã in) từ sổ pallet
+    return pallets.options(pallets.job_pallets(db.session, job_type), pallet_limit(job_type))
+
+def job_etag(job_type, version):
+    return hashlib.sha1(f"{job_type}:{version}".encode('utf-8')).hexdigest()[:20]
+
+def ensure_counters(job_type):
+    # Job chưa có bộ đếm (dữ liệu cũ) -> tính lại một lần rồi lưu
+    if counters.ensure_job(db.session, job_type):
+        db.session.commit()
+
+# --- GHI SCAN QUA HÀNG ĐỢI (SCAN_WRITE_BEHIND=1): trả lời ngay, luồng nền gán thùng vào DB chính theo lô ---
+@contextmanager
+def writer_session():
+    with app.app_context():
+        try:
+            yield db.session
+        finally:
+            db.session.remove()
+
+scan_queue = None
+scan_writer = None
+if app.config['SCAN_WRITE_BEHIND']:
+    scan_queue = ScanQueue(
+        app.config['SCAN_QUEUE_DB'] or os.path.join(app.instance_path, 'scan_queue.db'),
+        max_depth=app.config['SCAN_QUEUE_MAX_DEPTH'],
+        refresh_seconds=app.config['SCAN_QUEUE_REFRESH_SECONDS'],
+        keep_seconds=app.config['SCAN_DEDUP_SECONDS']
+    )
+    scan_writer = ScanWriter(scan_queue, writer_session, record_claims,
+                             flush_ms=app.config['SCAN_QUEUE_FLUSH_MS'], batch_size=app.config['SCAN_QUEUE_BATCH'],
+                             registry=worker_metrics.registry)
+
+@app.before_request
+def start_scan_writer():
+    # Khởi động khi worker nhận request đầu tiên (không chạy trong lệnh CLI); ghi tiếp hàng đợi còn lại sau crash
+    if scan_writer is not None:
+        scan_writer.ensure_started()
+
+def queue_waiting(job_type):
+    # Tồn chờ theo SKU từ bộ đếm (1 query) để nạp vào hàng đợi
+    ensure_counters(job_type)
+    return dict(counters.remaining_skus(db.session, job_type))
+
+def queue_scans(job_type, pallet_no, pallet_type, scans):
+    # scans: [(scan_id hoặc None, sku, barcode)] -> kết quả từng lần quét, không chạm DB chính (trừ khi nạp lại tồn)
+    current_user = session.get('user')
+    now = datetime.now()
+    check = app.config['SCAN_REJECT_DUPLICATES']
+    items = [{'scan_id': scan_id or uuid.uuid4().hex, 'job_type': job_type, 'sku': sku, 'pallet_no': pallet_no,
+              'pallet_type': pallet_type, 'userscan': current_user, 'time_scan': now, 'barcode': barcode if check else None}
+             for scan_id, sku, barcode in scans]
+    results = scan_queue.accept(items, queue_waiting, find_scanned=find_scanned if check else None)
+    accepted = sum(1 for r in results if r['success'] and not r.get('replayed'))
+    refused = sum(1 for r in results if r.get('busy'))
+    duplicates = sum(1 for r in results if r.get('duplicate'))
+    if duplicates:
+        worker_metrics.registry.inc('scan_duplicates_total', {}, duplicates)
+    if accepted:
+        worker_metrics.registry.inc('scan_queue_accepted_total', {}, accepted)
+        scan_writer.notify()
+    if refused:
+        worker_metrics.registry.inc('scan_queue_refused_total', {}, refused)
+    return results
+
 @app.route("/health")
 def health_check():
     try:
@@ -102,6 +441,15 @@ def health_check():
         }), 500
 
 
+@app.route("/metrics")
+def metrics_page():
+    # Định dạng Prometheus, đã cộng số liệu của mọi worker. Đặt METRICS_TOKEN để yêu cầu Authorization: Bearer
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return Response("unauthorized\n", status=401, mimetype='text/plain')
+    return Response(worker_metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
 # --- DECORATOR KIỂM TRA ĐĂNG NHẬP ---
 def login_required(f):
     @wraps(f)
@@ -205,15 +553,8 @@ def home():
 @login_required
 @role_required(['admin', 'scanner'])
 def scan_page():
-    job_types = []
-    try:
-        # Lấy danh sách jobno_type từ bảng scanfile, loại bỏ giá trị trùng và null
-        result = db.session.execute(text("SELECT DISTINCT jobno_type FROM scanfile WHERE jobno_type IS NOT NULL"))
-        job_types = [row[0] for row in result]
-    except Exception as e:
-        print(f"Lỗi khi lấy jobno_type: {e}")
-        # Fallback: Dùng danh sách mặc định nếu bảng chưa có hoặc lỗi kết nối
-        job_types = ['Normal', 'Urgent', 'Sample']
+    # Danh sách job đang mở (bảng jobs, cache trong RAM)
+    job_types = active_job_types()
 
     # Lọc danh sách Pallet: Loại bỏ các số pallet mà pallet = jobno trong database
     available_pallets = []
@@ -221,23 +562,15 @@ def scan_page():
         # Lấy job mặc định (đầu tiên) để lọc pallet khả dụng ban đầu
         default_job = job_types[0] if job_types else ''
 
-        # Tìm các pallet đang được sử dụng bởi Job HIỆN TẠI
-        current_query = text("SELECT DISTINCT pallet FROM scanfile WHERE jobno_type = :job_type AND pallet IS NOT NULL AND pallet != ''")
-        current_res = db.session.execute(current_query, {'job_type': default_job})
-        current_set = {str(row[0]) for row in current_res}
-        
-        # Tạo danh sách 1-25, trừ những số bị loại
-        available_pallets = []
-        for i in range(1, 26):
-            s_i = str(i)
-            status = " (Đang dùng)" if s_i in current_set else " (Trống)"
-            available_pallets.append({'no': i, 'label': f"{i}{status}"})
+        # Trạng thái pallet của Job HIỆN TẠI (từ sổ pallet)
+        available_pallets = pallet_options(default_job)
     except Exception as e:
         print(f"Lỗi lọc pallet: {e}")
-        available_pallets = [{'no': i, 'label': str(i)} for i in range(1, 26)]
+        available_pallets = [{'no': i, 'label': str(i)} for i in range(1, app.config['PALLETS_PER_JOB'] + 1)]
 
     # Render trang scan.html cho máy quét
-    return render_template('scan.html', job_types=job_types, available_pallets=available_pallets)
+    return render_template('scan.html', job_types=job_types, available_pallets=available_pallets, scan_batch_max=app.config['SCAN_BATCH_MAX'],
+                           scan_pipeline_depth=app.config['SCAN_PIPELINE_DEPTH'])
 
 @app.route('/api/job_stats', methods=['POST'])
 def job_stats():
@@ -245,106 +578,234 @@ def job_stats():
     job_type = data.get('job_type', '')
     
     try:
-        total_query = text("SELECT COUNT(id) FROM scanfile WHERE jobno_type = :job_type")
-        total_res = db.session.execute(total_query, {'job_type': job_type}).fetchone()
-        total_sscc = total_res[0] if total_res else 0
-
-        scanned_query = text("SELECT COUNT(id) FROM scanfile WHERE jobno_type = :job_type AND pallet !=''")
-        scanned_res = db.session.execute(scanned_query, {'job_type': job_type}).fetchone()
-        scanned_sscc = scanned_res[0] if scanned_res else 0
-
-        remain_query = text("SELECT COUNT(id) FROM scanfile WHERE jobno_type = :job_type AND pallet=''")
-        remain_res = db.session.execute(remain_query, {'job_type': job_type}).fetchone()
-        remain_sscc = remain_res[0] if remain_res else 0
+        # Đọc O(1) từ bộ đếm thay vì COUNT trên scanfile
+        ensure_counters(job_type)
+        total_sscc, scanned_sscc = counters.job_counts(db.session, job_type)
+        remain_sscc = total_sscc - scanned_sscc
         
         return jsonify({'success': True, 'total_sscc': total_sscc, 'scanned_sscc': scanned_sscc, 'remain_sscc': remain_sscc})
     except Exception as e:
+        db.session.rollback()
         return jsonify({'success': False, 'message': str(e)})
 
 @app.route('/api/scan', methods=['POST'])
 def process_scan():
     data = request.get_json()
-    barcode = data.get('barcode', '')
     job_type = data.get('job_type', '')
     pallet_no = data.get('pallet_no', '')
     pallet_type = data.get('pallet_type', '')
+    # Mã do máy quét tự sinh cho mỗi lần quét - gửi lại cùng scan_id không gán thêm thùng
+    scan_id = data.get('scan_id')
 
-    if not barcode or len(barcode) < 10:
-        return jsonify({'success': False, 'message': 'Mã vạch không hợp lệ (cần >= 10 ký tự)'})
+    # Kiểm tra mã + lấy prefix theo BARCODE_PREFIX_RULES trong RAM (mã quét lỗi không chạm DB)
+    parsed = parse_barcodes([data.get('barcode', '')])[0]
+    if parsed.error:
+        return jsonify({'success': False, 'message': parsed.error})
+    if scan_id is not None and not scan_ledger.valid_scan_id(scan_id):
+        return jsonify({'success': False, 'message': 'scan_id không hợp lệ'})
 
-    # Logic: Cắt bên phải vị trí số 1 lấy 5 ký tự
-    extracted_prefix = barcode[-6:-1]
+    barcode = parsed.barcode
+    extracted_prefix = parsed.prefix
 
     try:
-        # 1. Tìm SKU trong masterdata dựa trên prefix (refix)
-        # Giả sử tên cột trong DB là 'prefix'. Nếu tên là 'refix', hãy đổi lại ở đây.
-        master_query = text("SELECT sku FROM masterdata WHERE refix = :refix")
-        master_res = db.session.execute(master_query, {'refix': extracted_prefix}).fetchone()
+        # 0. Lần quét đã xử lý (phản hồi bị mất) -> trả lại kết quả cũ (chế độ hàng đợi: tra trong hàng đợi)
+        if scan_id and scan_queue is None:
+            purge_scan_ledger()
+            replay = replayed_scans([scan_id]).get(scan_id)
+            if replay:
+                return jsonify(replay)
+
+        # 1. Tìm SKU trong masterdata dựa trên prefix (refix) - tra trong RAM, không round trip DB
+        master_res = lookup_masterdata(extracted_prefix)
 
         if not master_res:
             return jsonify({'success': False, 'message': f'Lỗi: Prefix {extracted_prefix} không có trong Masterdata'})
         
-        sku = master_res[0]
-
-        # 2. Kiểm tra trong scanfile: khớp SKU, Job Type và chưa có Pallet (NULL hoặc rỗng)
-        scan_query = text("""
-            SELECT id FROM scanfile 
-            WHERE sku = :sku 
-            AND jobno_type = :job_type 
-            AND (pallet IS NULL OR pallet = '') 
-            LIMIT 1
-        """)
-        scan_res = db.session.execute(scan_query, {'sku': sku, 'job_type': job_type}).fetchone()
-
-        if scan_res:
-            # 3. Tìm thấy -> Cập nhật Pallet (Ghi nhận quét thành công)
-            row_id = scan_res[0]
-            current_user = session.get('user')
-            update_query = text("UPDATE scanfile SET pallet = :pallet, pallet_type = :pallet_type, userscan = :userscan, time_scan = :time_scan WHERE id = :id")
-            db.session.execute(update_query, {
-                'pallet': pallet_no, 
-                'pallet_type': pallet_type, 
-                'userscan': current_user,
-                'time_scan': datetime.now(),
-                'id': row_id
-            })
-            db.session.commit()
-
-            # Đếm lại tổng số lượng trên Pallet này để hiển thị
-            count_query = text("SELECT COUNT(id) FROM scanfile WHERE jobno_type = :job_type AND pallet = :pallet")
-            count_res = db.session.execute(count_query, {'job_type': job_type, 'pallet': pallet_no}).fetchone()
-            pallet_count = count_res[0] if count_res else 0
-            
-            # Lấy thống kê Job để cập nhật giao diện
-            stats_query = text("""
-                SELECT 
-                    COUNT(id) as total,
-                    COUNT(CASE WHEN pallet IS NOT NULL AND pallet != '' THEN 1 END) as scanned
-                FROM scanfile 
-                WHERE jobno_type = :job_type
-            """)
-            stats_res = db.session.execute(stats_query, {'job_type': job_type}).fetchone()
-            total_sscc = stats_res[0] if stats_res else 0
-            scanned_sscc = stats_res[1] if stats_res else 0
+        sku = master_res.sku
+
+        if scan_queue is not None:
+            # Chế độ hàng đợi: trừ tồn cục bộ + ghi hàng đợi rồi trả lời ngay (không có bộ đếm pallet/job)
+            result = queue_scans(job_type, pallet_no, pallet_type, [(scan_id, sku, barcode)])[0]
+            if result.get('busy'):
+                return jsonify(result), 503, {'Retry-After': '1'}
+            return jsonify(result)
+
+        # 1b. Thùng này đã được scan trong job -> báo trùng, không chạm scanfile
+        scanned = find_scanned(job_type, [barcode])
+        if barcode in scanned:
+            return jsonify(duplicate_result(barcode, scanned[barcode]))
+
+        # 2+3. Gán nguyên tử 1 thùng khớp SKU, Job Type và chưa có Pallet (NULL hoặc rỗng).
+        # Ghi mã vào sổ trước: hai worker cùng nhận một mã thì request sau lỗi khóa chính ngay tại đây
+        now = datetime.now()
+        if app.config['SCAN_REJECT_DUPLICATES']:
+            scanned_barcodes.record(db.session, job_type, [(barcode, sku, pallet_no, session.get('user'), now)])
+        claimed = claim_cartons(db.session, job_type, sku, 1, pallet_no, pallet_type,
+                                userscan=session.get('user'), time_scan=now)
+
+        if claimed:
+            record_claims(job_type, pallet_no, claimed)
+
+            # Tổng số lượng trên Pallet + thống kê Job từ bộ đếm (1 query, không COUNT scanfile),
+            # đọc trong transaction để ghi vào sổ chống trùng cùng lúc với việc gán thùng
+            pallet_count, total_sscc, scanned_sscc = counters.scan_summary(db.session, job_type, pallet_no)
             remain_sscc = total_sscc - scanned_sscc
+            result = {'success': True, 'sku': sku, 'message': 'OK', 'pallet_count': pallet_count, 'total_sscc': total_sscc, 'scanned_sscc': scanned_sscc, 'remain_sscc': remain_sscc}
+            if scan_id:
+                scan_ledger.record(db.session, [(scan_id, result)], job_type, session.get('user'))
+            db.session.commit()
+            barcode_filters.add(job_type, [barcode])
 
-            return jsonify({'success': True, 'sku': sku, 'message': 'OK', 'pallet_count': pallet_count, 'total_sscc': total_sscc, 'scanned_sscc': scanned_sscc, 'remain_sscc': remain_sscc})
+            return jsonify(result)
         else:
+            db.session.rollback()
             return jsonify({'success': False, 'message': f'Lỗi: Không tìm thấy dữ liệu chờ cho SKU {sku} (Job: {job_type})'})
 
+    except IntegrityError as e:
+        # Cùng scan_id (hoặc cùng mã vạch) gửi song song và request kia đã commit trước -> thùng vừa gán bị hoàn lại,
+        # trả kết quả của request kia / báo trùng
+        db.session.rollback()
+        replay = replayed_scans([scan_id]).get(scan_id) if scan_id else None
+        if replay:
+            return jsonify(replay)
+        scanned = scanned_barcodes.find(db.session, job_type, [barcode])
+        if barcode in scanned:
+            return jsonify(duplicate_result(barcode, scanned[barcode]))
+        return jsonify({'success': False, 'message': f'Lỗi Server: {str(e)}'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': f'Lỗi Server: {str(e)}'})
 
+@app.route('/api/scan_batch', methods=['POST'])
+def process_scan_batch():
+    data = request.get_json()
+    barcodes = data.get('barcodes') or []
+    job_type = data.get('job_type', '')
+    pallet_no = data.get('pallet_no', '')
+    pallet_type = data.get('pallet_type', '')
+    # scan_id của từng mã (cùng thứ tự barcodes, tùy chọn) - gửi lại cả lô không gán thêm thùng
+    scan_ids = data.get('scan_ids') or []
+
+    if not barcodes:
+        return jsonify({'success': False, 'message': 'Không có mã vạch nào'})
+    if len(barcodes) > app.config['SCAN_BATCH_MAX']:
+        return jsonify({'success': False, 'message': f"Tối đa {app.config['SCAN_BATCH_MAX']} mã vạch mỗi lần"})
+    if scan_ids and (len(scan_ids) != len(barcodes) or len(set(scan_ids)) != len(scan_ids)
+                     or not all(scan_ledger.valid_scan_id(scan_id) for scan_id in scan_ids)):
+        return jsonify({'success': False, 'message': 'scan_ids không hợp lệ (mỗi mã vạch một scan_id khác nhau)'})
+
+    # 1. Đọc mã + tra prefix trong RAM cho cả lô, gom các mã hợp lệ theo SKU (giữ thứ tự quét)
+    results = [None] * len(barcodes)
+    wanted = {}
+    parsed = parse_barcodes(barcodes)
+    barcodes = [item.barcode for item in parsed]
+    for i, item in enumerate(parsed):
+        if item.error:
+            results[i] = {'barcode': item.barcode, 'success': False, 'message': item.error}
+            continue
+        extracted_prefix = item.prefix
+        master_res = lookup_masterdata(extracted_prefix)
+        if not master_res:
+            results[i] = {'barcode': item.barcode, 'success': False, 'message': f'Lỗi: Prefix {extracted_prefix} không có trong Masterdata'}
+            continue
+        wanted.setdefault(master_res.sku, []).append(i)
+
+    try:
+        if scan_queue is not None and wanted:
+            # Chế độ hàng đợi: nhận cả lô vào hàng đợi; có mã bị từ chối vì đầy -> máy quét gửi lại cả lô (cùng scan_ids)
+            idxs = [(i, sku) for sku, sku_idxs in wanted.items() for i in sku_idxs]
+            queued = queue_scans(job_type, pallet_no, pallet_type,
+                                 [(scan_ids[i] if scan_ids else None, sku, barcodes[i]) for i, sku in idxs])
+            for (i, _), result in zip(idxs, queued):
+                results[i] = dict(result, barcode=barcodes[i])
+            if any(result.get('busy') for result in queued):
+                return jsonify({'success': False, 'busy': True, 'message': BUSY_MESSAGE}), 503, {'Retry-After': '1'}
+            return jsonify({'success': True, 'results': results, 'scanned': sum(1 for r in results if r['success'])})
+
+        # Mã đã xử lý ở lần gửi trước (phản hồi bị mất) -> lấy lại kết quả cũ, bỏ khỏi lô cần gán
+        if scan_ids:
+            purge_scan_ledger()
+            replays = replayed_scans(scan_ids)
+            for i, scan_id in enumerate(scan_ids):
+                if scan_id in replays:
+                    results[i] = dict(replays[scan_id], barcode=barcodes[i])
+            wanted = {sku: [i for i in idxs if scan_ids[i] not in replays] for sku, idxs in wanted.items()}
+            wanted = {sku: idxs for sku, idxs in wanted.items() if idxs}
+
+        # Mã đã scan trong job, hoặc lặp lại trong cùng lô (giữ lần đầu) -> báo trùng, bỏ khỏi lô cần gán
+        if wanted and app.config['SCAN_REJECT_DUPLICATES']:
+            scanned = find_scanned(job_type, [barcodes[i] for idxs in wanted.values() for i in idxs])
+            seen = set()
+            for sku, idxs in wanted.items():
+                kept = []
+                for i in idxs:
+                    if barcodes[i] in scanned:
+                        results[i] = dict(duplicate_result(barcodes[i], scanned[barcodes[i]]), barcode=barcodes[i])
+                    elif barcodes[i] in seen:
+                        results[i] = dict(duplicate_result(barcodes[i], pallet_no), barcode=barcodes[i])
+                    else:
+                        seen.add(barcodes[i])
+                        kept.append(i)
+                wanted[sku] = kept
+            wanted = {sku: idxs for sku, idxs in wanted.items() if idxs}
+
+        if wanted:
+            # 2. Mỗi SKU một câu claim nguyên tử, tất cả trong một transaction
+            current_user = session.get('user')
+            now = datetime.now()
+            for sku, idxs in wanted.items():
+                claimed = claim_cartons(db.session, job_type, sku, len(idxs), pallet_no, pallet_type,
+                                        userscan=current_user, time_scan=now)
+                record_claims(job_type, pallet_no, claimed)
+                for n, i in enumerate(idxs):
+                    if n < len(claimed):
+                        results[i] = {'barcode': barcodes[i], 'success': True, 'sku': sku, 'message': 'OK'}
+                    else:
+                        results[i] = {'barcode': barcodes[i], 'success': False, 'sku': sku, 'message': f'Lỗi: Không tìm thấy dữ liệu chờ cho SKU {sku} (Job: {job_type})'}
+            done = [i for idxs in wanted.values() for i in idxs if results[i]['success']]
+            if scan_ids:
+                scan_ledger.record(db.session, [(scan_ids[i], results[i]) for i in done], job_type, current_user)
+            if app.config['SCAN_REJECT_DUPLICATES']:
+                scanned_barcodes.record(db.session, job_type,
+                                        [(barcodes[i], results[i]['sku'], pallet_no, current_user, now) for i in done])
+            # 3. Commit một lần cho cả lô
+            db.session.commit()
+            barcode_filters.add(job_type, [barcodes[i] for i in done])
+
+        # 4. Bộ đếm cuối cùng của Pallet/Job cho giao diện
+        ensure_counters(job_type)
+        pallet_count, total_sscc, scanned_sscc = counters.scan_summary(db.session, job_type, pallet_no)
+
+        return jsonify({
+            'success': True,
+            'results': results,
+            'scanned': sum(1 for r in results if r['success']),
+            'pallet_count': pallet_count,
+            'total_sscc': total_sscc,
+            'scanned_sscc': scanned_sscc,
+            'remain_sscc': total_sscc - scanned_sscc
+        })
+    except IntegrityError:
+        # Cùng lô (hoặc cùng mã vạch) đang được xử lý song song -> hoàn lại, máy quét gửi lại và nhận kết quả đã ghi / báo trùng
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Lỗi: Lô mã vạch đang được xử lý, vui lòng gửi lại'})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Lỗi Server: {str(e)}'})
+
+def history_sql(table):
+    return f"SELECT pallet, sku, COUNT(sscc) as qty, MAX(userscan) FROM {table} WHERE jobno_type = :job_type AND (pallet IS NOT NULL AND pallet != '') GROUP BY pallet, sku ORDER BY pallet DESC, sku ASC"
+
 @app.route('/api/get_history', methods=['POST'])
 def get_history():
     data = request.get_json()
     job_type = data.get('job_type', '')
     
-    try:
+    def compute():
         # Lấy danh sách SKU đã có pallet thuộc job_type, group by Pallet, SKU và count SSCC
         # Thêm MAX(userscan) để lấy tên người thực hiện
-        query = text("SELECT pallet, sku, COUNT(sscc) as qty, MAX(userscan) FROM scanfile WHERE jobno_type = :job_type AND (pallet IS NOT NULL AND pallet != '') GROUP BY pallet, sku ORDER BY pallet DESC, sku ASC")
+        # Job đã lưu trữ -> đọc từ scanfile_archive
+        query = text(history_sql(archive.table_for(db.session, job_type)))
         result = db.session.execute(query, {'job_type': job_type})
         
         history = []
@@ -355,10 +816,71 @@ def get_history():
                 'qty': row[2],
                 'userscan': row[3] if row[3] else ''
             })
-        return jsonify({'success': True, 'history': history})
+        return {'success': True, 'history': history}
+
+    try:
+        return cached_job_response('get_history', job_type, compute)
     except Exception as e:
+        db.session.rollback()
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/api/job_snapshot', methods=['GET'])
+def job_snapshot():
+    # Toàn bộ trạng thái màn hình scan của một Job trong 1 request (thay cho 6 API riêng lẻ)
+    job_type = request.args.get('job_type', '')
+
+    try:
+        ensure_counters(job_type)
+        # Job chưa đổi kể từ lần trước -> 304, không đọc/tổng hợp gì thêm
+        etag = job_etag(job_type, counters.job_version(db.session, job_type))
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+
+        total_sscc = scanned_sscc = version = 0
+        pallet_counts = {}
+        remain_skus = []
+        cells = []
+        for pallet, sku, total, scanned, row_version in counters.job_rows(db.session, job_type):
+            if pallet == '' and sku == '':
+                total_sscc, scanned_sscc, version = total, scanned, row_version
+            elif pallet == '':
+                if total > scanned:
+                    remain_skus.append({'sku': sku, 'qty': total - scanned})
+            elif sku == '':
+                if scanned > 0:
+                    pallet_counts[pallet] = scanned
+            elif scanned > 0:
+                cells.append({'pallet': pallet, 'sku': sku, 'qty': scanned})
+
+        remain_skus.sort(key=lambda item: item['sku'])
+        # Cùng thứ tự với get_history: pallet giảm dần, SKU tăng dần
+        cells.sort(key=lambda item: item['sku'])
+        cells.sort(key=lambda item: item['pallet'], reverse=True)
+
+        response = jsonify({
+            'success': True,
+            'job_type': job_type,
+            'version': version,
+            'total_sscc': total_sscc,
+            'scanned_sscc': scanned_sscc,
+            'remain_sscc': total_sscc - scanned_sscc,
+            'pallets': pallet_options(job_type),
+            'pallet_counts': pallet_counts,
+            'remain_skus': remain_skus,
+            'history': cells
+        })
+        response.set_etag(job_etag(job_type, version))
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
+
+DELETE_SCAN_SELECT = "SELECT id, jobno, pallet_type FROM scanfile WHERE jobno_type = :job_type AND pallet = :pallet AND sku = :sku LIMIT :limit"
+
 @app.route('/api/delete_scan', methods=['POST'])
 def delete_scan():
     data = request.get_json()
@@ -373,23 +895,32 @@ def delete_scan():
             qty = int(quantity)
             if qty > 0:
                 # Lấy danh sách ID cần xóa (giới hạn theo số lượng)
-                select_query = text("SELECT id FROM scanfile WHERE jobno_type = :job_type AND pallet = :pallet AND sku = :sku LIMIT :limit")
-                ids_res = db.session.execute(select_query, {'job_type': job_type, 'pallet': pallet, 'sku': sku, 'limit': qty})
+                select_query = text(DELETE_SCAN_SELECT)
+                ids_res = db.session.execute(select_query, {'job_type': job_type, 'pallet': pallet, 'sku': sku, 'limit': qty}).fetchall()
                 ids = [row[0] for row in ids_res]
+                released = Counter((row[1], row[2]) for row in ids_res)
                 
                 if not ids:
                     return jsonify({'success': False, 'message': 'Không tìm thấy dữ liệu để xóa'})
 
-                # Xóa (update về null) các ID này
-                update_query = text("UPDATE scanfile SET pallet = '', pallet_type = '' WHERE id IN :ids")
+                # Xóa (update về null) các ID này - điều kiện pallet để chỉ đếm đúng số dòng thực sự gỡ
+                update_query = text("UPDATE scanfile SET pallet = '', pallet_type = '' WHERE id IN :ids AND jobno_type = :job_type AND pallet = :pallet")
                 update_query = update_query.bindparams(bindparam('ids', expanding=True))
-                db.session.execute(update_query, {'ids': ids})
+                result = db.session.execute(update_query, {'ids': ids, 'job_type': job_type, 'pallet': pallet})
+                record_releases(job_type, pallet, sku, result.rowcount, released)
                 db.session.commit()
-                return jsonify({'success': True, 'message': f'Đã xóa {len(ids)} thùng.'})
+                return jsonify({'success': True, 'message': f'Đã xóa {result.rowcount} thùng.'})
         
         # Mặc định: Xóa hết nếu không nhập số lượng
+        released_query = text("""
+            SELECT jobno, pallet_type, COUNT(id) FROM scanfile
+            WHERE jobno_type = :job_type AND pallet = :pallet AND sku = :sku
+            GROUP BY jobno, pallet_type
+        """)
+        released = {(row[0], row[1]): row[2] for row in db.session.execute(released_query, {'job_type': job_type, 'pallet': pallet, 'sku': sku})}
         query = text("UPDATE scanfile SET pallet = NULL, pallet_type = NULL WHERE jobno_type = :job_type AND pallet = :pallet AND sku = :sku")
-        db.session.execute(query, {'job_type': job_type, 'pallet': pallet, 'sku': sku})
+        result = db.session.execute(query, {'job_type': job_type, 'pallet': pallet, 'sku': sku})
+        record_releases(job_type, pallet, sku, result.rowcount, released)
         db.session.commit()
         return jsonify({'success': True, 'message': 'Đã xóa tất cả thùng của SKU này.'})
     except Exception as e:
@@ -399,33 +930,104 @@ def delete_scan():
 @app.route('/api/check_barcode', methods=['POST'])
 def check_barcode():
     data = request.get_json()
-    barcode = data.get('barcode', '')
     job_type = data.get('job_type', '')
 
-    if not barcode or len(barcode) < 10:
-        return jsonify({'success': False, 'message': 'Mã vạch không hợp lệ'})
-
-    # Logic: Cắt bên phải vị trí số 1 lấy 5 ký tự (giống process_scan)
-    extracted_prefix = barcode[-6:-1]
+    # Cùng quy tắc đọc mã với process_scan
+    parsed = parse_barcodes([data.get('barcode', '')])[0]
+    if parsed.error:
+        return jsonify({'success': False, 'message': parsed.error})
+    extracted_prefix = parsed.prefix
 
     try:
-        master_query = text("SELECT sku FROM masterdata WHERE refix = :refix")
-        master_res = db.session.execute(master_query, {'refix': extracted_prefix}).fetchone()
+        master_res = lookup_masterdata(extracted_prefix)
 
         if not master_res:
             return jsonify({'success': False, 'message': f'Prefix {extracted_prefix} không có trong Masterdata'})
         
-        sku = master_res[0]
+        sku = master_res.sku
 
         # Đếm số lượng khả dụng (chưa có pallet) của SKU này trong Job
-        count_query = text("SELECT COUNT(id) FROM scanfile WHERE sku = :sku AND jobno_type = :job_type AND (pallet IS NULL OR pallet = '')")
-        count_res = db.session.execute(count_query, {'sku': sku, 'job_type': job_type}).fetchone()
-        count = count_res[0] if count_res else 0
+        ensure_counters(job_type)
+        count = counters.sku_remaining(db.session, job_type, sku)
 
         return jsonify({'success': True, 'sku': sku, 'count': count})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/masterdata_index', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def masterdata_index_stats():
+    try:
+        # ?reload=1 để nạp lại toàn bộ ngay (sau khi sửa masterdata thủ công)
+        if request.args.get('reload'):
+            masterdata_index.load(db.session)
+        # Kèm thống kê đọc mã của worker này (mã bị từ chối theo lý do, số lần khớp từng quy tắc prefix)
+        return jsonify({'success': True, 'stats': masterdata_index.stats(), 'barcodes': barcode_reader.stats()})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/response_cache', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def response_cache_stats():
+    # Tỉ lệ hit của worker hiện tại và của kho dùng chung; ?clear=1 để xóa toàn bộ cache
+    try:
+        if request.args.get('clear'):
+            response_cache.clear()
+        return jsonify({'success': True, 'stats': response_cache.stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/scan_queue', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def scan_queue_stats():
+    # Hàng đợi ghi scan (SCAN_WRITE_BEHIND=1): số scan chờ ghi, worker đang ghi, các scan không gán được
+    if scan_queue is None:
+        return jsonify({'success': True, 'enabled': False})
+    try:
+        return jsonify({'success': True, 'enabled': True, 'queue': scan_queue.stats(), 'writer': scan_writer.stats()})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/api/import_scanfile', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def import_scanfile():
+    # Nạp dữ liệu job (CSV/XLSX) - form-data: file, job_type (tùy chọn, ghi đè cột jobno_type), jobno (tùy chọn)
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'success': False, 'message': 'Vui lòng chọn file CSV/XLSX'})
+    try:
+        summary = run_import(upload.stream, upload.filename,
+                             job_type=request.form.get('job_type') or None, jobno=request.form.get('jobno') or None)
+        return jsonify({'success': True, 'message': f"Đã nạp {summary['inserted']} dòng, bỏ qua {summary['rejected']} dòng.", 'summary': summary})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/import_masterdata', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def import_masterdata():
+    # Upsert masterdata từ file nhà cung cấp - form-data: file, allow_collisions=1, dry_run=1 (tùy chọn)
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'success': False, 'message': 'Vui lòng chọn file CSV/XLSX'})
+    try:
+        summary = run_masterdata_import(upload.stream, upload.filename,
+                                        allow_collisions=bool(request.form.get('allow_collisions')),
+                                        dry_run=bool(request.form.get('dry_run')))
+        message = (f"Thêm {summary['inserted']}, cập nhật {summary['updated']}, bỏ qua {summary['rejected']} SKU. "
+                   f"{summary['collision_count']} prefix trùng.")
+        return jsonify({'success': True, 'message': message, 'summary': summary})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
+
 @app.route('/api/bulk_update', methods=['POST'])
 def bulk_update():
     data = request.get_json()
@@ -436,28 +1038,15 @@ def bulk_update():
     quantity = data.get('quantity')
 
     try:
-        count = 0
-        # Nếu có số lượng cụ thể
-        if quantity:
-            qty = int(quantity)
-            # Lấy danh sách ID cần update (giới hạn theo số lượng)
-            select_query = text("SELECT id FROM scanfile WHERE sku = :sku AND jobno_type = :job_type AND (pallet IS NULL OR pallet = '') LIMIT :limit")
-            ids_res = db.session.execute(select_query, {'sku': sku, 'job_type': job_type, 'limit': qty})
-            ids = [row[0] for row in ids_res]
-            
-            if not ids:
-                 return jsonify({'success': False, 'message': 'Không còn hàng khả dụng để cập nhật'})
-
-            # Update các ID đã chọn
-            update_query = text("UPDATE scanfile SET pallet = :pallet, pallet_type = :pallet_type WHERE id IN :ids")
-            update_query = update_query.bindparams(bindparam('ids', expanding=True))
-            db.session.execute(update_query, {'pallet': pallet_no, 'pallet_type': pallet_type, 'ids': ids})
-            count = len(ids)
-        else:
-            # Cập nhật tất cả (Logic cũ)
-            update_query = text("UPDATE scanfile SET pallet = :pallet, pallet_type = :pallet_type WHERE sku = :sku AND jobno_type = :job_type AND (pallet IS NULL OR pallet = '')")
-            result = db.session.execute(update_query, {'pallet': pallet_no, 'pallet_type': pallet_type, 'sku': sku, 'job_type': job_type})
-            count = result.rowcount
+        # Nếu có số lượng cụ thể thì giới hạn, ngược lại cập nhật tất cả (Logic cũ)
+        limit = int(quantity) if quantity else None
+        claimed = claim_cartons(db.session, job_type, sku, limit, pallet_no, pallet_type)
+        count = len(claimed)
+        record_claims(job_type, pallet_no, claimed)
+
+        if limit and not claimed:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'Không còn hàng khả dụng để cập nhật'})
 
         db.session.commit()
         return jsonify({'success': True, 'message': f'Đã cập nhật {count} thùng SKU {sku} vào Pallet {pallet_no}.', 'count': count, 'sku': sku})
@@ -469,19 +1058,67 @@ def bulk_update():
 def get_pallets():
     job_type = request.args.get('job_type', '')
     try:
-        # Tìm các pallet đang được sử dụng bởi Job HIỆN TẠI
-        current_query = text("SELECT DISTINCT pallet FROM scanfile WHERE jobno_type = :job_type AND pallet IS NOT NULL AND pallet != ''")
-        current_res = db.session.execute(current_query, {'job_type': job_type})
-        current_set = {str(row[0]) for row in current_res}
-        
-        # Tạo danh sách 1-25, trừ những số đã bị sử dụng
-        available_pallets = []
-        for i in range(1, 26):
-            s_i = str(i)
-            status = " (Đang dùng)" if s_i in current_set else " (Trống)"
-            available_pallets.append({'no': i, 'label': f"{i}{status}"})
-        return jsonify({'success': True, 'pallets': available_pallets})
+        # Trạng thái pallet của Job HIỆN TẠI (từ sổ pallet)
+        return jsonify({'success': True, 'pallets': pallet_options(job_type)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/jobs', methods=['GET'])
+@login_required
+def list_jobs():
+    # ?status=active|closed|all - danh sách job kèm thông tin (jobno, tổng thùng, thời điểm tạo/đóng)
+    status = request.args.get('status', jobs.ACTIVE)
+    if status not in jobs.STATUSES + ('all',):
+        return jsonify({'success': False, 'message': 'status không hợp lệ'})
+    try:
+        rows = jobs.list_jobs(db.session, None if status == 'all' else status)
+        return jsonify({'success': True, 'jobs': [{key: exporter.format_value(val) for key, val in row.items()} for row in rows]})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/jobs/status', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def set_job_status():
+    # Đóng job (ẩn khỏi danh sách chọn job) hoặc mở lại
+    data = request.get_json()
+    job_type = data.get('job_type', '')
+    status = data.get('status', '')
+    if status not in jobs.STATUSES:
+        return jsonify({'success': False, 'message': 'status phải là active hoặc closed'})
+    try:
+        if not jobs.get(db.session, job_type):
+            return jsonify({'success': False, 'message': f'Không tìm thấy job {job_type}'})
+        changed = jobs.set_status(db.session, job_type, status)
+        db.session.commit()
+        job_list_cache.invalidate()
+        return jsonify({'success': True, 'changed': changed})
     except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/pallet_limit', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def set_pallet_limit():
+    # Số pallet của một job (job lớn cần 60+ pallet). pallet_count rỗng -> về mặc định PALLETS_PER_JOB
+    data = request.get_json()
+    job_type = data.get('job_type', '')
+    count = data.get('pallet_count')
+    if not job_type:
+        return jsonify({'success': False, 'message': 'Thiếu job_type'})
+    try:
+        count = int(count) if count not in (None, '') else None
+        if count is not None and not 1 <= count <= app.config['PALLETS_MAX']:
+            return jsonify({'success': False, 'message': f"Số pallet phải từ 1 đến {app.config['PALLETS_MAX']}"})
+        pallets.set_limit(db.session, job_type, count)
+        counters.bump_version(db.session, job_type)
+        db.session.commit()
+        return jsonify({'success': True, 'pallet_count': pallet_limit(job_type)})
+    except ValueError:
+        return jsonify({'success': False, 'message': 'pallet_count phải là số'})
+    except Exception as e:
+        db.session.rollback()
         return jsonify({'success': False, 'message': str(e)})
 
 @app.route('/api/pallet_details', methods=['POST'])
@@ -491,16 +1128,10 @@ def pallet_details():
     pallet_no = data.get('pallet_no', '')
 
     try:
-        # Đếm tổng số lượng trên Pallet này
-        count_query = text("SELECT COUNT(id) FROM scanfile WHERE jobno_type = :job_type AND pallet = :pallet")
-        count_res = db.session.execute(count_query, {'job_type': job_type, 'pallet': pallet_no}).fetchone()
-        pallet_count = count_res[0] if count_res else 0
-
-        # Lấy danh sách SKU trên Pallet này
-        sku_query = text("SELECT sku, COUNT(sscc) as qty FROM scanfile WHERE jobno_type = :job_type AND pallet = :pallet GROUP BY sku")
-        sku_res = db.session.execute(sku_query, {'job_type': job_type, 'pallet': pallet_no})
-        
-        skus = [{'sku': row[0], 'qty': row[1]} for row in sku_res]
+        # Đếm tổng số lượng + danh sách SKU trên Pallet này (từ bộ đếm)
+        ensure_counters(job_type)
+        pallet_count = counters.pallet_count(db.session, job_type, pallet_no)
+        skus = [{'sku': sku, 'qty': qty} for sku, qty in counters.pallet_skus(db.session, job_type, pallet_no)]
 
         return jsonify({'success': True, 'pallet_count': pallet_count, 'skus': skus})
     except Exception as e:
@@ -512,37 +1143,32 @@ def sku_details():
     job_type = data.get('job_type', '')
     sku = data.get('sku', '')
 
-    try:
+    def compute():
         # Lấy danh sách các pallet chứa SKU này trong job hiện tại
-        query = text("SELECT pallet, COUNT(sscc) as qty FROM scanfile WHERE jobno_type = :job_type AND sku = :sku AND (pallet IS NOT NULL AND pallet != '') GROUP BY pallet ORDER BY pallet")
-        result = db.session.execute(query, {'job_type': job_type, 'sku': sku})
-        
-        details = [{'pallet': row[0], 'qty': row[1]} for row in result]
-        return jsonify({'success': True, 'sku': sku, 'details': details})
+        details = [{'pallet': pallet, 'qty': qty} for pallet, qty in counters.sku_pallets(db.session, job_type, sku)]
+        return {'success': True, 'sku': sku, 'details': details}
+
+    try:
+        return cached_job_response('sku_details', job_type, compute, sku)
     except Exception as e:
+        db.session.rollback()
         return jsonify({'success': False, 'message': str(e)})
 
 @app.route('/add-product')
 @login_required
 @role_required(['admin', 'printer'])
 def manual_label_page():
-    # Lấy danh sách jobno_type
-    job_types = []
-    try:
-        result = db.session.execute(text("SELECT DISTINCT jobno_type FROM scanfile WHERE jobno_type IS NOT NULL"))
-        job_types = [row[0] for row in result]
-    except:
-        job_types = ['Normal', 'Urgent', 'Sample']
+    # Danh sách job đang mở
+    job_types = active_job_types()
 
     # Lấy danh sách Pallet khả dụng
     available_pallets = []
     try:
-        exclude_query = text("SELECT DISTINCT pallet FROM scanfile WHERE jobno_type IS NOT NULL AND pallet IS NOT NULL AND pallet != ''")
-        exclude_res = db.session.execute(exclude_query)
-        excluded_set = {str(row[0]) for row in exclude_res}
-        available_pallets = [i for i in range(1, 26) if str(i) not in excluded_set]
+        # Bỏ các số pallet đang có thùng ở các job chưa đóng (từ sổ pallet; job đã đóng/lưu trữ không tính)
+        excluded_set = pallets.used_anywhere(db.session)
+        available_pallets = [i for i in range(1, app.config['PALLETS_PER_JOB'] + 1) if str(i) not in excluded_set]
     except:
-        available_pallets = list(range(1, 26))
+        available_pallets = list(range(1, app.config['PALLETS_PER_JOB'] + 1))
 
     return render_template('manual_label.html', job_types=job_types, available_pallets=available_pallets)
 
@@ -552,9 +1178,8 @@ def get_job_skus():
     job_type = data.get('job_type', '')
     try:
         # Lấy danh sách SKU có item chưa gán pallet (khả dụng) trong Job
-        query = text("SELECT DISTINCT sku FROM scanfile WHERE jobno_type = :job_type AND (pallet IS NULL OR pallet = '')")
-        result = db.session.execute(query, {'job_type': job_type})
-        skus = [row[0] for row in result]
+        ensure_counters(job_type)
+        skus = [sku for sku, qty in counters.remaining_skus(db.session, job_type)]
         return jsonify({'success': True, 'skus': skus})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
@@ -565,9 +1190,8 @@ def get_sku_availability():
     job_type = data.get('job_type', '')
     sku = data.get('sku', '')
     try:
-        query = text("SELECT COUNT(id) FROM scanfile WHERE jobno_type = :job_type AND sku = :sku AND (pallet IS NULL OR pallet = '')")
-        res = db.session.execute(query, {'job_type': job_type, 'sku': sku}).fetchone()
-        count = res[0] if res else 0
+        ensure_counters(job_type)
+        count = counters.sku_remaining(db.session, job_type, sku)
         return jsonify({'success': True, 'count': count})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
@@ -578,10 +1202,8 @@ def get_remain_skus():
     job_type = data.get('job_type', '')
     try:
         # Lấy danh sách SKU và số lượng chưa scan (pallet null hoặc rỗng)
-        query = text("SELECT sku, COUNT(id) as qty FROM scanfile WHERE jobno_type = :job_type AND (pallet IS NULL OR pallet = '') GROUP BY sku ORDER BY sku")
-        result = db.session.execute(query, {'job_type': job_type})
-        
-        items = [{'sku': row[0], 'qty': row[1]} for row in result]
+        ensure_counters(job_type)
+        items = [{'sku': sku, 'qty': qty} for sku, qty in counters.remaining_skus(db.session, job_type)]
         return jsonify({'success': True, 'items': items})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
@@ -599,33 +1221,18 @@ def manual_update():
         return jsonify({'success': False, 'message': 'Số lượng phải lớn hơn 0'})
 
     try:
-        # Lấy danh sách ID cần update (giới hạn theo số lượng yêu cầu)
-        select_ids_query = text("""
-            SELECT id FROM scanfile 
-            WHERE jobno_type = :job_type AND sku = :sku AND (pallet IS NULL OR pallet = '') 
-            LIMIT :limit
-        """)
-        ids_res = db.session.execute(select_ids_query, {'job_type': job_type, 'sku': sku, 'limit': quantity})
-        ids = [row[0] for row in ids_res]
-
-        if not ids or len(ids) < quantity:
-             return jsonify({'success': False, 'message': f'Không đủ số lượng khả dụng (Tìm thấy {len(ids)})'})
-
-        # Cập nhật pallet, pallet_type và thời gian
-        # Sử dụng bindparam với expanding=True để xử lý danh sách ID an toàn cho mệnh đề IN
-        current_user = session.get('user')
-        update_query = text("UPDATE scanfile SET pallet = :pallet, pallet_type = :pallet_type, userscan = :userscan, time_scan = :time_scan WHERE id IN :ids")
-        update_query = update_query.bindparams(bindparam('ids', expanding=True))
-        db.session.execute(update_query, {
-            'pallet': pallet_no, 
-            'pallet_type': pallet_type, 
-            'userscan': current_user,
-            'time_scan': datetime.now(), 
-            'ids': list(ids)
-        })
+        # Gán nguyên tử đúng số lượng yêu cầu; thiếu thì hoàn tác toàn bộ
+        claimed = claim_cartons(db.session, job_type, sku, quantity, pallet_no, pallet_type,
+                                userscan=session.get('user'), time_scan=datetime.now())
+
+        if len(claimed) < quantity:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': f'Không đủ số lượng khả dụng (Tìm thấy {len(claimed)})'})
+
+        record_claims(job_type, pallet_no, claimed)
         db.session.commit()
 
-        return jsonify({'success': True, 'message': f'Đã cập nhật {len(ids)} thùng vào Pallet {pallet_no}'})
+        return jsonify({'success': True, 'message': f'Đã cập nhật {len(claimed)} thùng vào Pallet {pallet_no}'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)})
@@ -634,15 +1241,56 @@ def manual_update():
 @login_required
 @role_required(['admin', 'printer'])
 def print_label_page():
-    # Lấy danh sách jobno_type để hiển thị dropdown
-    job_types = []
-    try:
-        result = db.session.execute(text("SELECT DISTINCT jobno_type FROM scanfile WHERE jobno_type IS NOT NULL"))
-        job_types = [row[0] for row in result]
-    except:
-        job_types = ['Normal', 'Urgent', 'Sample']
+    # Danh sách job đang mở để hiển thị dropdown
+    return render_template('print_label.html', job_types=active_job_types())
+
+def print_rows_sql(table, by_pallet=False):
+    # Query lấy dữ liệu: Group theo Pallet và SKU để tính tổng số lượng
+    # Giả định bảng masterdata có cột 'weight' (số kg/thùng)
+    # Giả định bảng scanfile có cột 'tag_label' (ghi chú tem)
+    pallet_sql = "AND s.pallet = :pallet_no" if by_pallet else ""
+    return f"""
+        SELECT 
+            s.pallet, 
+            s.pallet_type, 
+            s.sku, 
+            COUNT(s.id) as qty, 
+            MAX(s.tag_label) as tag_label,
+            MAX(m.weight) as sku_weight,
+            s.jobscan,
+            MAX(s.userscan) as userscan
+                        
+        FROM {table} s
+        LEFT JOIN masterdata m ON s.sku = m.sku
+        WHERE s.jobno_type = :job_type 
+          AND s.pallet IS NOT NULL 
+          AND s.pallet != ''
+          {pallet_sql}
+        GROUP BY s.pallet, s.pallet_type, s.sku,s.jobscan
+        ORDER BY s.pallet, s.sku
+    """
+
+def print_rows(job_type, pallet_no=None):
+    query = text(print_rows_sql(archive.table_for(db.session, job_type), by_pallet=bool(pallet_no)))
+    result = db.session.execute(query, {'job_type': job_type, 'pallet_no': pallet_no})
     
-    return render_template('print_label.html', job_types=job_types)
+    items = []
+    for row in result:
+        items.append({
+            'pallet_no': row[0],
+            'pallet_type': row[1],
+            'sku': row[2],
+            'qty': row[3],
+            # Lấy tag_label, nếu null thì trả về chuỗi rỗng
+            'tag_label': 'Tem nhỏ' if row[4] else '',
+            # Lấy weight, nếu null (không tìm thấy trong masterdata) thì trả về 0
+            'sku_weight': float(row[5]) if row[5] is not None else 0,
+            # Lấy pallet_type, nếu null (không tìm thấy trong masterdata) thì trả về '
+            'jobscan': row[6],
+            'userscan': row[7] if row[7] else ''
+            
+        })
+    return items
 
 @app.route('/api/get_print_data', methods=['POST'])
 def get_print_data():
@@ -650,52 +1298,94 @@ def get_print_data():
     job_type = data.get('job_type', '')
 
     try:
-        # Query lấy dữ liệu: Group theo Pallet và SKU để tính tổng số lượng
-        # Giả định bảng masterdata có cột 'weight' (số kg/thùng)
-        # Giả định bảng scanfile có cột 'tag_label' (ghi chú tem)
-        query = text("""
-            SELECT 
-                s.pallet, 
-                s.pallet_type, 
-                s.sku, 
-                COUNT(s.id) as qty, 
-                MAX(s.tag_label) as tag_label,
-                MAX(m.weight) as sku_weight,
-                s.jobscan,
-                MAX(s.userscan) as userscan
-                            
-            FROM scanfile s
-            LEFT JOIN masterdata m ON s.sku = m.sku
-            WHERE s.jobno_type = :job_type 
-              AND s.pallet IS NOT NULL 
-              AND s.pallet != ''
-            GROUP BY s.pallet, s.pallet_type, s.sku,s.jobscan
-            ORDER BY s.pallet, s.sku
-        """)
-        
-        result = db.session.execute(query, {'job_type': job_type})
-        
-        items = []
-        for row in result:
-            items.append({
-                'pallet_no': row[0],
-                'pallet_type': row[1],
-                'sku': row[2],
-                'qty': row[3],
-                # Lấy tag_label, nếu null thì trả về chuỗi rỗng
-                'tag_label': 'Tem nhỏ' if row[4] else '',
-                # Lấy weight, nếu null (không tìm thấy trong masterdata) thì trả về 0
-                'sku_weight': float(row[5]) if row[5] is not None else 0,
-                # Lấy pallet_type, nếu null (không tìm thấy trong masterdata) thì trả về '
-                'jobscan': row[6],
-                'userscan': row[7] if row[7] else ''
-                
-            })
+        # Có trọng lượng từ masterdata -> khóa cache gồm cả phiên bản masterdata
+        return cached_job_response('get_print_data', job_type, lambda: {'success': True, 'items': print_rows(job_type)},
+                                   extra_versions=(versions.get(db.session, 'masterdata'),))
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
 
-        return jsonify({'success': True, 'items': items})
+def assign_jobscan(job_type, pallet_no=None):
+    # Giống printLabel ở trình duyệt: pallet chưa có jobscan -> gán timestamp yyyymmddhhmmss. Không commit.
+    pallet_sql = "AND pallet = :pallet_no" if pallet_no else "AND pallet IS NOT NULL AND pallet != ''"
+    query = text(f"UPDATE scanfile SET jobscan = :jobscan WHERE jobno_type = :job_type {pallet_sql} AND (jobscan IS NULL OR jobscan = '')")
+    result = db.session.execute(query, {'jobscan': datetime.now().strftime('%Y%m%d%H%M%S'), 'job_type': job_type, 'pallet_no': pallet_no})
+    changed = pallets.set_state(db.session, job_type, pallets.PRINTED, pallet_no)
+    if result.rowcount or changed:
+        counters.bump_version(db.session, job_type)
+        return True
+    return False
+
+@app.route('/api/labels/assign_jobscan', methods=['POST'])
+@login_required
+@role_required(['admin', 'printer'])
+def assign_jobscan_api():
+    # Gọi trước khi mở tem pallet PDF (GET tem chỉ đọc, không đổi trạng thái pallet)
+    data = request.get_json()
+    job_type = data.get('job_type')
+    if not job_type:
+        return jsonify({'success': False, 'message': 'Thiếu job_type'})
+    try:
+        ensure_counters(job_type)
+        changed = assign_jobscan(job_type, data.get('pallet_no') or None)
+        db.session.commit()
+        return jsonify({'success': True, 'changed': changed})
     except Exception as e:
+        db.session.rollback()
         return jsonify({'success': False, 'message': str(e)})
 
+def sscc_label_rows(job_type, pallet_no=None):
+    columns = exporter.LABEL_COLUMNS
+    pallet_nos = [pallet_no] if pallet_no else None
+    query, params = exporter.build_query(db.session.get_bind(), job_type, columns, pallets=pallet_nos,
+                                         table=archive.table_for(db.session, job_type))
+    return [{key: exporter.format_value(val) for key, val in zip(columns, row)} for row in db.session.execute(query, params)]
+
+@app.route('/api/labels/<kind>.pdf', methods=['GET'])
+@login_required
+@role_required(['admin', 'printer'])
+def label_pdf(kind):
+    # Tem PDF cho 1 pallet (?pallet=) hoặc cả job: kind = sscc | pallet. Chỉ đọc - JobScan của tem pallet
+    # được gán trước qua POST /api/labels/assign_jobscan
+    job_type = request.args.get('job_type', '')
+    pallet_no = request.args.get('pallet') or None
+    if kind not in ('sscc', 'pallet') or not job_type:
+        return jsonify({'success': False, 'message': 'Tham số không hợp lệ'}), 400
+
+    try:
+        ensure_counters(job_type)
+        if kind == 'pallet':
+            # Tem pallet có trọng lượng lấy từ masterdata -> khóa cache gồm cả phiên bản masterdata
+            key = label_cache.key(kind, job_type, pallet_no, counters.job_version(db.session, job_type), versions.get(db.session, 'masterdata'))
+        else:
+            key = label_cache.key(kind, job_type, pallet_no, counters.job_version(db.session, job_type))
+
+        pdf = label_cache.get(key)
+        cache_status = 'HIT'
+        if pdf is None:
+            cache_status = 'MISS'
+            if kind == 'pallet':
+                label_jobs = [(pallet, job_type) for pallet in labels.group_pallets(print_rows(job_type, pallet_no))]
+            else:
+                label_jobs = labels.sscc_jobs(sscc_label_rows(job_type, pallet_no))
+            if not label_jobs:
+                return jsonify({'success': False, 'message': 'Không có tem để in'}), 404
+            pdf, _ = labels.render_pdf(kind, label_jobs, pool=label_pool.for_jobs(len(label_jobs)))
+            label_cache.put(key, pdf)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+    filename = f"{kind}_{job_type}_{pallet_no or 'all'}.pdf"
+    return Response(pdf, mimetype='application/pdf', headers={
+        'Content-Disposition': f'inline; filename="{filename}"',
+        'X-Label-Cache': cache_status,
+    })
+
+def sscc_data_sql(bind, table):
+    # Chỉ lấy các cột tem SSCC cần (không SELECT *)
+    return f"SELECT {exporter.select_list(bind, exporter.LABEL_COLUMNS)} FROM {table} WHERE jobno_type = :job_type AND pallet = :pallet_no"
+
 @app.route('/api/get_sscc_data', methods=['POST'])
 def get_sscc_data():
     data = request.get_json()
@@ -703,27 +1393,57 @@ def get_sscc_data():
     pallet_no = data.get('pallet_no', '')
 
     try:
-        # Lấy tất cả thông tin từ bảng scanfile cho job và pallet này
-        query = text("SELECT * FROM scanfile WHERE jobno_type = :job_type AND pallet = :pallet_no")
+        columns = exporter.LABEL_COLUMNS
+        query = text(sscc_data_sql(db.session.get_bind(), archive.table_for(db.session, job_type)))
         result = db.session.execute(query, {'job_type': job_type, 'pallet_no': pallet_no})
-        
-        items = []
-        keys = result.keys() # Lấy danh sách tên cột
-        
-        for row in result:
-            item = {}
-            for key, val in zip(keys, row):
-                # Xử lý định dạng ngày tháng nếu có để tránh lỗi JSON
-                if isinstance(val, datetime):
-                    item[key] = val.strftime('%Y-%m-%d %H:%M:%S')
-                else:
-                    item[key] = val
-            items.append(item)
+        items = [{key: exporter.format_value(val) for key, val in zip(columns, row)} for row in result]
 
         return jsonify({'success': True, 'items': items})
     except Exception as e:
+        db.session.rollback()
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/api/export_sscc', methods=['GET'])
+@login_required
+def export_sscc():
+    # Xuất manifest cả job hoặc theo pallet, dạng NDJSON/CSV, trả về từng khối (chunked)
+    # ?job_type=&format=ndjson|csv&pallet=&pallet_from=&pallet_to=&status=scanned|waiting|all&columns=a,b,c
+    job_type = request.args.get('job_type', '')
+    fmt = request.args.get('format', 'ndjson')
+    status = request.args.get('status', 'scanned')
+    if not job_type:
+        return jsonify({'success': False, 'message': 'Thiếu job_type'})
+    if fmt not in ('ndjson', 'csv') or status not in exporter.STATUS_FILTERS:
+        return jsonify({'success': False, 'message': 'format/status không hợp lệ'})
+
+    columns = [c.strip() for c in request.args.get('columns', '').split(',') if c.strip()] or exporter.EXPORT_COLUMNS
+    unknown = [c for c in columns if c not in exporter.ALLOWED_COLUMNS]
+    if unknown:
+        return jsonify({'success': False, 'message': f"Cột không hợp lệ: {', '.join(unknown)}"})
+
+    pallet_nos = None
+    try:
+        table = archive.table_for(db.session, job_type)
+        if request.args.get('pallet'):
+            pallet_nos = [request.args.get('pallet')]
+        elif request.args.get('pallet_from') or request.args.get('pallet_to'):
+            low = int(request.args.get('pallet_from') or 0)
+            high = int(request.args.get('pallet_to') or 10 ** 9)
+            ensure_counters(job_type)
+            used = counters.used_pallets(db.session, job_type)
+            pallet_nos = sorted((p for p in used if p.isdigit() and low <= int(p) <= high), key=int)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'pallet_from/pallet_to phải là số'})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
+
+    stream = exporter.stream_export(db.engine, job_type, columns, fmt=fmt, pallets=pallet_nos, status=status, table=table)
+    if fmt == 'csv':
+        return Response(stream, mimetype='text/csv', headers={
+            'Content-Disposition': f'attachment; filename="{job_type}.csv"'})
+    return Response(stream, mimetype='application/x-ndjson')
+
 @app.route('/api/update_jobscan', methods=['POST'])
 def update_jobscan():
     data = request.get_json()
@@ -734,7 +1454,10 @@ def update_jobscan():
     try:
         # Cập nhật jobscan cho các record thuộc job_type và pallet này mà chưa có jobscan (NULL hoặc rỗng)
         query = text("UPDATE scanfile SET jobscan = :jobscan WHERE jobno_type = :job_type AND pallet = :pallet_no AND (jobscan IS NULL OR jobscan = '')")
-        db.session.execute(query, {'jobscan': jobscan, 'job_type': job_type, 'pallet_no': pallet_no})
+        result = db.session.execute(query, {'jobscan': jobscan, 'job_type': job_type, 'pallet_no': pallet_no})
+        changed = pallets.set_state(db.session, job_type, pallets.PRINTED, pallet_no)
+        if result.rowcount or changed:
+            counters.bump_version(db.session, job_type)
         db.session.commit()
         return jsonify({'success': True})
     except Exception as e:
@@ -747,6 +1470,29 @@ def update_jobscan():
 def users_page():
     return render_template('users.html')
 
+@app.route('/slow-queries')
+@login_required
+@role_required(['admin'])
+def slow_queries_page():
+    return render_template('slow_queries.html', threshold_ms=app.config['SLOW_QUERY_MS'])
+
+@app.route('/api/slow_queries', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def get_slow_queries():
+    # Dạng câu chậm xếp theo tổng thời gian; ?fingerprint= để xem các lần chậm gần nhất; ?clear=1 để xóa
+    try:
+        store = slow_query_log.store
+        if request.args.get('clear'):
+            store.clear()
+        fingerprint = request.args.get('fingerprint')
+        if fingerprint:
+            return jsonify({'success': True, 'samples': store.recent(fingerprint)})
+        limit = min(int(request.args.get('limit', 50)), 500)
+        return jsonify({'success': True, 'queries': store.worst(limit), 'stats': slow_query_log.stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
 @app.route('/api/users/list', methods=['GET'])
 @login_required
 @role_required(['admin'])
@@ -823,17 +1569,22 @@ def finish_pallet():
     user = session.get('user', 'Unknown')
 
     try:
-        # Đếm số lượng để ghi vào log
-        count_query = text("SELECT COUNT(id) FROM scanfile WHERE jobno_type = :job_type AND pallet = :pallet")
-        count_res = db.session.execute(count_query, {'job_type': job_type, 'pallet': pallet_no}).fetchone()
-        qty = count_res[0] if count_res else 0
+        # Đếm số lượng để ghi vào log (từ bộ đếm)
+        counters.ensure_job(db.session, job_type)
+        qty = counters.pallet_count(db.session, job_type, pallet_no)
 
         message = f"Pallet {pallet_no} ({pallet_type}) - Job {job_type} đã hoàn thành. SL: {qty} thùng."
         
         # Ghi vào bảng logs
         log_query = text("INSERT INTO logs (username, action, message, created_at, is_read) VALUES (:u, 'FINISH_PALLET', :m, :t, 0)")
-        db.session.execute(log_query, {'u': user, 'm': message, 't': datetime.now()})
+        now = datetime.now()
+        db.session.execute(log_query, {'u': user, 'm': message, 't': now})
+        if pallets.set_state(db.session, job_type, pallets.FINISHED, pallet_no):
+            counters.bump_version(db.session, job_type)
+        events.publish(db.session, 'log', {'username': user, 'action': 'FINISH_PALLET', 'message': message, 'created_at': str(now)},
+                       retention_hours=app.config['EVENTS_RETENTION_HOURS'])
         db.session.commit()
+        event_bus.notify()
 
         return jsonify({'success': True, 'message': 'Đã gửi thông báo cho bộ phận in!'})
     except Exception as e:
@@ -857,38 +1608,60 @@ def mark_read():
     log_id = data.get('id')
     try:
         db.session.execute(text("UPDATE logs SET is_read = 1 WHERE id = :id"), {'id': log_id})
+        events.publish(db.session, 'read', {'id': log_id}, retention_hours=app.config['EVENTS_RETENTION_HOURS'])
         db.session.commit()
+        event_bus.notify()
         return jsonify({'success': True})
     except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/events')
+@login_required
+def events_stream():
+    # Thay cho việc mỗi trạm in gọi /api/get_logs 10 giây/lần: trình duyệt giữ 1 kết nối SSE,
+    # server chỉ gửi khi có log mới / log được đánh dấu đã xem.
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    try:
+        if last_id:
+            # Nối lại sau khi mất kết nối -> gửi bù các sự kiện bị lỡ (kể cả id còn thiếu lúc ngắt)
+            cursor = events.Cursor.parse(last_id)
+            backlog = events.fetch_since(db.session, cursor)
+        else:
+            cursor = events.Cursor(events.latest_id(db.session))
+            backlog = []
+    except Exception as e:
+        db.session.rollback()
         return jsonify({'success': False, 'message': str(e)})
 
+    stream = event_bus.stream(backlog, cursor, app.config['SSE_STREAM_SECONDS'])
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
 @app.route('/print-small-label')
 @login_required
 @role_required(['admin', 'printer'])
 def print_small_label_page():
-    # Lấy danh sách jobno_type
-    job_types = []
-    try:
-        result = db.session.execute(text("SELECT DISTINCT jobno_type FROM scanfile WHERE jobno_type IS NOT NULL"))
-        job_types = [row[0] for row in result]
-    except:
-        job_types = ['Normal', 'Urgent', 'Sample']
-    return render_template('print_small_label.html', job_types=job_types)
+    # Danh sách job đang mở
+    return render_template('print_small_label.html', job_types=active_job_types())
 
 @app.route('/api/get_small_label_data', methods=['POST'])
 def get_small_label_data():
     data = request.get_json()
     job_type = data.get('job_type', '')
-    try:
-        # Lấy danh sách các item có tag_label, group theo Pallet, SKU và Tag
-        query = text("""
+    def compute():
+        # Lấy danh sách các item có tag_label, group theo Pallet, SKU và Tag (job đã lưu trữ đọc từ bảng lưu trữ)
+        table = archive.table_for(db.session, job_type)
+        query = text(f"""
             SELECT 
                 s.pallet, 
                 s.sku, 
                 s.tag_label,
                 COUNT(s.id) as qty,
                 s.jobscan
-            FROM scanfile s
+            FROM {table} s
             WHERE s.jobno_type = :job_type 
               AND s.tag_label IS NOT NULL 
               AND s.tag_label != ''
@@ -897,26 +1670,23 @@ def get_small_label_data():
         """)
         result = db.session.execute(query, {'job_type': job_type})
         items = [{'pallet': row[0], 'sku': row[1], 'tag_label': row[2], 'qty': row[3], 'jobscan': row[4]} for row in result]
-        return jsonify({'success': True, 'items': items})
+        return {'success': True, 'items': items}
+
+    try:
+        return cached_job_response('get_small_label_data', job_type, compute)
     except Exception as e:
+        db.session.rollback()
         return jsonify({'success': False, 'message': str(e)})
 
 @app.route('/stats')
 @login_required
 def stats_page():
     try:
-        # Query: Đếm số lượng pallet duy nhất (DISTINCT pallet) theo từng loại và job
-        # Chỉ lấy những dòng đã có pallet (không null, không rỗng)
-        query = text("""
-            SELECT jobno,jobno_type, pallet_type, COUNT(DISTINCT pallet), COUNT(id)
-            FROM scanfile
-            WHERE pallet IS NOT NULL AND pallet != ''
-            GROUP BY jobno, pallet_type,jobno_type
-            ORDER BY jobno
-        """)
-        result = db.session.execute(query)
-        
-        stats = {}
+        # Đọc từ bảng tổng hợp (services/stats.py) thay vì GROUP BY trên toàn bộ scanfile:
+        # số pallet và số thùng theo job + loại pallet
+        result = stats.pallet_rows(db.session)
+
+        job_stats = {}
         for row in result:
             job_no = row[0]
             job_type = row[1]
@@ -929,8 +1699,8 @@ def stats_page():
             # Sử dụng khóa là tuple (Job No, Job Type) để nhóm
             key = (job_no, job_type)
             
-            if key not in stats:
-                stats[key] = {'1.2': 0, '1.6': 0, '1.9': 0, 'loose': 0, 'total': 0}
+            if key not in job_stats:
+                job_stats[key] = {'1.2': 0, '1.6': 0, '1.9': 0, 'loose': 0, 'total': 0}
             
             # Nếu là loose (Loose Carton) thì đếm số SSCC (thùng), ngược lại đếm số Pallet
             if p_type == 'loose' or p_type == 'loosecarton':
@@ -938,13 +1708,13 @@ def stats_page():
             else:
                 count = pallet_count
 
-            if p_type in stats[key]:
-                stats[key][p_type] += count
-                stats[key]['total'] += count
+            if p_type in job_stats[key]:
+                job_stats[key][p_type] += count
+                job_stats[key]['total'] += count
 
         # Tính tổng cộng (Grand Total) cho hàng đầu trang
         grand_total = {'1.2': 0, '1.6': 0, '1.9': 0, 'loose': 0, 'total': 0}
-        for s in stats.values():
+        for s in job_stats.values():
             grand_total['1.2'] += s['1.2']
             grand_total['1.6'] += s['1.6']
             grand_total['1.9'] += s['1.9']
@@ -952,27 +1722,14 @@ def stats_page():
             grand_total['total'] += s['total']
 
         # Thống kê hàng chưa scan (Tồn) theo jobno_type
-        remain_query = text("""
-            SELECT jobno, jobno_type, COUNT(id)
-            FROM scanfile
-            WHERE pallet IS NULL OR pallet = ''
-            GROUP BY jobno, jobno_type
-            ORDER BY jobno
-        """)
-        remain_result = db.session.execute(remain_query)
+        remain_result = stats.remaining_rows(db.session)
         # Lưu key là tuple (jobno, jobno_type)
         remain_stats = {(row[0], row[1]): row[2] for row in remain_result}
 
         # Thống kê năng suất theo User (User Stats)
-        user_query = text("""
-            SELECT userscan, COUNT(id) 
-            FROM scanfile 
-            WHERE userscan IS NOT NULL AND userscan != ''
-            GROUP BY userscan
-        """)
-        user_stats = db.session.execute(user_query).fetchall()
+        user_stats = stats.user_rows(db.session)
 
-        return render_template('statistics.html', stats=stats, remain_stats=remain_stats, grand_total=grand_total, user_stats=user_stats)
+        return render_template('statistics.html', stats=job_stats, remain_stats=remain_stats, grand_total=grand_total, user_stats=user_stats)
     except Exception as e:
         return f"Lỗi: {str(e)}"
 
@@ -990,32 +1747,311 @@ def user_stats_by_date():
     try:
         if start_date and end_date:
             # Lọc theo khoảng thời gian (từ ngày... đến ngày...)
-            query = text("""
-                SELECT userscan, COUNT(id) as qty
-                FROM scanfile
-                WHERE userscan IS NOT NULL AND userscan != '' 
-                AND DATE(time_scan) >= :start AND DATE(time_scan) <= :end
-                GROUP BY userscan
-                ORDER BY qty DESC
-            """)
-            result = db.session.execute(query, {'start': start_date, 'end': end_date})
+            start, end = productivity.parse_day(start_date), productivity.parse_day(end_date)
         elif date_str:
-            # Lọc theo một ngày cụ thể (Logic cũ)
-            query = text("""
-                SELECT userscan, COUNT(id) as qty
-                FROM scanfile
-                WHERE userscan IS NOT NULL AND userscan != '' AND DATE(time_scan) = :date
-                GROUP BY userscan
-                ORDER BY qty DESC
-            """)
-            result = db.session.execute(query, {'date': date_str})
+            # Lọc theo một ngày cụ thể
+            start = end = productivity.parse_day(date_str)
         else:
             return jsonify({'success': False, 'message': 'Vui lòng chọn ngày hoặc khoảng thời gian'})
 
-        stats = [{'username': row[0], 'qty': row[1]} for row in result]
-        return jsonify({'success': True, 'stats': stats})
+        # Đọc bảng năng suất theo giờ (chỉ các bucket trong khoảng) thay vì DATE(time_scan) trên scanfile
+        rows = productivity.totals(db.session, start, end)
+        return jsonify({'success': True, 'stats': [{'username': user, 'qty': qty} for user, qty in rows]})
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Ngày không hợp lệ (định dạng YYYY-MM-DD)'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+# --- API NĂNG SUẤT THEO GIỜ/NGÀY/TUẦN ---
+@app.route('/api/productivity', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def productivity_report():
+    """?start=YYYY-MM-DD&end=YYYY-MM-DD&granularity=hour|day|week[&user=a,b][&job_type=...]
+
+    granularity=hour cho đường cong số thùng/giờ của từng user.
+    """
+    try:
+        start = productivity.parse_day(request.args.get('start', ''))
+        end = productivity.parse_day(request.args.get('end') or start.isoformat())
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Ngày không hợp lệ (định dạng YYYY-MM-DD)'})
+    if end < start:
+        return jsonify({'success': False, 'message': 'Ngày kết thúc phải sau ngày bắt đầu'})
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in productivity.GRANULARITIES:
+        return jsonify({'success': False, 'message': f"granularity phải là: {', '.join(productivity.GRANULARITIES)}"})
+    users = [u.strip() for u in request.args.get('user', '').split(',') if u.strip()]
+    job_type = request.args.get('job_type') or None
+
+    try:
+        data = productivity.series(db.session, start, end, granularity, users=users or None, job_type=job_type)
+        return jsonify({
+            'success': True,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'granularity': granularity,
+            'users': data,
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+# --- LỆNH CLI (flask --app app <lệnh>) ---
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Chạy các migration schema/index còn thiếu."""
+    applied = schema.upgrade(db.engine)
+    print(f"Đã chạy {len(applied)} migration." if applied else "Schema đã ở phiên bản mới nhất.")
+
+@app.cli.command('explain-hot')
+@click.option('--job-type', default='', help='jobno_type dùng làm tham số mẫu')
+@click.option('--sku', default='', help='SKU dùng làm tham số mẫu')
+@click.option('--pallet', default='1', help='Pallet dùng làm tham số mẫu')
+def explain_hot_command(job_type, sku, pallet):
+    """In EXPLAIN của các query nóng trên scanfile và báo query nào quét toàn bảng."""
+    # Query nằm trong app.py: cùng hàm dựng SQL mà route dùng
+    queries = [
+        ('delete_scan', DELETE_SCAN_SELECT),
+        ('get_history', history_sql('scanfile')),
+        ('get_print_data', print_rows_sql('scanfile')),
+        ('get_sscc_data', sscc_data_sql(db.engine, 'scanfile')),
+    ]
+    offenders = schema.explain_hot_queries(db.engine, job_type=job_type, sku=sku, pallet=pallet, queries=queries)
+    if offenders:
+        print(f"{len(offenders)} query còn quét toàn bảng: {', '.join(offenders)}")
+    else:
+        print("Không có query nào quét toàn bảng.")
+
+@app.cli.command('counters-reconcile')
+@click.option('--job-type', default=None, help='Chỉ tính lại một job (mặc định: tất cả)')
+def counters_reconcile_command(job_type):
+    """Tính lại bộ đếm scan_counters từ scanfile và báo các khóa bị lệch."""
+    report = counters.reconcile(db.session, job_type=job_type)
+    db.session.commit()
+    drifted = [name for name, drift in report.items() if drift]
+    print(f"{len(report)} job, {len(drifted)} job bị lệch đã được sửa.")
+
+@app.cli.command('stats-rebuild')
+def stats_rebuild_command():
+    """Tính lại bảng tổng hợp của trang /stats từ scanfile."""
+    pallet_rows, user_rows = stats.rebuild(db.session)
+    db.session.commit()
+    print(f"Đã tính lại: {pallet_rows} dòng job/pallet, {user_rows} user.")
+
+@app.cli.command('productivity-rebuild')
+def productivity_rebuild_command():
+    """Tính lại bảng năng suất theo giờ từ scanfile (userscan + time_scan)."""
+    buckets = productivity.rebuild(db.session)
+    db.session.commit()
+    print(f"Đã tính lại {buckets} bucket năng suất.")
+
+@app.cli.command('archive-jobs')
+@click.option('--job-type', default=None, help='Chỉ lưu trữ một job (mặc định: mọi job đủ điều kiện)')
+@click.option('--idle-hours', default=None, type=float, help='Số giờ không scan tối thiểu (mặc định ARCHIVE_IDLE_HOURS)')
+@click.option('--dry-run', is_flag=True, help='Chỉ liệt kê job đủ điều kiện')
+def archive_jobs_command(job_type, idle_hours, dry_run):
+    """Chuyển job đã scan + in tem xong từ scanfile sang scanfile_archive."""
+    if idle_hours is None:
+        idle_hours = app.config['ARCHIVE_IDLE_HOURS']
+    if job_type:
+        candidates = [(job_type, None)]
+    else:
+        # Job lưu trữ dở (bị ngắt) được chạy tiếp trước
+        candidates = archive.interrupted_jobs(db.session)
+        seen = {name for name, _ in candidates}
+        candidates += [(name, rows) for name, rows in archive.eligible_jobs(db.session, idle_hours) if name not in seen]
+    if dry_run or not candidates:
+        for name, rows in candidates:
+            print(f"[{name}] {rows if rows is not None else '?'} dòng")
+        print(f"{len(candidates)} job đủ điều kiện lưu trữ.")
+        return
+    archiver = JobArchiver(db.session, batch_size=app.config['ARCHIVE_BATCH_SIZE'])
+    for name, _ in candidates:
+        result = archiver.archive(name)
+        print(f"[{name}] {result['status']}: {result.get('rows', result.get('message'))}")
+
+@app.cli.command('archive-restore')
+@click.argument('job_type')
+def archive_restore_command(job_type):
+    """Trả một job đã lưu trữ về scanfile (vd. cần scan bổ sung)."""
+    if not archive.is_archived(db.session, job_type):
+        print(f"[{job_type}] chưa được lưu trữ.")
+        return
+    moved = JobArchiver(db.session, batch_size=app.config['ARCHIVE_BATCH_SIZE']).restore(job_type)
+    print(f"[{job_type}] đã trả {moved} dòng về scanfile.")
+
+@app.cli.command('pallets-rebuild')
+@click.option('--job-type', default=None, help='Chỉ tính lại một job (mặc định: tất cả)')
+def pallets_rebuild_command(job_type):
+    """Tính lại sổ pallet (số thùng, trạng thái đã in) từ scanfile."""
+    count = pallets.rebuild(db.session, job_type)
+    db.session.commit()
+    print(f"Đã tính lại {count} pallet.")
+
+@app.cli.command('jobs-sync')
+def jobs_sync_command():
+    """Thêm vào bảng jobs các job có trong scanfile nhưng chưa đăng ký (nạp ngoài app) và sửa tổng thùng."""
+    added, fixed = jobs.sync(db.session, archive.all_rows(['id', 'jobno', 'jobno_type']))
+    db.session.commit()
+    print(f"Đã thêm {added} job, sửa tổng thùng của {fixed} job.")
+
+@app.cli.command('scan-ledger-purge')
+def scan_ledger_purge_command():
+    """Xóa các dòng sổ chống trùng scan quá SCAN_DEDUP_SECONDS (worker cũng tự dọn định kỳ)."""
+    removed = scan_dedup.purge(db.session)
+    db.session.commit()
+    print(f"Đã xóa {removed} scan_id hết hạn.")
+
+@app.cli.command('scan-queue-drain')
+@click.option('--timeout', default=60, help='Thời gian tối đa (giây)')
+def scan_queue_drain_command(timeout):
+    """Ghi hết hàng đợi scan vào DB chính (vd. trước khi chuyển SCAN_WRITE_BEHIND=0). Server phải dừng."""
+    if scan_writer is None:
+        raise SystemExit("SCAN_WRITE_BEHIND đang tắt.")
+    total = scan_writer.drain(timeout)
+    if total is None:
+        raise SystemExit(f"Một worker đang ghi hàng đợi (còn {scan_queue.depth()[0]} scan chờ) - dừng server rồi chạy lại.")
+    depth = scan_queue.depth()[0]
+    print(f"Đã ghi {total} scan, còn {depth} scan chờ.")
+    if depth:
+        raise SystemExit(1)
+
+@app.cli.command('barcode-bench')
+@click.argument('barcodes', nargs=-1)
+@click.option('--count', default=10000, help='Số mã mẫu (khi không truyền mã)')
+@click.option('--rounds', default=5, help='Số lượt đo (lấy lượt nhanh nhất)')
+def barcode_bench_command(barcodes, count, rounds):
+    """Đọc thử mã vạch theo cấu hình BARCODE_* hiện tại và đo thời gian parse (micro giây/mã).
+
+    Truyền mã -> in kết quả từng mã rồi đo trên chính các mã đó; không truyền -> đo trên mẫu trộn
+    (mã cũ, SSCC, GS1-128, mã sai số kiểm tra, mã QR).
+    """
+    if barcodes:
+        for item in barcode_reader.parse_many(barcodes):
+            if item.error:
+                print(f"{item.barcode}: LỖI [{item.reason}] {item.error}")
+            else:
+                print(f"{item.barcode}: prefix {item.prefix} (MANCC {item.mancc}){f' AI {item.ais}' if item.ais else ''}")
+    sample = list(barcodes) if barcodes else barcode_parser.sample_barcodes(count)
+    print(json.dumps(barcode_parser.benchmark(barcode_reader, sample, rounds), ensure_ascii=False, indent=2))
+
+@app.cli.command('load-test')
+@click.option('--stations', default=20, help='Số trạm scan đồng thời')
+@click.option('--seconds', default=30, help='Thời gian chạy (giây)')
+@click.option('--cartons', default=5000, help='Số thùng của job tạm')
+@click.option('--skus', default=20, help='Số SKU của job tạm')
+@click.option('--think-ms', default=300, help='Thời gian nghỉ trung bình giữa 2 thao tác của một trạm (ms)')
+@click.option('--mix', default='', help='Tỉ lệ thao tác, vd. scan=60,check_barcode=10,job_stats=10,get_logs=8')
+@click.option('--url', default=None, help='Gọi server đang chạy (vd. http://127.0.0.1:8000) thay vì trong process')
+@click.option('--user', default=None, help='Đăng nhập khi dùng --url')
+@click.option('--password', default=None)
+@click.option('--seed', default=1, help='Seed ngẫu nhiên (lặp lại được cùng chuỗi thao tác)')
+@click.option('--output', default=None, type=click.Path(dir_okay=False), help='Ghi báo cáo JSON ra file')
+@click.option('--max-p95-ms', default=None, type=float, help='Báo lỗi nếu p95 toàn bộ vượt ngưỡng')
+@click.option('--min-rps', default=None, type=float, help='Báo lỗi nếu thông lượng thấp hơn ngưỡng')
+def load_test_command(stations, seconds, cartons, skus, think_ms, mix, url, user, password, seed, output, max_p95_ms, min_rps):
+    """Kiểm tra tải nhiều trạm scan trên job tạm (tự dọn sau khi chạy), in báo cáo JSON.
+
+    DB là DATABASE_URL hiện tại (SQLite hoặc Postgres/MySQL trong container: loadtest/docker-compose.yml).
+    """
+    try:
+        mix = loadtest.parse_mix(mix)
+    except ValueError as e:
+        raise SystemExit(f"LỖI: {e}")
+
+    if url:
+        def client_factory(n):
+            return loadtest.HttpClient(url, user, password)
+
+        def prepare(fixture):
+            # Mỗi worker của server tự làm mới chỉ mục masterdata sau MASTERDATA_REFRESH_SECONDS
+            wait = app.config['MASTERDATA_REFRESH_SECONDS'] + 1
+            print(f"Chờ {wait}s để server nạp {len(fixture.skus)} SKU tạm vào chỉ mục masterdata...")
+            time.sleep(wait)
+    else:
+        def client_factory(n):
+            return loadtest.AppClient(app, f"loadtest-{n + 1}")
+
+        def prepare(fixture):
+            masterdata_index.load(db.session)
+
+    report = loadtest.run_load(db.engine, client_factory, stations=stations, seconds=seconds, cartons=cartons,
+                               skus=skus, mix=mix, think_ms=think_ms, seed=seed, prepare=prepare,
+                               settle=scan_writer.wait_drained if scan_writer is not None else None)
+    report['target'] = url or 'in-process'
+    if not url:
+        masterdata_index.load(db.session)
+
+    body = json.dumps(report, ensure_ascii=False, indent=2)
+    print(body)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(body)
+
+    problems = []
+    if report['double_claims'] or report['lost_claims'] or report['pallet_mismatch'] or report['counter_drift'] or report['replay_mismatch']:
+        problems.append('thùng bị claim trùng/thất lạc, bộ đếm lệch hoặc gửi lại nhận sai kết quả')
+    if max_p95_ms is not None and report['p95_ms'] > max_p95_ms:
+        problems.append(f"p95 {report['p95_ms']}ms > {max_p95_ms}ms")
+    if min_rps is not None and report['rps'] < min_rps:
+        problems.append(f"thông lượng {report['rps']} req/s < {min_rps}")
+    if problems:
+        raise SystemExit(f"LỖI: {'; '.join(problems)}")
+
+@app.cli.command('claim-stress')
+@click.option('--threads', default=8, help='Số luồng scan đồng thời')
+@click.option('--cartons', default=1000, help='Số thùng tạo cho job tạm')
+@click.option('--batch', default=1, help='Số thùng mỗi lần claim')
+def claim_stress_command(threads, cartons, batch):
+    """Kiểm tra claim đồng thời: không có thùng bị đếm 2 lần, đo số claim/giây."""
+    report = run_stress(db.engine, threads=threads, cartons=cartons, batch=batch)
+    if report['double_claims'] or report['unclaimed'] or report['claims'] != cartons:
+        raise SystemExit("LỖI: phát hiện claim trùng hoặc thùng bị bỏ sót")
+
+@app.cli.command('import-scanfile')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--job-type', default=None, help='Ghi đè jobno_type cho mọi dòng')
+@click.option('--jobno', default=None, help='Ghi đè jobno cho mọi dòng')
+def import_scanfile_command(path, job_type, jobno):
+    """Nạp file CSV/XLSX vào scanfile (một transaction), in tiến độ và số dòng/giây."""
+    def progress(summary):
+        print(f"  {summary['inserted']} dòng ({summary['rows_per_second']} dòng/giây)")
+
+    with open(path, 'rb') as f:
+        try:
+            summary = run_import(f, path, job_type=job_type, jobno=jobno, progress=progress)
+        except ImportFileError as e:
+            db.session.rollback()
+            raise SystemExit(f"LỖI: {e}")
+    print(f"Đã nạp {summary['inserted']}/{summary['rows_read']} dòng trong {summary['seconds']}s "
+          f"({summary['rows_per_second']} dòng/giây), bỏ qua {summary['rejected']}.")
+    for error in summary['errors']:
+        print(f"    dòng {error['line']}: {error['message']}")
+    if summary['ignored_columns']:
+        print(f"Cột bị bỏ qua: {', '.join(summary['ignored_columns'])}")
+
+@app.cli.command('import-masterdata')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--allow-collisions', is_flag=True, help='Vẫn ghi các SKU có prefix trùng (chỉ báo cáo)')
+@click.option('--dry-run', is_flag=True, help='Chỉ kiểm tra, không ghi vào DB')
+def import_masterdata_command(path, allow_collisions, dry_run):
+    """Upsert masterdata từ file CSV/XLSX, tính cbm và kiểm tra prefix trùng."""
+    with open(path, 'rb') as f:
+        try:
+            summary = run_masterdata_import(f, path, allow_collisions=allow_collisions, dry_run=dry_run)
+        except ImportFileError as e:
+            db.session.rollback()
+            raise SystemExit(f"LỖI: {e}")
+    print(f"{'[DRY RUN] ' if dry_run else ''}Thêm {summary['inserted']}, cập nhật {summary['updated']}, "
+          f"bỏ qua {summary['rejected']} / {summary['rows_read']} dòng trong {summary['seconds']}s "
+          f"({summary['rows_per_second']} dòng/giây). Tính cbm: {summary['cbm_computed']}.")
+    for item in summary['collisions']:
+        print(f"    prefix {item['refix']}: {', '.join(item['skus'])}")
+    for error in summary['errors']:
+        print(f"    dòng {error['line']}: {error['message']}")
+    if summary['version'] is not None and not dry_run:
+        print(f"Phiên bản masterdata: {summary['version']}")
+
 if __name__ == '__main__':
     app.run(debug=True)
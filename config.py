@@ -5,4 +5,95 @@ class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", "kln_scan_secret_key_2024")
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    PERMANENT_SESSION_LIFETIME = timedelta(days=7)
\ No newline at end of file
+    PERMANENT_SESSION_LIFETIME = timedelta(days=7)
+
+    # Chỉ mục masterdata trong RAM (giây)
+    MASTERDATA_REFRESH_SECONDS = int(os.getenv("MASTERDATA_REFRESH_SECONDS", "30"))
+    MASTERDATA_FULL_RELOAD_SECONDS = int(os.getenv("MASTERDATA_FULL_RELOAD_SECONDS", "600"))
+
+    # Số mã vạch tối đa cho một request /api/scan_batch
+    SCAN_BATCH_MAX = int(os.getenv("SCAN_BATCH_MAX", "100"))
+
+    # Chống trùng scan theo scan_id: thời gian giữ kết quả để trả lại khi máy quét gửi lại (giây)
+    # và số request /api/scan mỗi máy quét được gửi song song (scan.html)
+    SCAN_DEDUP_SECONDS = int(os.getenv("SCAN_DEDUP_SECONDS", "86400"))
+    SCAN_PIPELINE_DEPTH = int(os.getenv("SCAN_PIPELINE_DEPTH", "4"))
+
+    # Đọc mã vạch trên worker trước khi tra masterdata (services/barcode_parser.py): độ dài tối thiểu,
+    # kiểm tra số kiểm tra SSCC/GTIN (mặc định tắt: mã sai số kiểm tra trước đây vẫn scan được - bật (1) cho
+    # nơi triển khai dùng nhãn GS1 chuẩn để chặn mã quét lỗi), loại mã được nhận theo AIM symbology ID máy quét gửi kèm (vd. "C,E,I" -
+    # để trống = nhận mọi loại) và quy tắc lấy prefix (refix) theo nhà cung cấp (MANCC), dạng JSON:
+    # [{"mancc": "NCC01", "source": "01", "match": "^0893", "slice": [-6, -1]}, {"mancc": "*", "source": "raw", "slice": [-6, -1]}]
+    BARCODE_MIN_LENGTH = int(os.getenv("BARCODE_MIN_LENGTH", "10"))
+    BARCODE_CHECK_DIGITS = os.getenv("BARCODE_CHECK_DIGITS", "0") not in ("0", "false", "False", "")
+    BARCODE_SYMBOLOGIES = [s.strip() for s in os.getenv("BARCODE_SYMBOLOGIES", "").split(",") if s.strip()]
+    BARCODE_PREFIX_RULES = os.getenv("BARCODE_PREFIX_RULES", '[{"mancc": "*", "source": "raw", "slice": [-6, -1]}]')
+
+    # Chặn scan lại cùng một mã vạch trong job (sổ scanned_barcodes + Bloom filter trong RAM) và số job
+    # giữ filter trong mỗi worker. Tắt (0) nếu nhãn thùng không có mã riêng cho từng thùng.
+    SCAN_REJECT_DUPLICATES = os.getenv("SCAN_REJECT_DUPLICATES", "1") not in ("0", "false", "False", "")
+    BARCODE_FILTER_JOBS = int(os.getenv("BARCODE_FILTER_JOBS", "20"))
+
+    # Ghi scan qua hàng đợi SQLite cục bộ (services/scan_queue.py): trả lời ngay, luồng nền ghi DB chính theo lô.
+    # File hàng đợi (mặc định instance/scan_queue.db), chu kỳ gom lô (ms), số scan tối đa mỗi lô,
+    # số scan chờ ghi tối đa trước khi từ chối (HTTP 503) và chu kỳ đọc lại tồn chờ từ DB chính (giây)
+    SCAN_WRITE_BEHIND = os.getenv("SCAN_WRITE_BEHIND", "0") not in ("0", "false", "False", "")
+    SCAN_QUEUE_DB = os.getenv("SCAN_QUEUE_DB")
+    SCAN_QUEUE_FLUSH_MS = float(os.getenv("SCAN_QUEUE_FLUSH_MS", "5"))
+    SCAN_QUEUE_BATCH = int(os.getenv("SCAN_QUEUE_BATCH", "200"))
+    SCAN_QUEUE_MAX_DEPTH = int(os.getenv("SCAN_QUEUE_MAX_DEPTH", "5000"))
+    SCAN_QUEUE_REFRESH_SECONDS = float(os.getenv("SCAN_QUEUE_REFRESH_SECONDS", "5"))
+
+    # Server-Sent Events (/api/events): chu kỳ đọc outbox ngay sau khi có sự kiện, chu kỳ tối đa khi yên lặng
+    # (giãn dần gấp đôi), thời gian tối đa mỗi kết nối (giây) và số giờ giữ sự kiện trong bảng events.
+    # Kết nối đóng trước timeout của worker gunicorn, EventSource tự nối lại bằng Last-Event-ID.
+    EVENTS_POLL_SECONDS = float(os.getenv("EVENTS_POLL_SECONDS", "0.5"))
+    EVENTS_POLL_MAX_SECONDS = float(os.getenv("EVENTS_POLL_MAX_SECONDS", "10"))
+    EVENTS_RETENTION_HOURS = float(os.getenv("EVENTS_RETENTION_HOURS", "24"))
+    SSE_STREAM_SECONDS = int(os.getenv("SSE_STREAM_SECONDS", "25"))
+
+    # Số dòng mỗi lần ghi khi nạp file scanfile (/api/import_scanfile, flask import-scanfile)
+    IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+
+    # Tem PDF phía server: số process dựng tem, số trang tối thiểu để dùng process pool,
+    # thư mục cache (mặc định instance/label_cache) và số file PDF giữ lại
+    LABEL_WORKERS = int(os.getenv("LABEL_WORKERS", str(min(4, os.cpu_count() or 1))))
+    LABEL_POOL_MIN_PAGES = int(os.getenv("LABEL_POOL_MIN_PAGES", "200"))
+    LABEL_CACHE_DIR = os.getenv("LABEL_CACHE_DIR")
+    LABEL_CACHE_MAX_FILES = int(os.getenv("LABEL_CACHE_MAX_FILES", "200"))
+
+    # Lưu trữ job đã xong (flask archive-jobs): số dòng mỗi lô và số giờ không scan tối thiểu
+    ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+    ARCHIVE_IDLE_HOURS = float(os.getenv("ARCHIVE_IDLE_HOURS", "24"))
+
+    # Số pallet mặc định mỗi job (đặt riêng từng job qua /api/pallet_limit) và giới hạn trên
+    PALLETS_PER_JOB = int(os.getenv("PALLETS_PER_JOB", "25"))
+    PALLETS_MAX = int(os.getenv("PALLETS_MAX", "200"))
+
+    # Cache danh sách job đang mở trong mỗi worker (giây giữa hai lần kiểm tra phiên bản)
+    JOBS_CACHE_SECONDS = float(os.getenv("JOBS_CACHE_SECONDS", "10"))
+
+    # Cache kết quả API đọc nhiều (in tem, lịch sử, chi tiết SKU) dùng chung giữa các worker:
+    # '' -> file SQLite instance/response_cache.db, 'redis://host:6379/0' -> Redis, 'off' -> tắt
+    RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "")
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+
+    # Pool kết nối DB mỗi worker và timeout query (giây). gunicorn.conf.py đặt các biến này theo
+    # loại worker/số thread (services/server_profile.py); để trống -> mặc định của SQLAlchemy, không giới hạn query
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "0")) or None
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW")) if os.getenv("DB_MAX_OVERFLOW") else None
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "0")) or None
+    DB_STATEMENT_TIMEOUT = float(os.getenv("DB_STATEMENT_TIMEOUT", "0")) or None
+
+    # /metrics (Prometheus): thư mục chia sẻ số liệu giữa các worker (mặc định instance/metrics),
+    # chu kỳ ghi bản chụp của mỗi worker (giây) và token bảo vệ (để trống -> không yêu cầu)
+    METRICS_DIR = os.getenv("METRICS_DIR")
+    METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "2"))
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+    # Nhật ký query chậm (/slow-queries): ngưỡng ms (0 -> tắt), tự EXPLAIN, file lưu (mặc định
+    # instance/slow_queries.db) và số lần chậm giữ lại
+    SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+    SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "1") not in ("0", "false", "False", "")
+    SLOW_QUERY_DB = os.getenv("SLOW_QUERY_DB")
+    SLOW_QUERY_MAX_SAMPLES = int(os.getenv("SLOW_QUERY_MAX_SAMPLES", "2000"))
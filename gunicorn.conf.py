@@ -0,0 +1,31 @@
+# Cấu hình gunicorn (tự đọc khi chạy `gunicorn app:app` trong thư mục này).
+# Chọn loại worker bằng GUNICORN_WORKER_CLASS=sync|gthread|gevent; số worker, thread, pool DB và timeout
+# tính trong services/server_profile.py theo số CPU, DB_MAX_CONNECTIONS và DB_LATENCY_MS.
+import os
+
+from services import server_profile
+
+profile = server_profile.build()
+# Worker đọc kích thước pool/timeout qua Config
+server_profile.export_env(profile)
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = profile.worker_class
+workers = profile.workers
+threads = profile.threads
+worker_connections = profile.worker_connections
+timeout = profile.timeout
+graceful_timeout = profile.graceful_timeout
+keepalive = profile.keepalive
+# Khởi động lại worker định kỳ (lệch nhau) để giới hạn phân mảnh bộ nhớ
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '5000'))
+max_requests_jitter = max_requests // 10
+accesslog = '-' if os.getenv('GUNICORN_ACCESS_LOG') else None
+
+
+def on_starting(server):
+    server.log.info(
+        "Profile %s: %d worker x %d (thread/kết nối), pool DB %d+%d/worker, timeout %ss, query %ss",
+        profile.worker_class, profile.workers, profile.worker_connections,
+        profile.pool_size, profile.max_overflow, profile.timeout, profile.statement_timeout,
+    )
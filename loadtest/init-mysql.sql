@@ -0,0 +1,16 @@
+-- Bảng gốc (giống init_local_db trong app.py); index và bảng phụ tạo bằng `flask db-upgrade`
+CREATE TABLE IF NOT EXISTS users (
+    id INT AUTO_INCREMENT PRIMARY KEY, username VARCHAR(255) NOT NULL UNIQUE, password VARCHAR(255) NOT NULL, role VARCHAR(50) NOT NULL
+);
+CREATE TABLE IF NOT EXISTS logs (
+    id INT AUTO_INCREMENT PRIMARY KEY, username VARCHAR(255), action VARCHAR(255), message TEXT, created_at DATETIME, is_read INT DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS scanfile (
+    id INT AUTO_INCREMENT PRIMARY KEY, jobno VARCHAR(255), jobno_type VARCHAR(255), pallet VARCHAR(255), pallet_type VARCHAR(255),
+    sku VARCHAR(255), sscc VARCHAR(255), jobscan VARCHAR(255), tag_label VARCHAR(255), time_scan DATETIME(6), userscan VARCHAR(255)
+);
+CREATE TABLE IF NOT EXISTS masterdata (
+    sku VARCHAR(255) PRIMARY KEY, refix VARCHAR(255), weight DOUBLE, length DOUBLE, width DOUBLE,
+    height DOUBLE, cbm DOUBLE, cartonperpallet INT, updated_at DATETIME(6)
+);
+INSERT IGNORE INTO users (username, password, role) VALUES ('admin', '123456', 'admin');
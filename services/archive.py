@@ -0,0 +1,237 @@
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import bindparam, inspect, text
+
+from services import jobs
+
+# Lưu trữ job đã xong ra khỏi bảng nóng scanfile.
+# Job đủ điều kiện: mọi dòng đã có pallet và jobscan (đã scan + in tem), không scan thêm trong N giờ.
+# Dòng được chuyển theo lô sang scanfile_archive (cùng cột + archived_at), job ghi vào archived_jobs.
+# Postgres/MySQL: scanfile_archive phân vùng theo tháng của archived_at -> xóa dữ liệu cũ bằng DROP PARTITION.
+# Đọc job đã lưu trữ (lịch sử, xuất file, in lại tem): table_for() trả về bảng cần đọc.
+# Trong lúc chuyển (mỗi lô commit riêng) archived_jobs.state = archiving/restoring: dữ liệu job nằm ở
+# cả hai bảng -> table_for() từ chối (JobMoving) thay vì trả dữ liệu thiếu; chạy lại lệnh để chuyển tiếp.
+# Khi thêm cột mới cho scanfile, thêm cùng cột cho scanfile_archive.
+
+ARCHIVE_TABLE = 'scanfile_archive'
+
+FINISHED = "pallet IS NOT NULL AND pallet != '' AND jobscan IS NOT NULL AND jobscan != ''"
+UNFINISHED = "pallet IS NULL OR pallet = '' OR jobscan IS NULL OR jobscan = ''"
+
+# archived_jobs.state (NULL ở dòng tạo trước migration 016 = archived)
+ARCHIVING = 'archiving'
+ARCHIVED = 'archived'
+RESTORING = 'restoring'
+
+
+class JobMoving(Exception):
+    pass
+
+
+def _dialect(session):
+    return session.get_bind().dialect.name
+
+
+def _month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def _next_month(value):
+    return date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def ensure_partition(session, when):
+    """Tạo phân vùng tháng chứa `when` (Postgres/MySQL). SQLite: không làm gì."""
+    start = _month_start(when)
+    end = _next_month(start)
+    name = f"{ARCHIVE_TABLE}_{start:%Y%m}"
+    dialect = _dialect(session)
+    if dialect == 'postgresql':
+        session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {ARCHIVE_TABLE} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+    elif dialect == 'mysql':
+        partitions = {row[0] for row in session.execute(text("""
+            SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL
+        """), {'table': ARCHIVE_TABLE})}
+        partition = f"p{start:%Y%m}"
+        if 'pmax' in partitions and partition not in partitions:
+            session.execute(text(f"""
+                ALTER TABLE {ARCHIVE_TABLE} REORGANIZE PARTITION pmax INTO (
+                    PARTITION {partition} VALUES LESS THAN (TO_DAYS('{end.isoformat()}')),
+                    PARTITION pmax VALUES LESS THAN MAXVALUE
+                )
+            """))
+
+
+# --- ĐỌC ---
+
+def job_state(session, job_type):
+    """None (đang làm, ở scanfile) | ARCHIVING | ARCHIVED | RESTORING."""
+    row = session.execute(text("SELECT state FROM archived_jobs WHERE jobno_type = :job_type"), {'job_type': job_type}).fetchone()
+    if row is None:
+        return None
+    return row[0] or ARCHIVED
+
+
+def is_archived(session, job_type):
+    """Job có dòng trong archived_jobs (đã lưu trữ hoặc đang chuyển dở)."""
+    return job_state(session, job_type) is not None
+
+
+def table_for(session, job_type):
+    """Bảng chứa dữ liệu của job: scanfile (đang làm) hoặc scanfile_archive (đã lưu trữ).
+
+    Job đang chuyển giữa hai bảng -> JobMoving (mỗi bảng chỉ có một phần dữ liệu).
+    """
+    state = job_state(session, job_type)
+    if state is None:
+        return 'scanfile'
+    if state == ARCHIVED:
+        return ARCHIVE_TABLE
+    action = 'lưu trữ' if state == ARCHIVING else 'khôi phục'
+    raise JobMoving(f"Job {job_type} đang được {action} - thử lại sau ít phút")
+
+
+def all_rows(columns):
+    """Nguồn dữ liệu gồm cả job đang làm và job đã lưu trữ (dùng khi tính lại bảng tổng hợp)."""
+    select = ', '.join(columns)
+    return f"(SELECT {select} FROM scanfile UNION ALL SELECT {select} FROM {ARCHIVE_TABLE}) AS s"
+
+
+def archived_jobs(session):
+    rows = session.execute(text("SELECT jobno_type, row_count, archived_at, state FROM archived_jobs ORDER BY archived_at DESC"))
+    return [{'job_type': row[0], 'rows': row[1], 'archived_at': row[2], 'state': row[3] or ARCHIVED} for row in rows]
+
+
+def eligible_jobs(session, idle_hours=24):
+    """Job đã xong hết (pallet + jobscan) và không có scan mới trong `idle_hours` giờ: list (job_type, số dòng)."""
+    cutoff = datetime.now() - timedelta(hours=idle_hours)
+    query = text(f"""
+        SELECT jobno_type, COUNT(id) FROM scanfile
+        WHERE jobno_type IS NOT NULL AND jobno_type != ''
+        GROUP BY jobno_type
+        HAVING SUM(CASE WHEN {UNFINISHED} THEN 1 ELSE 0 END) = 0
+           AND (MAX(time_scan) IS NULL OR MAX(time_scan) < :cutoff)
+        ORDER BY jobno_type
+    """)
+    return [(row[0], row[1]) for row in session.execute(query, {'cutoff': cutoff})]
+
+
+def interrupted_jobs(session):
+    """Job bị ngắt giữa lúc lưu trữ (có thể đã chuyển hết dòng nên không còn trong eligible_jobs)."""
+    rows = session.execute(text("SELECT jobno_type, row_count FROM archived_jobs WHERE state = :state ORDER BY jobno_type"),
+                           {'state': ARCHIVING})
+    return [(row[0], row[1]) for row in rows]
+
+
+# --- CHUYỂN DỮ LIỆU ---
+
+class JobArchiver:
+    """Chuyển dòng của job giữa scanfile và scanfile_archive theo lô.
+
+    Mỗi lô commit riêng để không giữ khóa lâu trên bảng nóng. Trạng thái archiving/restoring được
+    commit trước lô đầu tiên: bị ngắt giữa chừng thì chạy lại archive()/restore() để chuyển tiếp.
+    Nếu job thay đổi trong lúc chuyển (vd. có thùng bị gỡ khỏi pallet), các dòng đã chuyển được trả lại scanfile.
+    Bộ đếm scan_counters và bảng tổng hợp /stats của job được giữ nguyên.
+    """
+
+    def __init__(self, session, batch_size=5000, log=print):
+        self.session = session
+        self.batch_size = batch_size
+        self.log = log
+        bind = session.get_bind()
+        live = {c['name'] for c in inspect(bind).get_columns('scanfile')}
+        archived = {c['name'] for c in inspect(bind).get_columns(ARCHIVE_TABLE)}
+        self.columns = sorted(live & archived)
+        self.lock_sql = 'FOR UPDATE' if _dialect(session) in ('mysql', 'postgresql') else ''
+
+    def _move(self, source, target, job_type, condition, extra_column=None, extra_value=None):
+        """Chuyển một lô. Trả về số dòng đã chuyển (0 = hết)."""
+        select_ids = text(f"SELECT id FROM {source} WHERE jobno_type = :job_type AND {condition} ORDER BY id LIMIT :limit {self.lock_sql}")
+        ids = [row[0] for row in self.session.execute(select_ids, {'job_type': job_type, 'limit': self.batch_size})]
+        if not ids:
+            return 0
+        columns = ', '.join(self.columns)
+        target_columns, values, params = columns, columns, {'ids': ids}
+        if extra_column:
+            target_columns += f", {extra_column}"
+            values += f", :{extra_column}"
+            params[extra_column] = extra_value
+        insert = text(f"INSERT INTO {target} ({target_columns}) SELECT {values} FROM {source} WHERE id IN :ids AND {condition}")
+        delete = text(f"DELETE FROM {source} WHERE id IN :ids AND {condition}")
+        inserted = self.session.execute(insert.bindparams(bindparam('ids', expanding=True)), params).rowcount
+        deleted = self.session.execute(delete.bindparams(bindparam('ids', expanding=True)), {'ids': ids}).rowcount
+        if inserted != deleted:
+            self.session.rollback()
+            raise RuntimeError(f"[{job_type}] dữ liệu thay đổi trong lúc chuyển ({inserted} != {deleted})")
+        self.session.commit()
+        return deleted
+
+    def archive(self, job_type):
+        """Lưu trữ một job. Trả về dict kết quả; status: archived | skipped | rolled_back."""
+        started = time.perf_counter()
+        state = job_state(self.session, job_type)
+        if state == ARCHIVED:
+            return {'job_type': job_type, 'status': 'skipped', 'message': 'Job đã được lưu trữ'}
+        if state == RESTORING:
+            return {'job_type': job_type, 'status': 'skipped', 'message': 'Job đang khôi phục dở - chạy archive-restore trước'}
+        unfinished = self.session.execute(
+            text(f"SELECT COUNT(id) FROM scanfile WHERE jobno_type = :job_type AND ({UNFINISHED})"), {'job_type': job_type}
+        ).scalar()
+        if unfinished:
+            return {'job_type': job_type, 'status': 'skipped', 'message': f'Còn {unfinished} thùng chưa scan/in tem'}
+
+        now = datetime.now()
+        ensure_partition(self.session, now)
+        if state is None:
+            self.session.execute(
+                text("INSERT INTO archived_jobs (jobno_type, row_count, archived_at, state) VALUES (:job_type, 0, :now, :state)"),
+                {'job_type': job_type, 'now': now, 'state': ARCHIVING}
+            )
+            self.session.commit()
+        # Chạy tiếp lần lưu trữ bị ngắt: cộng cả các dòng đã chuyển trước đó
+        moved = self.session.execute(
+            text(f"SELECT COUNT(id) FROM {ARCHIVE_TABLE} WHERE jobno_type = :job_type"), {'job_type': job_type}
+        ).scalar()
+        while True:
+            n = self._move('scanfile', ARCHIVE_TABLE, job_type, FINISHED, 'archived_at', now)
+            if not n:
+                break
+            moved += n
+            self.log(f"[{job_type}] đã chuyển {moved} dòng")
+
+        remaining = self.session.execute(text("SELECT COUNT(id) FROM scanfile WHERE jobno_type = :job_type"), {'job_type': job_type}).scalar()
+        if remaining:
+            # Job có thùng mới/bị gỡ trong lúc chuyển -> trả lại toàn bộ, giữ job ở bảng nóng
+            self.restore(job_type)
+            return {'job_type': job_type, 'status': 'rolled_back',
+                    'message': f'Job thay đổi trong lúc lưu trữ ({remaining} dòng chưa xong), đã trả lại scanfile'}
+
+        self.session.execute(
+            text("UPDATE archived_jobs SET row_count = :rows, archived_at = :now, state = :state WHERE jobno_type = :job_type"),
+            {'job_type': job_type, 'rows': moved, 'now': now, 'state': ARCHIVED}
+        )
+        jobs.set_status(self.session, job_type, jobs.CLOSED)
+        self.session.commit()
+        return {'job_type': job_type, 'status': 'archived', 'rows': moved, 'seconds': round(time.perf_counter() - started, 3)}
+
+    def restore(self, job_type):
+        """Trả job đã lưu trữ (hoặc đang chuyển dở) về scanfile (vd. cần scan bổ sung). Trả về số dòng."""
+        self.session.execute(text("UPDATE archived_jobs SET state = :state WHERE jobno_type = :job_type"),
+                             {'job_type': job_type, 'state': RESTORING})
+        self.session.commit()
+        moved = 0
+        while True:
+            n = self._move(ARCHIVE_TABLE, 'scanfile', job_type, '1 = 1')
+            if not n:
+                break
+            moved += n
+        # Chỉ xóa đánh dấu khi mọi dòng đã về scanfile
+        self.session.execute(text("DELETE FROM archived_jobs WHERE jobno_type = :job_type"), {'job_type': job_type})
+        jobs.set_status(self.session, job_type, jobs.ACTIVE)
+        self.session.commit()
+        return moved
@@ -0,0 +1,298 @@
+import json
+import re
+import time
+from collections import namedtuple
+
+# Đọc mã vạch trên worker trước mọi truy vấn DB: bỏ AIM symbology ID máy quét gửi kèm (vd. ]C1 = GS1-128),
+# kiểm tra độ dài/ký tự, tách GS1 application identifier (AI) và số kiểm tra SSCC/GTIN, rồi lấy prefix (refix)
+# theo quy tắc của từng nhà cung cấp (MANCC). Quy tắc được biên dịch một lần khi khởi động; mã quét lỗi
+# (sai số kiểm tra, ký tự lạ, sai loại mã) bị từ chối trong vài micro giây, không tốn lần tra masterdata.
+#
+# Quy tắc (JSON, quy tắc đầu tiên khớp được dùng):
+#   {"mancc": "NCC01", "source": "01", "match": "^0893", "slice": [-6, -1]}
+#   source: "raw" = cả mã (đã bỏ symbology ID), hoặc số AI (vd. "01" = GTIN, "00" = SSCC) - mã không có AI đó thì bỏ qua
+#   match:  regex (tùy chọn) khớp từ đầu giá trị nguồn
+#   slice:  [start, end] kiểu Python trên giá trị nguồn; mặc định [-6, -1] (5 ký tự trước ký tự cuối - như trước đây)
+
+DEFAULT_RULES = '[{"mancc": "*", "source": "raw", "slice": [-6, -1]}]'
+
+GS = '\x1d'
+
+# AI GS1 hay gặp trên nhãn thùng: AI -> (độ dài cố định hoặc None, độ dài tối đa, chỉ số, có số kiểm tra)
+GS1_AIS = {
+    '00': (18, 18, True, True),     # SSCC
+    '01': (14, 14, True, True),     # GTIN
+    '02': (14, 14, True, True),     # GTIN hàng bên trong
+    '10': (None, 20, False, False),  # số lô
+    '11': (6, 6, True, False),      # ngày sản xuất
+    '12': (6, 6, True, False),
+    '13': (6, 6, True, False),      # ngày đóng gói
+    '15': (6, 6, True, False),
+    '16': (6, 6, True, False),
+    '17': (6, 6, True, False),      # hạn dùng
+    '20': (2, 2, True, False),
+    '21': (None, 20, False, False),  # số serial
+    '22': (None, 20, False, False),
+    '240': (None, 30, False, False),
+    '241': (None, 30, False, False),
+    '250': (None, 30, False, False),
+    '251': (None, 30, False, False),
+    '30': (None, 8, True, False),   # số lượng
+    '37': (None, 8, True, False),   # số đơn vị thương mại trong thùng
+    '400': (None, 30, False, False),  # số đơn hàng
+    '401': (None, 30, False, False),
+    '402': (17, 17, True, True),    # GSIN
+    '403': (None, 30, False, False),
+    '420': (None, 20, False, False),
+    '421': (None, 12, False, False),
+    '422': (3, 3, True, False),
+    '90': (None, 30, False, False),
+}
+# 310n-369n: số đo (khối lượng, kích thước...) - 6 chữ số, n = vị trí dấu thập phân
+for _ai in range(310, 370):
+    for _n in range(10):
+        GS1_AIS[f'{_ai}{_n}'] = (6, 6, True, False)
+# 410-417: GLN (địa điểm giao/nhận)
+for _ai in range(410, 418):
+    GS1_AIS[str(_ai)] = (13, 13, True, True)
+# 91-99: dữ liệu nội bộ công ty
+for _ai in range(91, 100):
+    GS1_AIS[str(_ai)] = (None, 90, False, False)
+
+# Symbology có thể mang dữ liệu GS1 (AIM ID): GS1-128, GS1 DataBar, GS1 DataMatrix, GS1 QR
+GS1_SYMBOLOGIES = ('C1', 'e0', 'd2', 'Q3')
+# Mã số thuần không có AI: độ dài -> loại mã có số kiểm tra
+PLAIN_CHECKED = {8: 'GTIN-8', 12: 'GTIN-12', 13: 'GTIN-13', 14: 'GTIN-14', 18: 'SSCC'}
+
+_SYMBOLOGY = re.compile(r'\](\w\w)')
+_PRINTABLE = re.compile(r'[\x20-\x7e\x1d]*')
+_BRACKETED = re.compile(r'\((\d{2,4})\)([^(]*)')
+
+
+class CheckDigitError(ValueError):
+    """Sai số kiểm tra (SSCC/GTIN/GLN) - thường là quét lỗi."""
+
+
+Parsed = namedtuple('Parsed', ['barcode', 'prefix', 'mancc', 'ais', 'error', 'reason'])
+Rule = namedtuple('Rule', ['mancc', 'source', 'match', 'start', 'end'])
+
+
+def check_digit(digits):
+    """Số kiểm tra GS1 (mod 10, trọng số 3-1 tính từ phải) cho phần dữ liệu không gồm số kiểm tra."""
+    total = 0
+    weight = 3
+    for d in reversed(digits):
+        total += (ord(d) - 48) * weight
+        weight = 4 - weight
+    return (10 - total % 10) % 10
+
+
+def valid_check_digit(digits):
+    return digits.isdigit() and len(digits) > 1 and check_digit(digits[:-1]) == ord(digits[-1]) - 48
+
+
+def compile_rules(spec):
+    """JSON (chuỗi hoặc list) -> [Rule]. Sai cấu hình -> ValueError (báo ngay khi khởi động)."""
+    items = json.loads(spec) if isinstance(spec, str) else spec
+    if not isinstance(items, list) or not items:
+        raise ValueError("BARCODE_PREFIX_RULES phải là danh sách JSON có ít nhất 1 quy tắc")
+    rules = []
+    for n, item in enumerate(items, start=1):
+        if not isinstance(item, dict):
+            raise ValueError(f"Quy tắc prefix #{n} phải là object JSON")
+        source = str(item.get('source', 'raw'))
+        if source != 'raw' and source not in GS1_AIS:
+            raise ValueError(f"Quy tắc prefix #{n}: AI {source} không hỗ trợ")
+        bounds = item.get('slice', [-6, -1])
+        if not isinstance(bounds, list) or len(bounds) != 2:
+            raise ValueError(f"Quy tắc prefix #{n}: slice phải có dạng [start, end]")
+        try:
+            match = re.compile(item['match']) if item.get('match') else None
+        except re.error as e:
+            raise ValueError(f"Quy tắc prefix #{n}: regex không hợp lệ ({e})")
+        rules.append(Rule(str(item.get('mancc', '*')), source, match,
+                          None if bounds[0] is None else int(bounds[0]), None if bounds[1] is None else int(bounds[1])))
+    return rules
+
+
+def parse_gs1(data, check_digits=True):
+    """Chuỗi GS1 (dạng (01)...(21)... hoặc AI liền nhau, trường độ dài thay đổi kết thúc bằng GS) -> {AI: giá trị}.
+
+    Sai cấu trúc -> ValueError, sai số kiểm tra (khi `check_digits`) -> CheckDigitError (kèm thông báo).
+    """
+    ais = {}
+    if data.startswith('('):
+        parts = _BRACKETED.findall(data)
+        if ''.join(f'({ai}){value}' for ai, value in parts) != data:
+            raise ValueError('Mã vạch GS1 không hợp lệ (sai dạng (AI)giá trị)')
+        for ai, value in parts:
+            _put_ai(ais, ai, value.rstrip(GS), check_digits)
+        return ais
+    pos = 0
+    end = len(data)
+    while pos < end:
+        if data[pos] == GS:
+            pos += 1
+            continue
+        ai = next((data[pos:pos + n] for n in (2, 3, 4) if data[pos:pos + n] in GS1_AIS), None)
+        if ai is None:
+            raise ValueError(f'Mã vạch GS1 không hợp lệ (AI không nhận dạng được tại vị trí {pos + 1})')
+        fixed, max_len, _, _ = GS1_AIS[ai]
+        pos += len(ai)
+        if fixed:
+            value = data[pos:pos + fixed]
+            pos += fixed
+        else:
+            stop = data.find(GS, pos)
+            stop = end if stop < 0 else stop
+            value = data[pos:stop]
+            pos = stop
+        _put_ai(ais, ai, value, check_digits)
+    return ais
+
+
+def _put_ai(ais, ai, value, check_digits):
+    spec = GS1_AIS.get(ai)
+    if spec is None:
+        raise ValueError(f'Mã vạch GS1 không hợp lệ (AI {ai} không hỗ trợ)')
+    fixed, max_len, numeric, checked = spec
+    if (fixed and len(value) != fixed) or not value or len(value) > max_len:
+        raise ValueError(f'Mã vạch GS1 không hợp lệ (AI {ai} sai độ dài)')
+    if numeric and not value.isdigit():
+        raise ValueError(f'Mã vạch GS1 không hợp lệ (AI {ai} phải là số)')
+    if checked and check_digits and not valid_check_digit(value):
+        raise CheckDigitError(f'Mã vạch sai số kiểm tra (AI {ai}) - quét lại')
+    if ai in ais:
+        raise ValueError(f'Mã vạch GS1 không hợp lệ (AI {ai} lặp lại)')
+    ais[ai] = value
+
+
+class BarcodeParser:
+    """Kiểm tra + lấy prefix của mã vạch hoàn toàn trong RAM (không truy vấn DB)."""
+
+    def __init__(self, rules=DEFAULT_RULES, min_length=10, max_length=100, symbologies=(), check_digits=False):
+        """symbologies: AIM ID được nhận (vd. ['C', 'E0'] - 'C' nhận mọi Code 128); rỗng = nhận mọi loại.
+        Mã không kèm symbology ID (máy quét không bật) luôn được nhận.
+        check_digits: từ chối mã sai số kiểm tra SSCC/GTIN/GLN (mã số thuần 8/12/13/14/18 ký tự và AI GS1).
+        Mặc định tắt - trước đây các mã này vẫn scan được; bật theo từng nơi triển khai.
+        max_length: kiểm tra cả trên mã đã chuẩn hóa (dạng lưu vào scanned_barcodes)."""
+        self.rules = compile_rules(rules)
+        self.min_length = min_length
+        self.max_length = max_length
+        self.symbologies = tuple(s for s in symbologies if s)
+        self.check_digits = check_digits
+        self.parsed = 0
+        self.rejected = {}
+        self.rule_hits = [0] * len(self.rules)
+
+    def _reject(self, barcode, reason, message):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return Parsed(barcode, None, None, None, message, reason)
+
+    def parse(self, raw):
+        """Mã quét -> Parsed. Lỗi: `error` là thông báo cho máy quét, `reason` là loại lỗi (length, charset,
+        symbology, check_digit, gs1, rule); hợp lệ: `barcode` đã chuẩn hóa, `prefix` để tra masterdata."""
+        barcode = str(raw or '').strip()
+        symbology = None
+        if barcode.startswith(']'):
+            m = _SYMBOLOGY.match(barcode)
+            if m:
+                symbology = m.group(1)
+                barcode = barcode[3:]
+                if self.symbologies and not symbology.startswith(self.symbologies):
+                    return self._reject(barcode, 'symbology', f'Sai loại mã vạch (]{symbology}) - quét mã trên nhãn thùng')
+        if len(barcode) < self.min_length:
+            return self._reject(barcode, 'length', f'Mã vạch không hợp lệ (cần >= {self.min_length} ký tự)')
+        if len(barcode) > self.max_length:
+            return self._reject(barcode, 'length', f'Mã vạch không hợp lệ (tối đa {self.max_length} ký tự)')
+        if _PRINTABLE.fullmatch(barcode) is None:
+            return self._reject(barcode, 'charset', 'Mã vạch không hợp lệ (ký tự lạ - quét lại)')
+
+        ais = None
+        if symbology in GS1_SYMBOLOGIES or barcode[0] == '(' or GS in barcode:
+            try:
+                ais = parse_gs1(barcode, self.check_digits)
+            except CheckDigitError as e:
+                return self._reject(barcode, 'check_digit', str(e))
+            except ValueError as e:
+                return self._reject(barcode, 'gs1', str(e))
+            # Dạng chuẩn (AI)giá trị: cùng một thùng dù máy quét gửi dạng có ngoặc hay AI liền nhau + GS
+            barcode = ''.join(f'({ai}){value}' for ai, value in ais.items())
+            if len(barcode) > self.max_length:
+                # Dạng (AI) dài hơn mã quét (thêm ngoặc) - vẫn phải vừa cột barcode khi lưu
+                return self._reject(barcode, 'length', f'Mã vạch không hợp lệ (tối đa {self.max_length} ký tự)')
+        elif self.check_digits and len(barcode) in PLAIN_CHECKED and barcode.isdigit() and not valid_check_digit(barcode):
+            return self._reject(barcode, 'check_digit', f'Mã vạch sai số kiểm tra ({PLAIN_CHECKED[len(barcode)]}) - quét lại')
+
+        for n, rule in enumerate(self.rules):
+            if rule.source == 'raw':
+                value = barcode
+            elif ais and rule.source in ais:
+                value = ais[rule.source]
+            else:
+                continue
+            if rule.match is not None and rule.match.match(value) is None:
+                continue
+            prefix = value[rule.start:rule.end]
+            if not prefix:
+                continue
+            self.rule_hits[n] += 1
+            self.parsed += 1
+            return Parsed(barcode, prefix, rule.mancc, ais, None, None)
+        return self._reject(barcode, 'rule', 'Mã vạch không khớp quy tắc prefix nào (BARCODE_PREFIX_RULES)')
+
+    def parse_many(self, raws):
+        """Cả lô (scan_batch): list Parsed cùng thứ tự."""
+        parse = self.parse
+        return [parse(raw) for raw in raws]
+
+    def stats(self):
+        return {
+            'parsed': self.parsed,
+            'rejected': dict(self.rejected),
+            'rules': [{'mancc': rule.mancc, 'source': rule.source, 'match': rule.match.pattern if rule.match else None,
+                       'slice': [rule.start, rule.end], 'hits': hits} for rule, hits in zip(self.rules, self.rule_hits)],
+            'symbologies': list(self.symbologies),
+        }
+
+
+def sample_barcodes(count=1000):
+    """Mẫu đo tốc độ: mã cũ 10 ký tự, SSCC, GTIN-14, GS1-128 (có/không ngoặc) và mã quét lỗi."""
+    samples = []
+    for n in range(count):
+        body = f'{n:017d}'
+        sscc = body + str(check_digit(body))
+        gtin = f'{n % 10 ** 13:013d}'
+        gtin += str(check_digit(gtin))
+        kind = n % 6
+        if kind == 0:
+            samples.append(f'{n:05d}123450')
+        elif kind == 1:
+            samples.append(sscc)
+        elif kind == 2:
+            samples.append(f']C101{gtin}10LOT{n % 97}{GS}21{n}')
+        elif kind == 3:
+            samples.append(f'(00){sscc}(01){gtin}')
+        elif kind == 4:
+            samples.append(sscc[:-1] + str((int(sscc[-1]) + 1) % 10))   # sai số kiểm tra
+        else:
+            samples.append(f']Q1{n:012d}')                               # QR (sai loại mã nếu lọc symbology)
+    return samples
+
+
+def benchmark(parser, barcodes, rounds=5):
+    """Thời gian parse trung bình (micro giây/mã) qua `rounds` lượt, lấy lượt nhanh nhất (ít nhiễu nhất)."""
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        results = parser.parse_many(barcodes)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    valid = sum(1 for r in results if r.error is None)
+    return {
+        'barcodes': len(barcodes),
+        'valid': valid,
+        'rejected': len(barcodes) - valid,
+        'us_per_barcode': round(best / len(barcodes) * 1e6, 3) if barcodes else 0.0,
+        'barcodes_per_second': round(len(barcodes) / best) if best else 0,
+    }
@@ -0,0 +1,164 @@
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from services.importer import not_null_filler
+
+# Dòng scanfile vừa được gán pallet. userscan/time_scan: sau khi gán, prev_user/prev_time: trước khi gán
+# (thùng bị gỡ rồi scan lại vẫn giữ userscan/time_scan cũ - cần cho thống kê theo user và năng suất)
+ClaimedRow = namedtuple('ClaimedRow', ['id', 'jobno', 'sku', 'pallet_type', 'userscan', 'prev_user', 'time_scan', 'prev_time'])
+
+WAITING = "jobno_type = :job_type AND sku = :sku AND (pallet IS NULL OR pallet = '')"
+
+
+def _dialect(session):
+    return session.get_bind().dialect.name
+
+
+def _set_clause(values):
+    return ', '.join(f"{column} = :{column}" for column in values)
+
+
+def claim_sql(dialect, columns, limit_sql=''):
+    """Câu query chọn thùng chờ để gán (Postgres: gán luôn và trả về dòng đã gán). columns: cột được ghi."""
+    if dialect == 'postgresql':
+        return f"""
+            UPDATE scanfile AS s SET {_set_clause(columns)}
+            FROM (SELECT id, userscan, time_scan FROM scanfile WHERE {WAITING} {limit_sql} FOR UPDATE SKIP LOCKED) AS prev
+            WHERE s.id = prev.id AND (s.pallet IS NULL OR s.pallet = '')
+            RETURNING s.id, s.jobno, s.sku, prev.userscan, prev.time_scan
+        """
+    lock = ' FOR UPDATE SKIP LOCKED' if dialect == 'mysql' else ''
+    return f"SELECT id, jobno, sku, userscan, time_scan FROM scanfile WHERE {WAITING} {limit_sql}{lock}"
+
+
+def claim_cartons(session, job_type, sku, limit, pallet, pallet_type, userscan=None, time_scan=None):
+    """Gán tối đa `limit` thùng đang chờ của SKU vào pallet bằng một thao tác nguyên tử.
+
+    `limit=None` gán tất cả. Không commit - caller commit cùng các thay đổi khác.
+    Hai request đồng thời không bao giờ nhận cùng một dòng:
+    - Postgres: UPDATE ... FROM (SELECT ... FOR UPDATE SKIP LOCKED) RETURNING
+    - MySQL 8: SELECT ... FOR UPDATE SKIP LOCKED rồi UPDATE theo id trong cùng transaction
+    - SQLite: SELECT rồi UPDATE theo id có điều kiện pallet rỗng (SQLite chỉ có 1 writer)
+    """
+    values = {'pallet': pallet, 'pallet_type': pallet_type}
+    if userscan is not None:
+        values['userscan'] = userscan
+    if time_scan is not None:
+        values['time_scan'] = time_scan
+    params = dict(values, job_type=job_type, sku=sku)
+    limit_sql = ''
+    if limit is not None:
+        limit_sql = 'LIMIT :limit'
+        params['limit'] = int(limit)
+
+    def claimed_row(row_id, jobno, row_sku, prev_user, prev_time):
+        return ClaimedRow(row_id, jobno, row_sku, pallet_type,
+                          userscan if userscan is not None else prev_user, prev_user,
+                          time_scan if time_scan is not None else prev_time, prev_time)
+
+    dialect = _dialect(session)
+    claim_query = text(claim_sql(dialect, values, limit_sql))
+    if dialect == 'postgresql':
+        return [claimed_row(*row) for row in session.execute(claim_query, params)]
+
+    update_query = text(f"UPDATE scanfile SET {_set_clause(values)} WHERE id IN :ids AND (pallet IS NULL OR pallet = '')")
+    update_query = update_query.bindparams(bindparam('ids', expanding=True))
+    if dialect == 'mysql':
+        rows = [claimed_row(*row) for row in session.execute(claim_query, params)]
+        if rows:
+            session.execute(update_query, dict(values, ids=[row.id for row in rows]))
+        return rows
+
+    # SQLite: đọc userscan cũ trước khi gán; dòng bị request khác gán mất giữa 2 câu -> lấy bù
+    claimed = []
+    for _ in range(5):
+        candidates = {row[0]: row for row in session.execute(claim_query, params)}
+        if not candidates:
+            break
+        returning = text(f"{update_query.text} RETURNING id").bindparams(bindparam('ids', expanding=True))
+        won = [row[0] for row in session.execute(returning, dict(values, ids=list(candidates)))]
+        claimed.extend(claimed_row(*candidates[row_id]) for row_id in won)
+        if limit is None or len(claimed) >= int(limit) or len(won) == len(candidates):
+            break
+        params['limit'] = int(limit) - len(claimed)
+    return claimed
+
+
+# --- KIỂM TRA TẢI ĐỒNG THỜI (flask --app app claim-stress) ---
+
+def run_stress(engine, threads=8, cartons=1000, batch=1, log=print):
+    """Cho nhiều luồng tranh nhau claim cùng một job tạm và kiểm tra không có dòng bị claim 2 lần."""
+    job_type = f"__stress_{uuid.uuid4().hex[:8]}"
+    row = {'jobno': job_type, 'jobno_type': job_type, 'sku': 'STRESS', 'pallet': ''}
+    # Cột NOT NULL khác (DB production) -> giá trị rỗng như khi nạp file scanfile
+    for col in inspect(engine).get_columns('scanfile'):
+        value = not_null_filler(col)
+        if col['name'] not in row and col['name'] != 'sscc' and value is not None:
+            row[col['name']] = value
+    columns = list(row) + ['sscc']
+    insert = text(f"INSERT INTO scanfile ({', '.join(columns)}) VALUES ({', '.join(':' + name for name in columns)})")
+    with engine.begin() as conn:
+        conn.execute(insert, [dict(row, sscc=f"{job_type}-{i}") for i in range(cartons)])
+
+    claimed = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(n):
+        mine = []
+        with Session(engine) as session:
+            while True:
+                try:
+                    rows = claim_cartons(session, job_type, 'STRESS', batch, pallet=str(n), pallet_type='stress',
+                                         userscan=f"stress-{n}", time_scan=datetime.now())
+                    session.commit()
+                except OperationalError as e:
+                    # SQLite "database is locked" / MySQL deadlock -> thử lại
+                    session.rollback()
+                    with lock:
+                        errors.append(str(e.orig))
+                    continue
+                if not rows:
+                    break
+                mine.extend(row.id for row in rows)
+        with lock:
+            claimed.extend(mine)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    try:
+        with engine.connect() as conn:
+            assigned = conn.execute(
+                text("SELECT COUNT(id) FROM scanfile WHERE jobno_type = :job_type AND pallet != ''"), {'job_type': job_type}
+            ).fetchone()[0]
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM scanfile WHERE jobno_type = :job_type"), {'job_type': job_type})
+
+    report = {
+        'dialect': engine.dialect.name,
+        'threads': threads,
+        'cartons': cartons,
+        'batch': batch,
+        'claims': len(claimed),
+        'double_claims': len(claimed) - len(set(claimed)),
+        'unclaimed': cartons - assigned,
+        'retries': len(errors),
+        'seconds': round(elapsed, 3),
+        'claims_per_second': round(len(claimed) / elapsed, 1) if elapsed else 0.0,
+    }
+    log(report)
+    return report
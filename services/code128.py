@@ -0,0 +1,89 @@
+# Bộ mã hóa Code 128 (set B + C) tự viết - không phụ thuộc thư viện ngoài.
+# Mỗi ký hiệu là 6 độ rộng xen kẽ vạch/khoảng trắng (tổng 11 module), STOP có 7 độ rộng.
+
+PATTERNS = [
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213', '122312', '132212', '221213',
+    '221312', '231212', '112232', '122132', '122231', '113222', '123122', '123221', '223211', '221132',
+    '221231', '213212', '223112', '312131', '311222', '321122', '321221', '312212', '322112', '322211',
+    '212123', '212321', '232121', '111323', '131123', '131321', '112313', '132113', '132311', '211313',
+    '231113', '231311', '112133', '112331', '132131', '113123', '113321', '133121', '313121', '211331',
+    '231131', '213113', '213311', '213131', '311123', '311321', '331121', '312113', '312311', '332111',
+    '314111', '221411', '431111', '111224', '111422', '121124', '121421', '141122', '141221', '112214',
+    '112412', '122114', '122411', '142112', '142211', '241211', '221114', '413111', '241112', '134111',
+    '111242', '121142', '121241', '114212', '124112', '124211', '411212', '421112', '421211', '212141',
+    '214121', '412121', '111143', '111341', '131141', '114113', '114311', '411113', '411311', '113141',
+    '114131', '311141', '411131', '211412', '211214', '211232', '2331112',
+]
+
+CODE_C = 99
+CODE_B = 100
+START_B = 104
+START_C = 105
+STOP = 106
+QUIET_ZONE = 10
+
+
+def _digit_run(data, i):
+    n = 0
+    while i + n < len(data) and data[i + n].isdigit():
+        n += 1
+    return n
+
+
+def encode(data):
+    """Chuỗi ASCII 32-126 -> danh sách giá trị ký hiệu (gồm START, checksum, STOP).
+
+    Dùng set C (2 chữ số/ký hiệu) cho các đoạn số dài -> SSCC 18-20 số ngắn gần một nửa.
+    """
+    data = str(data)
+    if not data:
+        raise ValueError("Code 128: dữ liệu rỗng")
+    for ch in data:
+        if not 32 <= ord(ch) <= 126:
+            raise ValueError(f"Code 128: ký tự không hỗ trợ {ch!r}")
+
+    values = []
+    current = None
+    i = 0
+    while i < len(data):
+        run = _digit_run(data, i)
+        at_start, at_end = i == 0, i + run == len(data)
+        use_c = run >= 4 and (at_start or at_end or run >= 6) or (run == 2 and at_start and at_end)
+        if use_c:
+            if run % 2:
+                # Số lẻ chữ số: chữ số đầu mã hóa bằng set B
+                if current != 'B':
+                    values.append(START_B if current is None else CODE_B)
+                    current = 'B'
+                values.append(ord(data[i]) - 32)
+                i += 1
+                run -= 1
+            if current != 'C':
+                values.append(START_C if current is None else CODE_C)
+                current = 'C'
+            for j in range(i, i + run, 2):
+                values.append(int(data[j:j + 2]))
+            i += run
+            continue
+        if current != 'B':
+            values.append(START_B if current is None else CODE_B)
+            current = 'B'
+        values.append(ord(data[i]) - 32)
+        i += 1
+
+    checksum = values[0] + sum(position * value for position, value in enumerate(values[1:], start=1))
+    values.append(checksum % 103)
+    values.append(STOP)
+    return values
+
+
+def widths(data):
+    """Độ rộng (số module) xen kẽ vạch, khoảng trắng, ... bắt đầu bằng vạch."""
+    result = []
+    for value in encode(data):
+        result.extend(int(w) for w in PATTERNS[value])
+    return result
+
+
+def total_modules(data):
+    return sum(widths(data))
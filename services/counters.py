@@ -0,0 +1,323 @@
+from collections import Counter
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+# Bảng scan_counters giữ 4 mức đếm trong cùng một khóa (jobno_type, pallet, sku):
+#   (job, '',     '')    -> total/scanned của cả job
+#   (job, '',     sku)   -> total/scanned của SKU trong job
+#   (job, pallet, '')    -> scanned trên pallet
+#   (job, pallet, sku)   -> scanned của SKU trên pallet
+# Mọi thao tác ghi scanfile cập nhật bảng này trong cùng transaction.
+# Dòng (job, '', '') còn giữ `version` - tăng mỗi lần dữ liệu của job thay đổi (dùng cho ETag/cache).
+
+_ready = set()
+# Job vừa tính lại trong transaction đang mở: chỉ đưa vào _ready sau khi commit. Transaction rollback
+# (vd. IntegrityError ở process_scan) thì dòng đếm không tồn tại -> lần sau phải kiểm tra/tính lại.
+_PENDING = 'counters_ready'
+
+
+def _mark_ready(session, job_type):
+    session.info.setdefault(_PENDING, set()).add(job_type)
+
+
+@event.listens_for(Session, 'after_commit')
+def _commit_ready(session):
+    _ready.update(session.info.pop(_PENDING, ()))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_ready(session, previous_transaction):
+    session.info.pop(_PENDING, None)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _end_ready(session, transaction):
+    # Đóng session không commit (transaction gốc kết thúc) -> bỏ job chờ
+    if transaction.parent is None:
+        session.info.pop(_PENDING, None)
+
+
+def _dialect(session):
+    return session.get_bind().dialect.name
+
+
+def _upsert(session, rows, replace=False):
+    """rows: list dict(job_type, pallet, sku, total, scanned[, version]). replace=False -> cộng dồn."""
+    if not rows:
+        return
+    for row in rows:
+        row.setdefault('version', 0)
+    # Khóa dòng theo thứ tự cố định để tránh deadlock giữa các transaction
+    rows = sorted(rows, key=lambda r: (r['job_type'], r['pallet'], r['sku']))
+    if _dialect(session) == 'mysql':
+        if replace:
+            update = "total = VALUES(total), scanned = VALUES(scanned), version = VALUES(version)"
+        else:
+            update = "total = total + VALUES(total), scanned = scanned + VALUES(scanned), version = version + VALUES(version)"
+        sql = f"""
+            INSERT INTO scan_counters (jobno_type, pallet, sku, total, scanned, version)
+            VALUES (:job_type, :pallet, :sku, :total, :scanned, :version)
+            ON DUPLICATE KEY UPDATE {update}
+        """
+    else:
+        if replace:
+            update = "total = excluded.total, scanned = excluded.scanned, version = excluded.version"
+        else:
+            update = ("total = scan_counters.total + excluded.total, scanned = scan_counters.scanned + excluded.scanned, "
+                      "version = scan_counters.version + excluded.version")
+        sql = f"""
+            INSERT INTO scan_counters (jobno_type, pallet, sku, total, scanned, version)
+            VALUES (:job_type, :pallet, :sku, :total, :scanned, :version)
+            ON CONFLICT (jobno_type, pallet, sku) DO UPDATE SET {update}
+        """
+    session.execute(text(sql), rows)
+
+
+# Query nóng (schema.HOT_QUERIES dùng lại để EXPLAIN)
+AGGREGATE_SQL = """
+    SELECT COALESCE(pallet, ''), COALESCE(sku, ''), COUNT(id)
+    FROM scanfile WHERE jobno_type = :job_type
+    GROUP BY COALESCE(pallet, ''), COALESCE(sku, '')
+"""
+SCAN_SUMMARY_SQL = "SELECT pallet, total, scanned FROM scan_counters WHERE jobno_type = :job_type AND sku = '' AND pallet IN ('', :pallet)"
+REMAINING_SKUS_SQL = """
+    SELECT sku, total - scanned FROM scan_counters
+    WHERE jobno_type = :job_type AND pallet = '' AND sku != '' AND total > scanned
+    ORDER BY sku
+"""
+
+
+def _aggregate(session, job_type):
+    """Đếm lại từ scanfile cho một job -> dict {(pallet, sku): (total, scanned)}."""
+    result = {}
+    job_total = job_scanned = 0
+    query = text(AGGREGATE_SQL)
+    sku_totals = Counter()
+    sku_scanned = Counter()
+    pallet_scanned = Counter()
+    for pallet, sku, qty in session.execute(query, {'job_type': job_type}):
+        job_total += qty
+        sku_totals[sku] += qty
+        if pallet != '':
+            job_scanned += qty
+            sku_scanned[sku] += qty
+            pallet_scanned[pallet] += qty
+            result[(pallet, sku)] = (qty, qty)
+    result[('', '')] = (job_total, job_scanned)
+    for sku, total in sku_totals.items():
+        if sku != '':
+            result[('', sku)] = (total, sku_scanned[sku])
+    for pallet, qty in pallet_scanned.items():
+        result[(pallet, '')] = (qty, qty)
+    return result
+
+
+def _stored(session, job_type):
+    query = text("SELECT pallet, sku, total, scanned FROM scan_counters WHERE jobno_type = :job_type")
+    return {(row[0], row[1]): (row[2], row[3]) for row in session.execute(query, {'job_type': job_type})}
+
+
+def _lock_job(session, job_type):
+    # Ghi (+0) vào dòng tổng của job trước khi đếm: các transaction scan cũng ghi dòng này trước tiên
+    # (khóa theo thứ tự), nên lần đếm lại không chạy xen với scan chưa commit và không làm mất số đếm.
+    # SQLite: lệnh ghi đầu tiên giữ khóa ghi của cả DB cho tới khi commit.
+    _upsert(session, [{'job_type': job_type, 'pallet': '', 'sku': '', 'total': 0, 'scanned': 0}])
+
+
+def rebuild_job(session, job_type):
+    """Tính lại toàn bộ bộ đếm của job từ scanfile. Trả về danh sách khóa bị lệch. Không commit."""
+    _lock_job(session, job_type)
+    fresh = _aggregate(session, job_type)
+    stored = _stored(session, job_type)
+    version = job_version(session, job_type) + 1
+    drift = []
+    for key in set(fresh) | set(stored):
+        if fresh.get(key, (0, 0)) != stored.get(key, (0, 0)):
+            drift.append({'pallet': key[0], 'sku': key[1], 'stored': stored.get(key), 'actual': fresh.get(key)})
+
+    session.execute(text("DELETE FROM scan_counters WHERE jobno_type = :job_type"), {'job_type': job_type})
+    _upsert(session, [
+        {'job_type': job_type, 'pallet': pallet, 'sku': sku, 'total': total, 'scanned': scanned,
+         'version': version if (pallet, sku) == ('', '') else 0}
+        for (pallet, sku), (total, scanned) in fresh.items()
+    ], replace=True)
+    _mark_ready(session, job_type)
+    return drift
+
+
+def ensure_job(session, job_type):
+    """Khởi tạo bộ đếm cho job chưa có (job cũ, nạp ngoài app). Trả về True nếu vừa tính lại."""
+    if job_type in _ready or job_type in session.info.get(_PENDING, ()):
+        return False
+    row = session.execute(
+        text("SELECT 1 FROM scan_counters WHERE jobno_type = :job_type AND pallet = '' AND sku = ''"),
+        {'job_type': job_type}
+    ).fetchone()
+    if row:
+        # Không do transaction này tạo (không nằm trong job chờ) -> đã commit
+        _ready.add(job_type)
+        return False
+    rebuild_job(session, job_type)
+    return True
+
+
+def apply_claims(session, job_type, pallet, skus):
+    """Cộng số thùng vừa gán vào pallet. skus: iterable SKU (mỗi phần tử 1 thùng)."""
+    per_sku = Counter(skus)
+    if not per_sku:
+        return
+    if ensure_job(session, job_type):
+        # Vừa đếm lại từ scanfile trong cùng transaction -> đã bao gồm các thùng này
+        return
+    pallet = str(pallet)
+    n = sum(per_sku.values())
+    rows = [
+        {'job_type': job_type, 'pallet': '', 'sku': '', 'total': 0, 'scanned': n, 'version': 1},
+        {'job_type': job_type, 'pallet': pallet, 'sku': '', 'total': n, 'scanned': n},
+    ]
+    for sku, qty in per_sku.items():
+        rows.append({'job_type': job_type, 'pallet': '', 'sku': sku, 'total': 0, 'scanned': qty})
+        rows.append({'job_type': job_type, 'pallet': pallet, 'sku': sku, 'total': qty, 'scanned': qty})
+    _upsert(session, rows)
+
+
+def apply_releases(session, job_type, pallet, sku, qty):
+    """Trừ số thùng bị gỡ khỏi pallet (delete_scan)."""
+    if not qty:
+        return
+    if ensure_job(session, job_type):
+        return
+    pallet = str(pallet)
+    _upsert(session, [
+        {'job_type': job_type, 'pallet': '', 'sku': '', 'total': 0, 'scanned': -qty, 'version': 1},
+        {'job_type': job_type, 'pallet': pallet, 'sku': '', 'total': -qty, 'scanned': -qty},
+        {'job_type': job_type, 'pallet': '', 'sku': sku, 'total': 0, 'scanned': -qty},
+        {'job_type': job_type, 'pallet': pallet, 'sku': sku, 'total': -qty, 'scanned': -qty},
+    ])
+
+
+def add_totals(session, job_type, sku_counts):
+    """Cộng tổng số thùng chờ khi nạp thêm dữ liệu cho job. sku_counts: {sku: qty}."""
+    if ensure_job(session, job_type):
+        return
+    n = sum(sku_counts.values())
+    rows = [{'job_type': job_type, 'pallet': '', 'sku': '', 'total': n, 'scanned': 0, 'version': 1}]
+    rows += [{'job_type': job_type, 'pallet': '', 'sku': sku, 'total': qty, 'scanned': 0} for sku, qty in sku_counts.items()]
+    _upsert(session, rows)
+
+
+def bump_version(session, job_type):
+    """Đánh dấu dữ liệu job đã đổi mà không đổi số lượng (vd. cập nhật jobscan)."""
+    if ensure_job(session, job_type):
+        return
+    _upsert(session, [{'job_type': job_type, 'pallet': '', 'sku': '', 'total': 0, 'scanned': 0, 'version': 1}])
+
+
+# --- ĐỌC O(1) ---
+
+def job_version(session, job_type):
+    row = session.execute(
+        text("SELECT version FROM scan_counters WHERE jobno_type = :job_type AND pallet = '' AND sku = ''"),
+        {'job_type': job_type}
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def job_rows(session, job_type):
+    """Toàn bộ bộ đếm của job: list (pallet, sku, total, scanned, version)."""
+    query = text("SELECT pallet, sku, total, scanned, version FROM scan_counters WHERE jobno_type = :job_type")
+    return [tuple(row) for row in session.execute(query, {'job_type': job_type})]
+
+
+def job_counts(session, job_type):
+    """(total, scanned) của job."""
+    row = session.execute(
+        text("SELECT total, scanned FROM scan_counters WHERE jobno_type = :job_type AND pallet = '' AND sku = ''"),
+        {'job_type': job_type}
+    ).fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def scan_summary(session, job_type, pallet):
+    """(pallet_count, total, scanned) bằng một query cho phản hồi sau mỗi lần scan."""
+    rows = session.execute(
+        text(SCAN_SUMMARY_SQL),
+        {'job_type': job_type, 'pallet': str(pallet)}
+    ).fetchall()
+    pallet_count, total, scanned = 0, 0, 0
+    for row in rows:
+        if row[0] == '':
+            total, scanned = row[1], row[2]
+        else:
+            pallet_count = row[2]
+    return pallet_count, total, scanned
+
+
+def pallet_count(session, job_type, pallet):
+    row = session.execute(
+        text("SELECT scanned FROM scan_counters WHERE jobno_type = :job_type AND pallet = :pallet AND sku = ''"),
+        {'job_type': job_type, 'pallet': str(pallet)}
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def pallet_skus(session, job_type, pallet):
+    query = text("""
+        SELECT sku, scanned FROM scan_counters
+        WHERE jobno_type = :job_type AND pallet = :pallet AND sku != '' AND scanned > 0
+        ORDER BY sku
+    """)
+    return [(row[0], row[1]) for row in session.execute(query, {'job_type': job_type, 'pallet': str(pallet)})]
+
+
+def sku_pallets(session, job_type, sku):
+    query = text("""
+        SELECT pallet, scanned FROM scan_counters
+        WHERE jobno_type = :job_type AND sku = :sku AND pallet != '' AND scanned > 0
+        ORDER BY pallet
+    """)
+    return [(row[0], row[1]) for row in session.execute(query, {'job_type': job_type, 'sku': sku})]
+
+
+def sku_remaining(session, job_type, sku):
+    row = session.execute(
+        text("SELECT total - scanned FROM scan_counters WHERE jobno_type = :job_type AND pallet = '' AND sku = :sku"),
+        {'job_type': job_type, 'sku': sku}
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def remaining_skus(session, job_type):
+    return [(row[0], row[1]) for row in session.execute(text(REMAINING_SKUS_SQL), {'job_type': job_type})]
+
+
+def used_pallets(session, job_type):
+    query = text("SELECT pallet FROM scan_counters WHERE jobno_type = :job_type AND pallet != '' AND sku = '' AND scanned > 0")
+    return {str(row[0]) for row in session.execute(query, {'job_type': job_type})}
+
+
+def reconcile(session, job_type=None, log=print):
+    """Tính lại bộ đếm (một job hoặc tất cả) và báo các khóa bị lệch. Không commit."""
+    if job_type:
+        job_types = [job_type]
+    else:
+        rows = session.execute(text("SELECT DISTINCT jobno_type FROM scanfile WHERE jobno_type IS NOT NULL"))
+        job_types = [row[0] for row in rows]
+        # Job không còn trong scanfile (trừ job đã lưu trữ - giữ nguyên bộ đếm) -> xóa bộ đếm thừa
+        archived = {row[0] for row in session.execute(text("SELECT jobno_type FROM archived_jobs"))}
+        stale = session.execute(text("SELECT DISTINCT jobno_type FROM scan_counters")).fetchall()
+        for (name,) in stale:
+            if name not in job_types and name not in archived:
+                session.execute(text("DELETE FROM scan_counters WHERE jobno_type = :job_type"), {'job_type': name})
+                _ready.discard(name)
+                log(f"[{name}] xóa bộ đếm của job không còn dữ liệu")
+
+    report = {}
+    for name in job_types:
+        drift = rebuild_job(session, name)
+        report[name] = drift
+        log(f"[{name}] {'lệch ' + str(len(drift)) + ' khóa' if drift else 'khớp'}")
+        for item in drift[:20]:
+            log(f"    pallet={item['pallet']!r} sku={item['sku']!r} lưu={item['stored']} thực tế={item['actual']}")
+    return report
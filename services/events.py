@@ -0,0 +1,226 @@
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, text
+
+# Bảng `events` là hàng đợi outbox dùng chung cho mọi worker gunicorn:
+# mỗi thay đổi cần đẩy tới trình duyệt (FINISH_PALLET, đánh dấu đã xem) ghi 1 dòng trong
+# cùng transaction. Mỗi worker có 1 luồng EventBus đọc các dòng mới và phát cho các kết nối SSE
+# của worker đó -> DB chỉ nhận 1 query nhỏ/worker/chu kỳ thay vì 1 query/trạm in/10 giây,
+# và không query gì khi không có trạm nào đang mở.
+#
+# id tự tăng được cấp lúc INSERT nhưng dòng chỉ thấy được lúc commit: transaction commit sau có thể
+# mang id nhỏ hơn dòng đã đọc (MySQL/Postgres). Cursor giữ lại các id bị bỏ qua (gap) và đọc lại
+# chúng trong GAP_SECONDS; id không bao giờ xuất hiện (transaction rollback) thì bỏ sau thời gian đó.
+
+GAP_SECONDS = 60
+MAX_GAPS = 200
+
+# Xóa sự kiện cũ hơn retention_hours, tối đa 1 lần mỗi PURGE_EVERY giây trong mỗi worker (khi ghi sự kiện)
+PURGE_EVERY = 600
+_last_purge = 0.0
+
+
+class Cursor:
+    """Vị trí đã đọc trong outbox: id lớn nhất đã thấy + các id nhỏ hơn chưa thấy (chưa commit)."""
+
+    def __init__(self, last_id=0, gaps=()):
+        self.last_id = last_id
+        deadline = time.monotonic() + GAP_SECONDS
+        self.gaps = {gap: deadline for gap in gaps if gap < last_id}
+
+    @classmethod
+    def parse(cls, value):
+        """Last-Event-ID dạng '120' hoặc '120:117,118'."""
+        head, _, tail = str(value).partition(':')
+        return cls(int(head), [int(gap) for gap in tail.split(',') if gap])
+
+    def __str__(self):
+        if not self.gaps:
+            return str(self.last_id)
+        return f"{self.last_id}:{','.join(str(gap) for gap in sorted(self.gaps))}"
+
+    def advance(self, events):
+        """Ghi nhận các sự kiện (theo thứ tự id) -> trả về những sự kiện chưa thấy."""
+        now = time.monotonic()
+        fresh = []
+        for event in events:
+            event_id = event[0]
+            if event_id > self.last_id:
+                for gap in range(max(self.last_id + 1, event_id - MAX_GAPS), event_id):
+                    self.gaps[gap] = now + GAP_SECONDS
+                self.last_id = event_id
+                fresh.append(event)
+            elif self.gaps.pop(event_id, None) is not None:
+                fresh.append(event)
+        for gap, deadline in list(self.gaps.items()):
+            if deadline <= now:
+                del self.gaps[gap]
+        if len(self.gaps) > MAX_GAPS:
+            for gap in sorted(self.gaps)[:len(self.gaps) - MAX_GAPS]:
+                del self.gaps[gap]
+        return fresh
+
+
+def purge(session, retention_hours):
+    """Xóa sự kiện cũ hơn retention_hours. Trả về số dòng đã xóa. Không commit."""
+    cutoff = datetime.now() - timedelta(hours=retention_hours)
+    return session.execute(text("DELETE FROM events WHERE created_at < :cutoff"), {'cutoff': cutoff}).rowcount
+
+
+def publish(session, kind, payload, retention_hours=None):
+    """Ghi 1 sự kiện vào outbox (không commit - caller commit cùng thay đổi gốc).
+
+    retention_hours: thỉnh thoảng xóa luôn các sự kiện cũ trong cùng transaction.
+    """
+    global _last_purge
+    session.execute(
+        text("INSERT INTO events (kind, payload, created_at) VALUES (:kind, :payload, :t)"),
+        {'kind': kind, 'payload': json.dumps(payload, ensure_ascii=False, default=str), 't': datetime.now()}
+    )
+    if retention_hours and time.monotonic() - _last_purge >= PURGE_EVERY:
+        _last_purge = time.monotonic()
+        purge(session, retention_hours)
+
+
+def fetch_since(conn, cursor, limit=200):
+    """Sự kiện sau cursor (Cursor hoặc id) và các id còn thiếu của cursor, theo thứ tự id."""
+    if not isinstance(cursor, Cursor):
+        cursor = Cursor(int(cursor))
+    params = {'last_id': cursor.last_id, 'limit': limit}
+    where = "id > :last_id"
+    if cursor.gaps:
+        where += " OR id IN :gaps"
+        params['gaps'] = sorted(cursor.gaps)
+    query = text(f"SELECT id, kind, payload FROM events WHERE {where} ORDER BY id LIMIT :limit")
+    if cursor.gaps:
+        query = query.bindparams(bindparam('gaps', expanding=True))
+    return [(row[0], row[1], row[2]) for row in conn.execute(query, params).fetchall()]
+
+
+def latest_id(conn):
+    row = conn.execute(text("SELECT MAX(id) FROM events")).fetchone()
+    return row[0] or 0
+
+
+def format_sse(event_id, kind, payload):
+    return f"id: {event_id}\nevent: {kind}\ndata: {payload}\n\n"
+
+
+class EventBus:
+    """Luồng nền của một worker: đọc outbox khi có người nghe và phát cho các hàng đợi SSE.
+
+    Chu kỳ đọc thích ứng: poll_interval ngay sau khi có sự kiện (hoặc còn id chờ), rồi giãn dần
+    gấp đôi tới max_interval khi yên lặng. Sự kiện do chính worker ghi được đọc ngay qua notify().
+    """
+
+    def __init__(self, engine, poll_interval=0.5, max_interval=10.0):
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.max_interval = max(max_interval, poll_interval)
+        self.interval = poll_interval
+        self.cursor = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.polls = 0
+        self.delivered = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self.engine.connect() as conn:
+            self.cursor = Cursor(latest_id(conn))
+        self._thread = threading.Thread(target=self._run, name='event-bus', daemon=True)
+        self._thread.start()
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=1000)
+        with self._lock:
+            self._ensure_started()
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def notify(self):
+        """Gọi sau khi chính worker này commit sự kiện -> đọc ngay, không chờ chu kỳ."""
+        self._wake.set()
+
+    def poll(self, listeners):
+        """Một lần đọc outbox và phát cho listeners. Trả về số sự kiện mới."""
+        with self.engine.connect() as conn:
+            events = self.cursor.advance(fetch_since(conn, self.cursor))
+        self.polls += 1
+        for event in events:
+            for q in listeners:
+                try:
+                    q.put_nowait(event)
+                except queue.Full:
+                    # Kết nối chậm/treo: bỏ qua, trình duyệt sẽ resume bằng Last-Event-ID
+                    pass
+            self.delivered += 1
+        return len(events)
+
+    def _run(self):
+        while True:
+            woken = self._wake.wait(self.interval)
+            self._wake.clear()
+            with self._lock:
+                listeners = list(self._subscribers)
+            if not listeners:
+                # Không có trạm nào đang nghe -> không query DB
+                self.interval = self.poll_interval
+                continue
+            try:
+                delivered = self.poll(listeners)
+            except Exception as e:
+                print(f"Lỗi đọc events: {e}")
+                time.sleep(self.poll_interval)
+                continue
+            if delivered or woken or self.cursor.gaps:
+                self.interval = self.poll_interval
+            else:
+                self.interval = min(self.interval * 2, self.max_interval)
+
+    def stream(self, backlog, cursor, max_seconds, keepalive=15):
+        """Generator SSE: gửi backlog (resume), sau đó các sự kiện mới cho tới max_seconds.
+
+        id gửi cho trình duyệt là cursor (id lớn nhất + id còn thiếu) để Last-Event-ID nối lại không mất sự kiện.
+        """
+        q = self.subscribe()
+        try:
+            yield "retry: 1000\n\n"
+            for event in backlog:
+                for event_id, kind, payload in cursor.advance([event]):
+                    yield format_sse(cursor, kind, payload)
+            deadline = time.monotonic() + max_seconds
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = q.get(timeout=min(keepalive, remaining))
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                for event_id, kind, payload in cursor.advance([event]):
+                    yield format_sse(cursor, kind, payload)
+        finally:
+            self.unsubscribe(q)
+
+    def stats(self):
+        return {
+            'subscribers': len(self._subscribers),
+            'last_id': self.cursor.last_id if self.cursor else None,
+            'gaps': len(self.cursor.gaps) if self.cursor else 0,
+            'interval': self.interval,
+            'polls': self.polls,
+            'delivered': self.delivered,
+        }
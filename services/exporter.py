@@ -0,0 +1,99 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+
+from sqlalchemy import bindparam, inspect, text
+
+# Cột xuất mặc định cho manifest khách hàng (theo models/scanfile.py)
+EXPORT_COLUMNS = [
+    'jobno', 'jobno_type', 'pallet', 'pallet_type', 'sku', 'sscc', 'barcode', 'release_key',
+    'master_delivery', 'qty', 'ship_to', 'master_add1', 'master_add2', 'master_add3', 'master_add4',
+    'st_zip', 'tag_label', 'jobscan', 'userscan', 'time_scan',
+]
+# Cột cần cho tem SSCC (print_label.html / print_small_label.html)
+LABEL_COLUMNS = [
+    'id', 'sscc', 'barcode', 'tag_label', 'sku', 'qty', 'pallet', 'master_delivery',
+    'ship_to', 'master_add1', 'master_add2', 'master_add3', 'master_add4',
+]
+ALLOWED_COLUMNS = set(EXPORT_COLUMNS) | set(LABEL_COLUMNS)
+
+STATUS_FILTERS = {
+    'scanned': "AND pallet IS NOT NULL AND pallet != ''",
+    'waiting': "AND (pallet IS NULL OR pallet = '')",
+    'all': '',
+}
+
+
+_existing_columns = {}
+
+
+def select_list(bind, columns):
+    # Cột không có trong DB đang chạy (SQLite local) -> NULL để định dạng xuất luôn giống nhau
+    key = str(bind.engine.url)
+    if key not in _existing_columns:
+        _existing_columns[key] = {c['name'] for c in inspect(bind).get_columns('scanfile')}
+    existing = _existing_columns[key]
+    return ', '.join(c if c in existing else f'NULL AS {c}' for c in columns)
+
+
+def format_value(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    return value
+
+
+def pallet_filter(pallets):
+    """Điều kiện pallet cho query xuất: None -> không lọc, list -> pallet IN (...)."""
+    if pallets is None:
+        return '', {}
+    return 'AND pallet IN :pallets', {'pallets': [str(p) for p in pallets]}
+
+
+def build_query(bind, job_type, columns, pallets=None, status='scanned', table='scanfile'):
+    # table: scanfile hoặc scanfile_archive cho job đã lưu trữ (services/archive.py)
+    where_pallet, params = pallet_filter(pallets)
+    query = text(f"""
+        SELECT {select_list(bind, columns)} FROM {table}
+        WHERE jobno_type = :job_type {STATUS_FILTERS[status]} {where_pallet}
+        ORDER BY pallet, sku, id
+    """)
+    if pallets is not None:
+        query = query.bindparams(bindparam('pallets', expanding=True))
+    return query, dict(params, job_type=job_type)
+
+
+def stream_export(engine, job_type, columns, fmt='ndjson', pallets=None, status='scanned', chunk_rows=1000, table='scanfile'):
+    """Generator trả về từng khối text của file xuất.
+
+    Dùng kết nối riêng với stream_results (server-side cursor trên MySQL/Postgres) và yield_per,
+    nên bộ nhớ không phụ thuộc số dòng của job. Mỗi khối gồm tối đa `chunk_rows` dòng.
+    """
+    if pallets is not None and not pallets:
+        # Khoảng pallet không có pallet nào -> chỉ xuất tiêu đề
+        if fmt == 'csv':
+            yield ','.join(columns) + '\r\n'
+        return
+
+    with engine.connect() as conn:
+        query, params = build_query(conn, job_type, columns, pallets, status, table)
+        result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(query, params)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(columns)
+        for partition in result.partitions():
+            for row in partition:
+                values = [format_value(value) for value in row]
+                if writer:
+                    writer.writerow(values)
+                else:
+                    buffer.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False, default=str))
+                    buffer.write('\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
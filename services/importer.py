@@ -0,0 +1,268 @@
+import codecs
+import csv
+import io
+import os
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import inspect, text
+
+try:
+    import openpyxl
+except ImportError:  # Chỉ cần khi nạp file .xlsx
+    openpyxl = None
+
+# Các cột scanfile có thể nạp từ file (theo models/scanfile.py). Cột không có trong bảng thực tế
+# của DB đang chạy (vd. SQLite local) sẽ bị bỏ qua và báo lại trong kết quả.
+IMPORT_COLUMNS = [
+    'release_key', 'sscc', 'master_delivery', 'qty', 'master_ctl', 'master_st_company',
+    'master_add1', 'master_add2', 'master_add3', 'master_add4', 'ship_to', 'st_zip',
+    'barcode', 'sku', 'jobno', 'jobno_type', 'tag_label', 'jobscan',
+]
+REQUIRED_COLUMNS = ('sscc', 'sku', 'jobno', 'jobno_type')
+INTEGER_COLUMNS = ('qty',)
+# Thùng mới nạp luôn ở trạng thái chờ scan
+WAITING_VALUES = {'pallet': '', 'pallet_type': ''}
+
+MAX_ERRORS = 50
+
+# Giá trị cho cột ngày/giờ NOT NULL không có trong file (thùng chưa scan)
+NO_DATETIME = datetime(1970, 1, 1)
+
+
+class ImportFileError(Exception):
+    pass
+
+
+def normalize_header(name):
+    return str(name or '').strip().lower().replace(' ', '_').replace('-', '_')
+
+
+def _iter_csv(stream):
+    # Giải mã và đọc từng dòng -> không nạp cả file vào RAM
+    yield from csv.reader(codecs.getreader('utf-8-sig')(stream))
+
+
+def _iter_xlsx(stream):
+    if openpyxl is None:
+        raise ImportFileError("Chưa cài openpyxl - không đọc được file .xlsx (pip install openpyxl) hoặc dùng CSV")
+    # read_only=True: openpyxl đọc sheet dạng stream, không dựng toàn bộ workbook
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ['' if value is None else value for value in row]
+    finally:
+        workbook.close()
+
+
+def iter_file_rows(stream, filename):
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext in ('.xlsx', '.xlsm'):
+        return _iter_xlsx(stream)
+    if ext in ('.csv', '.txt', ''):
+        return _iter_csv(stream)
+    raise ImportFileError(f"Định dạng file không hỗ trợ: {ext} (chỉ CSV/XLSX)")
+
+
+def table_columns(session, table):
+    return {col['name']: col for col in inspect(session.get_bind()).get_columns(table)}
+
+
+def not_null_filler(col):
+    """Giá trị cho cột NOT NULL không có trong file (DB production khai báo NOT NULL cho mọi cột)."""
+    if col.get('nullable', True) or col.get('default') is not None or col.get('autoincrement') is True:
+        return None
+    try:
+        python_type = col['type'].python_type
+    except NotImplementedError:
+        return None
+    if python_type is str:
+        return ''
+    if python_type in (int, float, Decimal):
+        return 0
+    if python_type is bool:
+        return False
+    # Ngày/giờ (vd. scanfile.time_scan db.Date NOT NULL): mốc cố định thay cho "chưa có"
+    if python_type is datetime:
+        return NO_DATETIME
+    if python_type is date:
+        return NO_DATETIME.date()
+    return None
+
+
+def copy_sql(table, columns):
+    return f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+
+
+def copy_csv(rows):
+    """Dữ liệu CSV cho COPY ... FORMAT csv: COPY đọc ô rỗng không có dấu nháy là NULL, nên mọi giá trị
+    (kể cả '') đều được đặt trong dấu nháy, chỉ None mới để trống -> cột NOT NULL nhận '' chứ không phải NULL."""
+    lines = []
+    for row in rows:
+        lines.append(','.join('' if value is None else '"' + str(value).replace('"', '""') + '"' for value in row))
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+class ScanfileImporter:
+    """Nạp dữ liệu job vào scanfile theo từng chunk với đường ghi nhanh nhất của từng DB.
+
+    - Postgres: COPY ... FROM STDIN (CSV) trên cùng kết nối của session
+    - MySQL: executemany -> PyMySQL gộp thành INSERT nhiều dòng
+    - SQLite: executemany theo chunk
+    Toàn bộ file nằm trong một transaction (lỗi giữa chừng -> không nạp dòng nào).
+    Không commit - caller commit.
+    """
+
+    def __init__(self, session, job_type=None, jobno=None, chunk_size=5000, progress=None):
+        self.session = session
+        self.job_type = job_type
+        self.jobno = jobno
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.dialect = session.get_bind().dialect.name
+        self.rows_read = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.errors = []
+        self.ignored_columns = []
+        self.per_job = defaultdict(Counter)
+        self.per_jobno = Counter()
+        self._seen = {}
+        self._started = None
+
+    def _error(self, line, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({'line': line, 'message': message})
+
+    def _existing_sscc(self, job_type):
+        # SSCC đã có của job -> nạp lại cùng file không tạo dòng trùng (dùng index jobno_type)
+        if job_type not in self._seen:
+            rows = self.session.execute(text("SELECT sscc FROM scanfile WHERE jobno_type = :job_type"), {'job_type': job_type})
+            self._seen[job_type] = {row[0] for row in rows}
+        return self._seen[job_type]
+
+    def _plan_columns(self, header):
+        table = table_columns(self.session, 'scanfile')
+        header = [normalize_header(name) for name in header]
+        positions = {}
+        for i, name in enumerate(header):
+            if name in IMPORT_COLUMNS and name in table:
+                positions.setdefault(name, i)
+            elif name:
+                self.ignored_columns.append(name)
+
+        overrides = {}
+        if self.job_type:
+            overrides['jobno_type'] = self.job_type
+        if self.jobno:
+            overrides['jobno'] = self.jobno
+        missing = [name for name in REQUIRED_COLUMNS if name not in positions and name not in overrides]
+        if missing:
+            raise ImportFileError(f"Thiếu cột bắt buộc: {', '.join(missing)}")
+
+        constants = dict(WAITING_VALUES)
+        for name, col in table.items():
+            if name in positions or name in overrides or name in constants:
+                continue
+            value = not_null_filler(col)
+            if value is not None:
+                constants[name] = value
+        constants = {name: value for name, value in constants.items() if name in table}
+        constants.update(overrides)
+        self.positions = positions
+        self.constants = constants
+        self.columns = [name for name in positions if name not in overrides] + list(constants)
+
+    def _normalize(self, line, raw):
+        record = {}
+        for name, i in self.positions.items():
+            value = raw[i] if i < len(raw) else ''
+            if isinstance(value, float) and value.is_integer():
+                # Excel trả số nguyên dạng float (SSCC/qty)
+                value = int(value)
+            value = str(value).strip()
+            if name in INTEGER_COLUMNS:
+                try:
+                    value = int(float(value)) if value else 0
+                except ValueError:
+                    self._error(line, f"{name} không phải số: {value!r}")
+                    return None
+            record[name] = value
+        record.update(self.constants)
+        for name in REQUIRED_COLUMNS:
+            if not record.get(name):
+                self._error(line, f"Thiếu {name}")
+                return None
+        seen = self._existing_sscc(record['jobno_type'])
+        if record['sscc'] in seen:
+            self._error(line, f"SSCC trùng: {record['sscc']}")
+            return None
+        seen.add(record['sscc'])
+        return record
+
+    def _write(self, chunk):
+        if not chunk:
+            return
+        if self.dialect == 'postgresql':
+            self._copy(chunk)
+        else:
+            placeholders = ', '.join(f":{name}" for name in self.columns)
+            sql = text(f"INSERT INTO scanfile ({', '.join(self.columns)}) VALUES ({placeholders})")
+            self.session.execute(sql, chunk)
+        for record in chunk:
+            self.per_job[record['jobno_type']][record['sku']] += 1
+            self.per_jobno[(record['jobno'], record['jobno_type'])] += 1
+        self.inserted += len(chunk)
+        self._report()
+
+    def _copy(self, chunk):
+        buffer = io.StringIO(copy_csv([record[name] for name in self.columns] for record in chunk))
+        # Cursor psycopg2 trên cùng kết nối -> cùng transaction với session
+        raw = self.session.connection().connection.dbapi_connection
+        with raw.cursor() as cursor:
+            cursor.copy_expert(copy_sql('scanfile', self.columns), buffer)
+
+    def _report(self):
+        if self.progress:
+            self.progress(self.summary())
+
+    def run(self, rows):
+        """rows: iterable các dòng (list giá trị), dòng đầu là tiêu đề. Trả về summary()."""
+        self._started = time.perf_counter()
+        rows = iter(rows)
+        header = next(rows, None)
+        if not header:
+            raise ImportFileError("File rỗng")
+        self._plan_columns(header)
+
+        chunk = []
+        for line, raw in enumerate(rows, start=2):
+            if not any(str(value).strip() for value in raw):
+                continue
+            self.rows_read += 1
+            record = self._normalize(line, raw)
+            if record is None:
+                continue
+            chunk.append(record)
+            if len(chunk) >= self.chunk_size:
+                self._write(chunk)
+                chunk = []
+        self._write(chunk)
+        return self.summary()
+
+    def summary(self):
+        elapsed = time.perf_counter() - self._started if self._started else 0
+        return {
+            'dialect': self.dialect,
+            'rows_read': self.rows_read,
+            'inserted': self.inserted,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'ignored_columns': self.ignored_columns,
+            'jobs': {job_type: sum(skus.values()) for job_type, skus in self.per_job.items()},
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(self.inserted / elapsed, 1) if elapsed else 0.0,
+        }
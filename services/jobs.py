@@ -0,0 +1,141 @@
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from services import versions
+
+# Bảng jobs: một dòng cho mỗi jobno_type (jobno, trạng thái active/closed, tổng thùng, thời điểm tạo/đóng).
+# Ghi khi nạp dữ liệu, đóng/mở bằng tay hoặc khi lưu trữ job. Mọi thay đổi tăng phiên bản 'jobs'
+# để cache danh sách job trong từng worker biết khi nào cần đọc lại.
+
+ACTIVE = 'active'
+CLOSED = 'closed'
+STATUSES = (ACTIVE, CLOSED)
+VERSION_NAME = 'jobs'
+
+COLUMNS = ('jobno_type', 'jobno', 'status', 'total_cartons', 'created_at', 'closed_at')
+
+
+def _dialect(session):
+    return session.get_bind().dialect.name
+
+
+def register(session, jobno_counts):
+    """Ghi nhận thùng mới nạp: {(jobno, jobno_type): số thùng}. Job đã đóng được mở lại. Không commit."""
+    totals = {}
+    for (jobno, job_type), n in jobno_counts.items():
+        if not job_type:
+            continue
+        entry = totals.setdefault(job_type, {'job_type': job_type, 'jobno': jobno or '', 'n': 0})
+        entry['n'] += n
+    if not totals:
+        return
+    now = datetime.now()
+    rows = [dict(entry, now=now, status=ACTIVE) for _, entry in sorted(totals.items())]
+    if _dialect(session) == 'mysql':
+        sql = """
+            INSERT INTO jobs (jobno_type, jobno, status, total_cartons, created_at)
+            VALUES (:job_type, :jobno, :status, :n, :now)
+            ON DUPLICATE KEY UPDATE total_cartons = total_cartons + VALUES(total_cartons),
+                status = VALUES(status), closed_at = NULL
+        """
+    else:
+        sql = """
+            INSERT INTO jobs (jobno_type, jobno, status, total_cartons, created_at)
+            VALUES (:job_type, :jobno, :status, :n, :now)
+            ON CONFLICT (jobno_type) DO UPDATE SET total_cartons = jobs.total_cartons + excluded.total_cartons,
+                status = excluded.status, closed_at = NULL
+        """
+    session.execute(text(sql), rows)
+    versions.bump(session, VERSION_NAME)
+
+
+def set_status(session, job_type, status):
+    """Đóng/mở job. Trả về True nếu có thay đổi. Không commit."""
+    if status not in STATUSES:
+        raise ValueError(f"Trạng thái không hợp lệ: {status}")
+    result = session.execute(text("""
+        UPDATE jobs SET status = :status, closed_at = :closed_at
+        WHERE jobno_type = :job_type AND status != :status
+    """), {'job_type': job_type, 'status': status, 'closed_at': datetime.now() if status == CLOSED else None})
+    if result.rowcount:
+        versions.bump(session, VERSION_NAME)
+    return bool(result.rowcount)
+
+
+def get(session, job_type):
+    row = session.execute(text(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE jobno_type = :job_type"),
+                          {'job_type': job_type}).fetchone()
+    return dict(zip(COLUMNS, row)) if row else None
+
+
+def list_jobs(session, status=ACTIVE):
+    """Danh sách job (dict theo COLUMNS), mới nhất trước. status=None -> tất cả."""
+    where = "WHERE status = :status" if status else ""
+    query = text(f"SELECT {', '.join(COLUMNS)} FROM jobs {where} ORDER BY created_at DESC, jobno_type")
+    return [dict(zip(COLUMNS, row)) for row in session.execute(query, {'status': status})]
+
+
+def source_sql(source='scanfile'):
+    return f"""
+        SELECT jobno_type, COALESCE(MAX(jobno), ''), COUNT(id) FROM {source}
+        WHERE jobno_type IS NOT NULL AND jobno_type != ''
+        GROUP BY jobno_type
+    """
+
+
+def sync(session, source='scanfile'):
+    """Đồng bộ bảng jobs với dữ liệu thực tế (job nạp ngoài app, tổng thùng lệch). Quét cả bảng. Không commit.
+
+    Trả về (số job thêm mới, số job sửa tổng).
+    """
+    stored = {row['jobno_type']: row for row in list_jobs(session, status=None)}
+    now = datetime.now()
+    added = fixed = 0
+    for job_type, jobno, total in session.execute(text(source_sql(source))):
+        if job_type not in stored:
+            session.execute(text("""
+                INSERT INTO jobs (jobno_type, jobno, status, total_cartons, created_at)
+                VALUES (:job_type, :jobno, :status, :total, :now)
+            """), {'job_type': job_type, 'jobno': jobno, 'status': ACTIVE, 'total': total, 'now': now})
+            added += 1
+        elif stored[job_type]['total_cartons'] != total:
+            session.execute(text("UPDATE jobs SET total_cartons = :total WHERE jobno_type = :job_type"),
+                            {'job_type': job_type, 'total': total})
+            fixed += 1
+    if added or fixed:
+        versions.bump(session, VERSION_NAME)
+    return added, fixed
+
+
+class JobListCache:
+    """Danh sách job đang mở trong RAM của worker.
+
+    Trong `ttl` giây trả về bản đã nạp; sau đó kiểm tra phiên bản 'jobs' (một dòng theo khóa chính)
+    và chỉ đọc lại bảng jobs khi phiên bản đổi.
+    """
+
+    def __init__(self, ttl=10):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._jobs = []
+        self._version = None
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        self._checked_at = 0.0
+
+    def active(self, session):
+        """Danh sách jobno_type đang mở (mới nhất trước)."""
+        if time.monotonic() - self._checked_at < self.ttl:
+            return list(self._jobs)
+        with self._lock:
+            if time.monotonic() - self._checked_at >= self.ttl:
+                version = versions.get(session, VERSION_NAME)
+                if version != self._version:
+                    self._jobs = [row['jobno_type'] for row in list_jobs(session, ACTIVE)]
+                    self._version = version
+                self._checked_at = time.monotonic()
+            return list(self._jobs)
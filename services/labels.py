@@ -0,0 +1,268 @@
+import hashlib
+import os
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from services import code128
+from services.pdf import PageCanvas, PdfDocument
+
+# Tem in phía server: tem SSCC 100x150mm và tem Pallet A4 (bố cục theo print_label.html).
+# Mỗi trang được dựng thành content stream đã nén; job lớn chia trang cho process pool.
+
+LAYOUT_VERSION = 1
+
+SSCC_SIZE = (100, 150)
+PALLET_SIZE = (210, 297)
+SENDER = 'KLN ORDC # 061'
+CARRIER = 'KLN Logistics'
+
+# Trọng lượng vỏ pallet (kg) - giữ đồng bộ PALLET_WEIGHTS trong print_label.html
+PALLET_WEIGHTS = {'1.2': 15.5, '1.6': 20.5, '1.9': 22.0, 'loose': 0}
+
+# Khổ module tối đa của mã vạch (mm)
+MAX_MODULE = 0.6
+PALLET_ROWS_PER_PAGE = 18
+
+
+def draw_barcode(canvas, value, center_x, y, height, max_width):
+    value = str(value or '').strip()
+    if not value:
+        return
+    try:
+        widths = code128.widths(value)
+    except ValueError:
+        canvas.text(center_x, y + height / 2, value, size=10, align='center', max_width=max_width)
+        return
+    module = min(MAX_MODULE, max_width / (sum(widths) + 2 * code128.QUIET_ZONE))
+    canvas.bars(center_x - sum(widths) * module / 2, y, height, widths, module)
+
+
+def sscc_page(item, index, total, pallet_no):
+    """Một tem SSCC 100x150mm: lưới 2 cột x 2 hàng, sau đó PO, SKU và SSCC."""
+    width, height = SSCC_SIZE
+    c = PageCanvas(width, height)
+    # Nền xám cho ô PO và SKU
+    c.rect(0, 50, width, 50, fill=True, gray=0.93)
+    c.rect(0.5, 0.5, width - 1, height - 1)
+    for y in (25, 50, 75, 100):
+        c.line(0.5, y, width - 0.5, y)
+    c.line(50, 0.5, 50, 50)
+
+    c.text(3, 6, 'FROM:', size=9, bold=True)
+    c.text(3, 12, SENDER, size=10, max_width=45)
+    c.text(53, 5.5, 'TO:', size=9, bold=True)
+    for n, key in enumerate(('ship_to', 'master_add1', 'master_add2', 'master_add3', 'master_add4')):
+        c.text(53, 9.5 + n * 3.4, item.get(key) or '-', size=8, max_width=45)
+
+    c.text(3, 31, 'CUSTOMER', size=9, bold=True)
+    c.text(53, 31, 'CARRIER', size=9, bold=True)
+    c.text(53, 38, CARRIER, size=10, max_width=45)
+
+    c.text(3, 57, 'PO #', size=12, bold=True)
+    c.text(3, 70, item.get('master_delivery') or '', size=30, bold=True, max_width=94)
+
+    c.text(3, 80.5, 'SKU', size=10, bold=True)
+    c.text(78, 80.5, 'Quantity', size=9, align='right')
+    c.text(97, 82, item.get('qty') if item.get('qty') is not None else '', size=18, bold=True, align='right')
+    c.text(3, 88, item.get('sku') or '', size=14, bold=True, max_width=94)
+    draw_barcode(c, item.get('sku'), width / 2, 90, 8.5, 90)
+
+    barcode_value = item.get('sscc') or item.get('barcode') or item.get('id')
+    c.text(3, 106, 'SSCC', size=11, bold=True)
+    draw_barcode(c, barcode_value, width / 2, 109, 26, 92)
+    c.text(width / 2, 140, barcode_value, size=11, align='center')
+    c.text(97, 145.5, f"{index}/{total}", size=7, align='right')
+    c.text(97, 148.5, f"Pallet No:{pallet_no}", size=7, align='right')
+    return c.content()
+
+
+def pallet_pages(pallet, job_type):
+    """Tem Pallet A4 (một hoặc nhiều trang nếu pallet có nhiều SKU)."""
+    width, height = PALLET_SIZE
+    skus = pallet['skus']
+    chunks = [skus[i:i + PALLET_ROWS_PER_PAGE] for i in range(0, len(skus), PALLET_ROWS_PER_PAGE)] or [[]]
+    pages = []
+    for page_no, rows in enumerate(chunks, start=1):
+        c = PageCanvas(width, height)
+        c.rect(10, 10, width - 20, height - 20, line_width=0.6)
+        c.text(width / 2, 32, f"PALLET ID: {pallet['pallet_no']}", size=32, bold=True, align='center', max_width=180)
+        c.line(10, 40, width - 10, 40)
+        c.text(15, 48, f"Jobno: {job_type}", size=12, max_width=60)
+        c.text(width / 2, 48, f"JobScan: {pallet['jobscan']}", size=12, align='center', max_width=70)
+        c.text(width - 15, 48, f"Loai pallet: {pallet['pallet_type']}", size=12, align='right', max_width=55)
+        draw_barcode(c, pallet['jobscan'], width / 2, 54, 20, 170)
+
+        # Bảng STT / SKU / Carton / Ghi chú
+        columns = [(15, 15, 'STT'), (30, 95, 'SKU'), (125, 30, 'Carton'), (155, 40, 'Ghi chu')]
+        top, row_h = 84, 9
+        c.rect(15, top, 180, row_h, fill=True, gray=0.93)
+        for n in range(len(rows) + 2):
+            c.line(15, top + n * row_h, 195, top + n * row_h)
+        bottom = top + (len(rows) + 1) * row_h
+        for x, w, title in columns:
+            c.line(x, top, x, bottom)
+            c.text(x + w / 2, top + 6.3, title, size=12, bold=True, align='center')
+        c.line(195, top, 195, bottom)
+        first = (page_no - 1) * PALLET_ROWS_PER_PAGE
+        for n, row in enumerate(rows, start=1):
+            y = top + n * row_h + 6.3
+            c.text(22.5, y, first + n, size=12, align='center')
+            c.text(32, y, row['sku'], size=12, max_width=91)
+            c.text(140, y, row['qty'], size=12, align='center')
+            c.text(157, y, row['tag_label'] or '', size=11, max_width=36)
+
+        c.line(10, 262, width - 10, 262, line_width=0.6)
+        c.text(15, 272, f"Tong Carton: {pallet['total_qty']}", size=18, bold=True)
+        c.text(width - 15, 272, f"Tong KG: {pallet['final_weight']:.2f}", size=18, bold=True, align='right')
+        c.text(15, 283, f"Page {page_no}/{len(chunks)}", size=9)
+        c.text(width - 15, 283, pallet['pallet_no'], size=9, align='right')
+        pages.append(c.content())
+    return pages
+
+
+def group_pallets(items):
+    """Gom các dòng get_print_data theo pallet và tính trọng lượng (giống processData ở trình duyệt)."""
+    pallets = {}
+    for item in items:
+        if not item['pallet_no']:
+            continue
+        pallet = pallets.setdefault(item['pallet_no'], {
+            'pallet_no': item['pallet_no'],
+            'pallet_type': item['pallet_type'] or 'loose',
+            'skus': [],
+            'total_qty': 0,
+            'tag_label': item['tag_label'] or '',
+            'gross_weight': 0.0,
+            'jobscan': item['jobscan'] or '',
+        })
+        weight = (item['sku_weight'] or 0) * item['qty']
+        pallet['skus'].append({'sku': item['sku'], 'qty': item['qty'], 'weight': weight, 'tag_label': item['tag_label']})
+        pallet['total_qty'] += item['qty']
+        pallet['gross_weight'] += weight
+        if item['tag_label']:
+            pallet['tag_label'] = item['tag_label']
+        if item['jobscan'] and not pallet['jobscan']:
+            pallet['jobscan'] = item['jobscan']
+    for pallet in pallets.values():
+        pallet['final_weight'] = pallet['gross_weight'] + PALLET_WEIGHTS.get(pallet['pallet_type'], 0)
+    return [pallets[key] for key in sorted(pallets, key=pallet_sort_key)]
+
+
+def pallet_sort_key(pallet_no):
+    pallet_no = str(pallet_no)
+    return (0, int(pallet_no), '') if pallet_no.isdigit() else (1, 0, pallet_no)
+
+
+def sscc_jobs(rows):
+    """rows: dict theo exporter.LABEL_COLUMNS. Bỏ thùng có tag_label (in tem nhỏ riêng), đánh số theo pallet."""
+    by_pallet = {}
+    for row in rows:
+        if row.get('tag_label'):
+            continue
+        by_pallet.setdefault(str(row['pallet']), []).append(row)
+    jobs = []
+    for pallet_no in sorted(by_pallet, key=pallet_sort_key):
+        items = by_pallet[pallet_no]
+        jobs.extend((item, n, len(items), pallet_no) for n, item in enumerate(items, start=1))
+    return jobs
+
+
+def _render_chunk(kind, jobs):
+    # Chạy trong process con: chỉ dùng dữ liệu thuần (dict/tuple) -> không đụng tới DB/app
+    if kind == 'sscc':
+        return [sscc_page(*job) for job in jobs]
+    pages = []
+    for job in jobs:
+        pages.extend(pallet_pages(*job))
+    return pages
+
+
+def render_pdf(kind, jobs, pool=None, chunk_size=50):
+    """Dựng file PDF cho danh sách tem. pool: ProcessPoolExecutor hoặc None (dựng ngay trong process)."""
+    size = SSCC_SIZE if kind == 'sscc' else PALLET_SIZE
+    if pool is None:
+        contents = _render_chunk(kind, jobs)
+    else:
+        chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+        contents = []
+        for pages in pool.map(_render_chunk, [kind] * len(chunks), chunks):
+            contents.extend(pages)
+    document = PdfDocument()
+    for content in contents:
+        document.add_page(size[0], size[1], content)
+    return document.to_bytes(), len(contents)
+
+
+class LabelPool:
+    """Process pool dùng chung trong worker, chỉ tạo khi có job đủ lớn."""
+
+    def __init__(self, workers, min_pages):
+        self.workers = workers
+        self.min_pages = min_pages
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def for_jobs(self, count):
+        if self.workers <= 1 or count < self.min_pages:
+            return None
+        with self._lock:
+            if self._pool is None:
+                # spawn: worker gunicorn đã có nhiều luồng (EventBus, ScanWriter, metrics...) - fork có thể
+                # chép sang process con một lock đang bị giữ và treo mãi
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+
+class LabelCache:
+    """File PDF đã dựng, lưu trên đĩa (dùng chung giữa các worker), xóa file cũ nhất khi quá giới hạn."""
+
+    def __init__(self, directory, max_files=200):
+        self.directory = directory
+        self.max_files = max_files
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(kind, job_type, pallet, *versions):
+        parts = [kind, job_type, pallet or '*', f"layout{LAYOUT_VERSION}"] + [str(v) for v in versions]
+        return ':'.join(str(p) for p in parts)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pdf')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self):
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.pdf')]
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=lambda path: os.path.getmtime(path))
+        for path in files[:len(files) - self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hits / total, 3) if total else 0.0}
@@ -0,0 +1,328 @@
+import http.cookiejar
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import bindparam, text
+
+# Kiểm tra tải (flask --app app load-test): nhiều trạm scan đồng thời gọi các API thật
+# (/api/scan kèm gửi lại cùng scan_id, /api/check_barcode, /api/bulk_update, /api/job_stats, /api/get_logs, API in tem)
+# với tỉ lệ thao tác và thời gian nghỉ giống thực tế, trên một job tạm tạo riêng rồi dọn sạch.
+# Chạy trong process (Flask test client, không cần server) hoặc tới server đang chạy (--url).
+# Kết quả: thông lượng, p50/p95/p99 theo API, số lỗi và số thùng bị claim trùng/thất lạc (JSON).
+
+# Tỉ lệ thao tác mặc định của một trạm scan (trọng số)
+DEFAULT_MIX = {
+    'scan': 60,
+    'scan_replay': 3,
+    'check_barcode': 10,
+    'job_stats': 10,
+    'get_logs': 8,
+    'get_print_data': 4,
+    'get_history': 3,
+    'get_small_label_data': 1,
+    'bulk_update': 4,
+}
+
+# Phản hồi success=False được coi là bình thường (hết thùng chờ), không tính là lỗi
+EMPTY_MESSAGES = ('Lỗi: Không tìm thấy dữ liệu chờ', 'Không còn hàng khả dụng')
+
+PERCENTILES = (50, 95, 99)
+
+
+def parse_mix(value):
+    """'scan=60,job_stats=10' -> dict. Rỗng -> DEFAULT_MIX."""
+    if not value:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Thao tác không hợp lệ: {name} (có: {', '.join(DEFAULT_MIX)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, p):
+    """Percentile theo nearest-rank trên list đã sắp xếp."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+# --- CLIENT ---
+
+class AppClient:
+    """Gọi API trong cùng process qua Flask test client (đăng nhập bằng session)."""
+
+    def __init__(self, app, user):
+        self.client = app.test_client()
+        with self.client.session_transaction() as s:
+            s['user'] = user
+            s['role'] = 'admin'
+
+    def call(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:
+    """Gọi API của server đang chạy (giữ cookie đăng nhập)."""
+
+    def __init__(self, base_url, user=None, password=None, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        if user:
+            form = urllib.parse.urlencode({'username': user, 'password': password or ''}).encode('utf-8')
+            self.opener.open(f"{self.base_url}/login", data=form, timeout=timeout).read()
+
+    def call(self, method, path, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        req = urllib.request.Request(f"{self.base_url}{path}", data=data, method=method,
+                                     headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                return response.status, json.loads(response.read() or b'null')
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+
+# --- DỮ LIỆU TẠM ---
+
+class LoadFixture:
+    """Job tạm `__load_xxxxxxxx`: `skus` SKU (mỗi SKU 1 refix chưa dùng trong masterdata), `cartons` thùng chờ scan."""
+
+    def __init__(self, engine, cartons=5000, skus=20):
+        self.engine = engine
+        self.job_type = f"__load_{uuid.uuid4().hex[:8]}"
+        self.cartons = cartons
+        self.skus = {}
+        self._serials = itertools.count(1)
+
+        with engine.begin() as conn:
+            used = {str(row[0]).strip() for row in conn.execute(text("SELECT refix FROM masterdata WHERE refix IS NOT NULL"))}
+            candidates = (f"{n:05d}" for n in range(99999, 0, -1))
+            refixes = [refix for refix in candidates if refix not in used][:skus]
+            now = datetime.now()
+            for k, refix in enumerate(refixes):
+                self.skus[f"{self.job_type}_{k}"] = refix
+            conn.execute(text("INSERT INTO masterdata (sku, refix, weight, updated_at) VALUES (:sku, :refix, 1, :now)"),
+                         [{'sku': sku, 'refix': refix, 'now': now} for sku, refix in self.skus.items()])
+            names = list(self.skus)
+            conn.execute(
+                text("INSERT INTO scanfile (jobno, jobno_type, sku, sscc, pallet) VALUES (:jobno, :job_type, :sku, :sscc, '')"),
+                [{'jobno': self.job_type, 'job_type': self.job_type, 'sku': names[i % len(names)], 'sscc': f"{self.job_type}-{i}"}
+                 for i in range(cartons)]
+            )
+
+    def barcode(self, sku):
+        # Quy tắc prefix mặc định (BARCODE_PREFIX_RULES) lấy barcode[-6:-1]; 16 chữ số - không bị kiểm tra số kiểm tra
+        # như GTIN/SSCC; phần đầu là số thứ tự - mỗi lần quét một thùng khác (không bị báo trùng)
+        return f"{next(self._serials):010d}{self.skus[sku]}0"
+
+    def assigned(self):
+        """{pallet: số thùng} đã gán trong DB."""
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT pallet, COUNT(id) FROM scanfile
+                WHERE jobno_type = :job_type AND pallet IS NOT NULL AND pallet != ''
+                GROUP BY pallet
+            """), {'job_type': self.job_type})
+            return {str(row[0]): row[1] for row in rows}
+
+    def counted(self):
+        """Số thùng đã scan theo bộ đếm scan_counters (0 nếu job chưa có bộ đếm)."""
+        with self.engine.connect() as conn:
+            row = conn.execute(text("SELECT scanned FROM scan_counters WHERE jobno_type = :job_type AND pallet = '' AND sku = ''"),
+                               {'job_type': self.job_type}).fetchone()
+            return row[0] if row else 0
+
+    def cleanup(self):
+        params = {'job_type': self.job_type}
+        with self.engine.begin() as conn:
+            # Bảng tổng hợp theo user không có jobno_type -> trừ đúng số thùng của job tạm
+            per_user = conn.execute(text("""
+                SELECT userscan, COUNT(id) FROM scanfile
+                WHERE jobno_type = :job_type AND userscan IS NOT NULL AND userscan != ''
+                GROUP BY userscan
+            """), params).fetchall()
+            for user, n in per_user:
+                conn.execute(text("UPDATE stats_users SET cartons = cartons - :n WHERE userscan = :user"), {'n': n, 'user': user})
+                conn.execute(text("DELETE FROM stats_users WHERE userscan = :user AND cartons <= 0"), {'user': user})
+            for table in ('scanfile', 'scan_counters', 'stats_job_pallets', 'productivity_hourly',
+                          'pallet_registry', 'pallet_limits', 'jobs', 'scan_ledger', 'scanned_barcodes'):
+                conn.execute(text(f"DELETE FROM {table} WHERE jobno_type = :job_type"), params)
+            conn.execute(text("DELETE FROM masterdata WHERE sku IN :skus").bindparams(bindparam('skus', expanding=True)),
+                         {'skus': list(self.skus)})
+
+
+# --- CHẠY ---
+
+class Station(threading.Thread):
+    """Một trạm scan: chọn thao tác theo tỉ lệ, nghỉ giữa hai thao tác, scan vào pallet riêng."""
+
+    def __init__(self, n, client, fixture, mix, think_ms, deadline, seed):
+        super().__init__(name=f"station-{n}", daemon=True)
+        self.client = client
+        self.fixture = fixture
+        self.pallet = str(n + 1)
+        self.think_ms = think_ms
+        self.deadline = deadline
+        self.random = random.Random(seed)
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.empty = 0
+        self.claimed = 0
+        self.replay_mismatch = 0
+        self.last_scan = None
+        self.samples = []
+
+    def _request(self, name, method, path, body=None):
+        started = time.perf_counter()
+        try:
+            status, payload = self.client.call(method, path, body)
+        except Exception as e:
+            status, payload = None, {'message': str(e)}
+        self.latencies[name].append((time.perf_counter() - started) * 1000)
+        if status != 200 or payload is None:
+            self.errors[name] += 1
+            if len(self.samples) < 5:
+                self.samples.append({'api': name, 'status': status})
+            return None
+        if not payload.get('success'):
+            message = str(payload.get('message', ''))
+            if message.startswith(EMPTY_MESSAGES):
+                self.empty += 1
+            else:
+                self.errors[name] += 1
+                if len(self.samples) < 5:
+                    self.samples.append({'api': name, 'status': status, 'message': message[:200]})
+            return None
+        return payload
+
+    def step(self):
+        job_type = self.fixture.job_type
+        name = self.random.choices(self.names, self.weights)[0]
+        sku = self.random.choice(list(self.fixture.skus))
+        if name == 'scan':
+            body = {'barcode': self.fixture.barcode(sku), 'job_type': job_type, 'pallet_no': self.pallet,
+                    'pallet_type': '1.2', 'scan_id': uuid.uuid4().hex}
+            payload = self._request(name, 'POST', '/api/scan', body)
+            if payload:
+                self.claimed += 1
+                self.last_scan = (body, payload)
+        elif name == 'scan_replay':
+            # Máy quét mất phản hồi rồi gửi lại: phải nhận đúng kết quả cũ, không gán thêm thùng
+            if self.last_scan is None:
+                return
+            body, original = self.last_scan
+            payload = self._request(name, 'POST', '/api/scan', body)
+            if payload and (not payload.get('replayed') or payload.get('sku') != original.get('sku')):
+                self.replay_mismatch += 1
+        elif name == 'check_barcode':
+            self._request(name, 'POST', '/api/check_barcode', {'barcode': self.fixture.barcode(sku), 'job_type': job_type})
+        elif name == 'bulk_update':
+            payload = self._request(name, 'POST', '/api/bulk_update', {
+                'sku': sku, 'job_type': job_type, 'pallet_no': self.pallet, 'pallet_type': '1.2', 'quantity': 2})
+            if payload:
+                self.claimed += payload.get('count', 0)
+        elif name == 'get_logs':
+            self._request(name, 'GET', '/api/get_logs')
+        else:
+            self._request(name, 'POST', f"/api/{name}", {'job_type': job_type})
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            self.step()
+            if self.think_ms:
+                # Thời gian nghỉ dao động quanh think_ms (người thao tác không đều)
+                time.sleep(self.random.expovariate(1000.0 / self.think_ms))
+
+
+def run_load(engine, client_factory, stations=20, seconds=30, cartons=5000, skus=20, mix=None,
+             think_ms=300, seed=1, prepare=None, settle=None, log=print):
+    """Chạy kiểm tra tải và trả về báo cáo (dict).
+
+    client_factory(n) -> client có .call(method, path, body); prepare(fixture): gọi sau khi tạo job tạm
+    (vd. nạp lại chỉ mục masterdata để các refix mới tra được); settle(): gọi trước khi đối chiếu DB
+    (vd. chờ hàng đợi ghi scan trống).
+    """
+    fixture = LoadFixture(engine, cartons=cartons, skus=skus)
+    mix = mix or dict(DEFAULT_MIX)
+    try:
+        if prepare:
+            prepare(fixture)
+        clients = [client_factory(n) for n in range(stations)]
+        log(f"Job tạm {fixture.job_type}: {cartons} thùng, {len(fixture.skus)} SKU, {stations} trạm, {seconds}s")
+        started = time.perf_counter()
+        deadline = time.monotonic() + seconds
+        pool = [Station(n, clients[n], fixture, mix, think_ms, deadline, seed + n) for n in range(stations)]
+        for station in pool:
+            station.start()
+        for station in pool:
+            station.join()
+        elapsed = time.perf_counter() - started
+
+        if settle:
+            settle()
+        assigned = fixture.assigned()
+        counted = fixture.counted()
+    finally:
+        fixture.cleanup()
+
+    report = {
+        'dialect': engine.dialect.name,
+        'stations': stations,
+        'seconds': round(elapsed, 3),
+        'think_ms': think_ms,
+        'cartons': cartons,
+        'mix': mix,
+        'requests': 0,
+        'errors': 0,
+        'empty': sum(station.empty for station in pool),
+        'apis': {},
+    }
+    for name in mix:
+        latencies = sorted(ms for station in pool for ms in station.latencies[name])
+        errors = sum(station.errors[name] for station in pool)
+        report['requests'] += len(latencies)
+        report['errors'] += errors
+        if not latencies:
+            continue
+        entry = {'count': len(latencies), 'errors': errors, 'rps': round(len(latencies) / elapsed, 1)}
+        entry.update({f"p{p}_ms": round(percentile(latencies, p), 2) for p in PERCENTILES})
+        entry['max_ms'] = round(latencies[-1], 2)
+        report['apis'][name] = entry
+
+    claimed = sum(station.claimed for station in pool)
+    total_assigned = sum(assigned.values())
+    # Mỗi trạm scan vào pallet riêng -> số thùng trạm nhận được OK phải bằng số thùng trên pallet đó
+    pallet_mismatch = sum(1 for station in pool if assigned.get(station.pallet, 0) != station.claimed)
+    all_latencies = sorted(ms for station in pool for values in station.latencies.values() for ms in values)
+    report.update({
+        'rps': round(report['requests'] / elapsed, 1) if elapsed else 0.0,
+        'scans_per_second': round(claimed / elapsed, 1) if elapsed else 0.0,
+        'claimed': claimed,
+        'assigned': total_assigned,
+        'double_claims': max(0, claimed - total_assigned),
+        'lost_claims': max(0, total_assigned - claimed),
+        'pallet_mismatch': pallet_mismatch,
+        'counter_drift': counted - total_assigned,
+        'replay_mismatch': sum(station.replay_mismatch for station in pool),
+        'error_samples': [sample for station in pool for sample in station.samples][:10],
+    })
+    report.update({f"p{p}_ms": round(percentile(all_latencies, p), 2) for p in PERCENTILES})
+    return report
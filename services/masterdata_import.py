@@ -0,0 +1,292 @@
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import text
+
+from services import versions
+from services.importer import ImportFileError, normalize_header, not_null_filler, table_columns
+
+# Cột masterdata có thể nạp từ file nhà cung cấp (theo models/masterdata.py)
+FLOAT_COLUMNS = ('weight', 'length', 'width', 'height', 'cbm')
+INTEGER_COLUMNS = ('quantity', 'cartonperpallet')
+TEXT_COLUMNS = ('mancc', 'description', 'refix', 'remark', 'loosecase', 'kindpallet')
+# Kích thước tính bằng cm -> cbm (m³) = D x R x C / 1.000.000
+CBM_DIVISOR = 1000000.0
+
+VERSION_NAME = 'masterdata'
+MAX_REPORT = 50
+
+
+def _to_number(value, cast):
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return cast(value)
+    return cast(float(str(value).strip().replace(',', '.')))
+
+
+def compute_cbm(lengths, widths, heights, current):
+    """Tính cbm cho các cột của một lô (vòng lặp Python theo dòng; giữ cbm có sẵn khi thiếu kích thước).
+
+    Trả về (list cbm, số dòng đã tính).
+    """
+    computed = 0
+    result = []
+    for length, width, height, cbm in zip(lengths, widths, heights, current):
+        if length and width and height:
+            cbm = round(length * width * height / CBM_DIVISOR, 6)
+            computed += 1
+        result.append(cbm)
+    return result, computed
+
+
+class MasterdataImporter:
+    """Upsert masterdata theo lô từ file nhà cung cấp.
+
+    Đọc file từng lô `chunk_size` dòng (chỉ giữ trong RAM lô đang xử lý + chỉ mục sku -> refix), tính cbm
+    cho lô rồi ghi UPDATE/INSERT bằng executemany. SKU lặp trong file: dòng sau thắng.
+    Prefix trùng: chỉ loại dòng của file làm phát sinh trùng (đổi/thêm prefix đang thuộc SKU khác); prefix đã trùng
+    sẵn trong DB không chặn các dòng khác. Dòng có thể trùng được giữ lại tới cuối file rồi kiểm tra lại (SKU kia
+    có thể được đổi prefix ở dòng sau).
+    Mọi dòng ghi có updated_at mới (watermark của chỉ mục RAM) và phiên bản 'masterdata' tăng 1.
+    Không commit - caller commit.
+    """
+
+    def __init__(self, session, chunk_size=5000, allow_collisions=False):
+        self.session = session
+        self.chunk_size = chunk_size
+        self.allow_collisions = allow_collisions
+        self.rows_read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = 0
+        self.cbm_computed = 0
+        self.errors = []
+        self.collisions = {}
+        self.ignored_columns = []
+        self.version = None
+        self._started = None
+        # sku -> refix trong DB trước khi nạp; sku -> (dòng, refix) đã ghi từ file; dòng chờ kiểm tra trùng
+        self._existing = {}
+        self._existing_by_refix = defaultdict(set)
+        self._written = {}
+        self._written_by_refix = defaultdict(set)
+        self._held = {}
+
+    def _error(self, line, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORT:
+            self.errors.append({'line': line, 'message': message})
+
+    def _plan_columns(self, header):
+        # Tên cột thực tế trong DB (production dùng 'MANCC' viết hoa)
+        self.table = table_columns(self.session, 'masterdata')
+        actual = {name.lower(): name for name in self.table}
+        known = set(FLOAT_COLUMNS + INTEGER_COLUMNS + TEXT_COLUMNS + ('sku',))
+        positions = {}
+        for i, name in enumerate(normalize_header(name) for name in header):
+            if name in known and name in actual:
+                positions.setdefault(name, i)
+            elif name:
+                self.ignored_columns.append(name)
+        if 'sku' not in positions:
+            raise ImportFileError("Thiếu cột bắt buộc: sku")
+        self.positions = positions
+        self.actual = actual
+        self.names = list(positions)
+        if 'cbm' in actual and 'cbm' not in positions and all(name in positions for name in ('length', 'width', 'height')):
+            # File không có cột cbm: tính từ kích thước
+            self.names.append('cbm')
+
+    def _parse(self, line, raw):
+        """Một dòng file -> dict theo cột, None nếu dòng lỗi."""
+        record = {}
+        try:
+            for name, i in self.positions.items():
+                value = raw[i] if i < len(raw) else ''
+                if name in FLOAT_COLUMNS:
+                    value = _to_number(value, float)
+                elif name in INTEGER_COLUMNS:
+                    value = _to_number(value, int)
+                else:
+                    if isinstance(value, float) and value.is_integer():
+                        value = int(value)
+                    value = str(value if value is not None else '').strip() or None
+                record[name] = value
+        except ValueError as e:
+            self._error(line, f"Giá trị số không hợp lệ: {e}")
+            return None
+        if not record['sku']:
+            self._error(line, "Thiếu sku")
+            return None
+        return record
+
+    def _read_batches(self, rows):
+        """Đọc file theo lô: mỗi lô {sku: (dòng, record)} theo thứ tự (SKU lặp trong lô: dòng sau thắng)."""
+        batch = {}
+        for line, raw in enumerate(rows, start=2):
+            if not any(str(value).strip() for value in raw if value is not None):
+                continue
+            self.rows_read += 1
+            record = self._parse(line, raw)
+            if record is None:
+                continue
+            previous = batch.pop(record['sku'], None)
+            if previous:
+                self._error(previous[0], f"SKU lặp lại trong file: {record['sku']} (dùng dòng {line})")
+            batch[record['sku']] = (line, record)
+            if len(batch) >= self.chunk_size:
+                yield batch
+                batch = {}
+        if batch:
+            yield batch
+
+    def _load_existing(self):
+        for sku, refix in self.session.execute(text("SELECT sku, refix FROM masterdata")):
+            refix = str(refix).strip() if refix is not None else None
+            self._existing[sku] = refix
+            if refix:
+                self._existing_by_refix[refix].add(sku)
+
+    def _current_refix(self, sku):
+        if sku in self._written:
+            return self._written[sku][1]
+        return self._existing.get(sku)
+
+    def _collides(self, sku, refix):
+        """Các SKU khác đang giữ `refix` nếu dòng này đổi/thêm prefix thành `refix` (rỗng = không phát sinh trùng)."""
+        if not refix or self._current_refix(sku) == refix:
+            return set()
+        others = {other for other in self._existing_by_refix[refix] if self._current_refix(other) == refix}
+        others |= self._written_by_refix[refix]
+        others.discard(sku)
+        return others
+
+    def _cbm(self, records):
+        # Tính cbm cho lô (chỉ khi bảng có cột cbm và file có đủ kích thước)
+        if 'cbm' not in self.actual or not all(name in self.positions for name in ('length', 'width', 'height')):
+            return
+        values, computed = compute_cbm([record['length'] for record in records], [record['width'] for record in records],
+                                       [record['height'] for record in records], [record.get('cbm') for record in records])
+        self.cbm_computed += computed
+        for record, cbm in zip(records, values):
+            record['cbm'] = cbm
+
+    def _accept(self, line, record, updates, inserts):
+        """Nhận dòng vào lô ghi và cập nhật chỉ mục prefix (dòng sau trong file kiểm tra trùng với dòng này)."""
+        sku, refix = record['sku'], record.get('refix')
+        if sku in self._written:
+            # SKU đã ghi ở lô trước -> dòng sau thắng (đã đếm thêm/cập nhật ở lần ghi đầu)
+            previous_line, previous_refix = self._written[sku]
+            self._error(previous_line, f"SKU lặp lại trong file: {sku} (dùng dòng {line})")
+            if previous_refix:
+                self._written_by_refix[previous_refix].discard(sku)
+            updates.append(record)
+        elif sku in self._existing:
+            self.updated += 1
+            updates.append(record)
+        else:
+            self.inserted += 1
+            inserts.append(record)
+        self._written[sku] = (line, refix)
+        if refix:
+            self._written_by_refix[refix].add(sku)
+
+    def _write(self, updates, inserts, now):
+        self._cbm(updates + inserts)
+        self._write_updates(self.names, updates, now)
+        self._write_inserts(self.names, inserts, now)
+
+    def run(self, rows):
+        """rows: iterable các dòng (list giá trị), dòng đầu là tiêu đề. Trả về summary()."""
+        self._started = time.perf_counter()
+        rows = iter(rows)
+        header = next(rows, None)
+        if not header:
+            raise ImportFileError("File rỗng")
+        self._plan_columns(header)
+        self._load_existing()
+        check_refix = 'refix' in self.positions
+        now = datetime.now()
+
+        for batch in self._read_batches(rows):
+            updates, inserts = [], []
+            for sku, (line, record) in batch.items():
+                held = self._held.pop(sku, None)
+                if held:
+                    self._error(held[0], f"SKU lặp lại trong file: {sku} (dùng dòng {line})")
+                if check_refix and self._collides(sku, record['refix']):
+                    self._held[sku] = (line, record)
+                else:
+                    self._accept(line, record, updates, inserts)
+            self._write(updates, inserts, now)
+
+        # Dòng chờ: kiểm tra lại khi đã đọc hết file (SKU đang giữ prefix có thể đã được đổi ở dòng sau)
+        updates, inserts = [], []
+        for sku, (line, record) in sorted(self._held.items(), key=lambda item: item[1][0]):
+            others = self._collides(sku, record['refix'])
+            if others:
+                self.collisions[record['refix']] = sorted(others | {sku})
+                if not self.allow_collisions:
+                    self._error(line, f"Prefix {record['refix']} trùng với SKU khác: {', '.join(sorted(others))}")
+                    continue
+            self._accept(line, record, updates, inserts)
+        self._write(updates, inserts, now)
+
+        if self.inserted or self.updated:
+            self.version = versions.bump(self.session, VERSION_NAME)
+        return self.summary()
+
+    def _chunks(self, records):
+        for start in range(0, len(records), self.chunk_size):
+            yield records[start:start + self.chunk_size]
+
+    def _write_updates(self, names, records, now):
+        if not records:
+            return
+        fields = [name for name in names if name != 'sku']
+        assignments = [f"{self.actual[name]} = :{name}" for name in fields]
+        if 'updated_at' in self.actual:
+            assignments.append("updated_at = :updated_at")
+        sql = text(f"UPDATE masterdata SET {', '.join(assignments)} WHERE sku = :sku")
+        for chunk in self._chunks(records):
+            self.session.execute(sql, [dict(record, updated_at=now) for record in chunk])
+
+    def _write_inserts(self, names, records, now):
+        if not records:
+            return
+        constants = {}
+        lowered = {name.lower() for name in names}
+        for name, col in self.table.items():
+            if name.lower() in lowered or name in ('id', 'updated_at'):
+                continue
+            value = not_null_filler(col)
+            if value is not None:
+                constants[name] = value
+        if 'updated_at' in self.actual:
+            constants['updated_at'] = now
+        params = {f"c_{i}": value for i, value in enumerate(constants.values())}
+        column_sql = [self.actual[name] for name in names] + list(constants)
+        value_sql = [f":{name}" for name in names] + list(f":{key}" for key in params)
+        sql = text(f"INSERT INTO masterdata ({', '.join(column_sql)}) VALUES ({', '.join(value_sql)})")
+        for chunk in self._chunks(records):
+            self.session.execute(sql, [dict(record, **params) for record in chunk])
+
+    def summary(self):
+        elapsed = time.perf_counter() - self._started if self._started else 0
+        written = self.inserted + self.updated
+        return {
+            'rows_read': self.rows_read,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'rejected': self.rejected,
+            'cbm_computed': self.cbm_computed,
+            'collisions': [{'refix': refix, 'skus': skus} for refix, skus in list(self.collisions.items())[:MAX_REPORT]],
+            'collision_count': len(self.collisions),
+            'errors': self.errors,
+            'ignored_columns': self.ignored_columns,
+            'version': self.version,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(written / elapsed, 1) if elapsed else 0.0,
+        }
@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+# Bản ghi gọn nhẹ cho mỗi prefix (refix) - chỉ giữ các cột cần cho luồng scan/in
+MasterRecord = namedtuple('MasterRecord', ['sku', 'weight', 'length', 'width', 'height', 'cartonperpallet'])
+
+INDEX_COLUMNS = ('refix',) + MasterRecord._fields
+
+
+class MasterDataIndex:
+    """Chỉ mục prefix -> SKU của bảng masterdata, nằm trong RAM của từng worker.
+
+    Nạp toàn bộ một lần, sau đó mỗi `refresh_interval` giây kiểm tra watermark
+    (COUNT, MAX(updated_at)) bằng một câu query nhỏ và chỉ tải lại các dòng đã đổi.
+    """
+
+    def __init__(self, refresh_interval=30, full_reload_interval=600):
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self._lock = threading.Lock()
+        self._by_refix = {}
+        self._columns = None
+        self._row_count = None
+        self._watermark = None
+        self._loaded_at = None
+        self._checked_at = 0.0
+        self._full_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.full_loads = 0
+        self.collisions = 0
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def _detect_columns(self, session):
+        # DB cũ (SQLite local) có thể thiếu cột kích thước/updated_at -> thay bằng NULL
+        existing = {c['name'] for c in inspect(session.get_bind()).get_columns('masterdata')}
+        self._columns = existing
+        return existing
+
+    def _select_list(self):
+        return ', '.join(c if c in self._columns else f'NULL AS {c}' for c in INDEX_COLUMNS)
+
+    def _has_watermark(self):
+        return 'updated_at' in self._columns
+
+    def _read_watermark(self, session):
+        if self._has_watermark():
+            row = session.execute(text("SELECT COUNT(*), MAX(updated_at) FROM masterdata")).fetchone()
+            return row[0], row[1]
+        row = session.execute(text("SELECT COUNT(*) FROM masterdata")).fetchone()
+        return row[0], None
+
+    def _apply_rows(self, target, rows):
+        for row in rows:
+            refix = row[0]
+            if refix is None or refix == '':
+                continue
+            refix = str(refix).strip()
+            record = MasterRecord(*row[1:])
+            current = target.get(refix)
+            if current is not None and current.sku != record.sku:
+                # refix không unique trong DB: giữ bản ghi đầu tiên như hành vi fetchone() cũ
+                self.collisions += 1
+                continue
+            target[refix] = record
+
+    def load(self, session):
+        """Nạp toàn bộ masterdata vào RAM (thay thế chỉ mục hiện tại)."""
+        self._detect_columns(session)
+        row_count, watermark = self._read_watermark(session)
+        rows = session.execute(text(f"SELECT {self._select_list()} FROM masterdata")).fetchall()
+
+        fresh = {}
+        self.collisions = 0
+        self._apply_rows(fresh, rows)
+
+        with self._lock:
+            self._by_refix = fresh
+            self._row_count = row_count
+            self._watermark = watermark
+            self._loaded_at = datetime.now()
+            self._checked_at = self._full_at = time.monotonic()
+            self.full_loads += 1
+        return len(fresh)
+
+    def refresh(self, session, force=False):
+        """Đồng bộ tăng dần theo watermark; tự nạp lại toàn bộ khi phát hiện xóa dòng."""
+        now = time.monotonic()
+        if not self.loaded or (now - self._full_at) >= self.full_reload_interval:
+            return self.load(session)
+        if not force and (now - self._checked_at) < self.refresh_interval:
+            return 0
+
+        with self._lock:
+            self._checked_at = now
+        row_count, watermark = self._read_watermark(session)
+        if row_count == self._row_count and watermark == self._watermark:
+            return 0
+
+        if (not self._has_watermark() or self._watermark is None
+                or watermark == self._watermark or row_count < self._row_count):
+            # Dòng bị xóa/thêm mà watermark không đổi -> không thể đồng bộ tăng dần
+            return self.load(session)
+
+        rows = session.execute(
+            text(f"SELECT {self._select_list()} FROM masterdata WHERE updated_at >= :wm"),
+            {'wm': self._watermark}
+        ).fetchall()
+
+        with self._lock:
+            # Dòng đã đổi: bỏ bản ghi cũ theo refix mới và theo SKU (trường hợp đổi refix)
+            changed_refix = {str(r[0]).strip() for r in rows if r[0]}
+            changed_sku = {r[1] for r in rows}
+            updated = {k: v for k, v in self._by_refix.items()
+                       if k not in changed_refix and v.sku not in changed_sku}
+            self._apply_rows(updated, rows)
+            self._by_refix = updated
+            self._watermark = watermark
+            self.refreshes += 1
+
+        # Số dòng mới nhiều hơn số dòng đã tải -> có dòng được thêm mà không set updated_at
+        if row_count - self._row_count > len(rows):
+            return self.load(session)
+        self._row_count = row_count
+        return len(rows)
+
+    def lookup(self, refix):
+        """Tra cứu prefix hoàn toàn trong RAM. Trả về MasterRecord hoặc None."""
+        record = self._by_refix.get(refix)
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return record
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'loaded': self.loaded,
+            'size': len(self._by_refix),
+            'rows': self._row_count,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'refreshes': self.refreshes,
+            'full_loads': self.full_loads,
+            'collisions': self.collisions,
+            'watermark': str(self._watermark) if self._watermark is not None else None,
+            'loaded_at': self._loaded_at.strftime('%Y-%m-%d %H:%M:%S') if self._loaded_at else None,
+        }
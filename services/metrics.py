@@ -0,0 +1,273 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+
+# Số liệu vận hành dạng Prometheus (/metrics).
+# Mỗi worker gunicorn đếm trong RAM (thời gian request theo route, request đang chạy, số câu SQL và thời gian DB
+# mỗi request, thời gian chờ lấy kết nối từ pool) và ghi bản chụp ra file <pid>.json trong thư mục dùng chung
+# tối đa mỗi `flush_interval` giây. /metrics cộng bản chụp của mọi worker còn sống (file của worker đã chết bị xóa,
+# Prometheus coi bộ đếm giảm là reset).
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# name -> (loại, mô tả, buckets)
+METRICS = {
+    'scan_http_requests_total': ('counter', 'Số request theo route, method và mã HTTP', None),
+    'scan_http_request_duration_seconds': ('histogram', 'Thời gian xử lý request theo route', LATENCY_BUCKETS),
+    'scan_http_requests_in_flight': ('gauge', 'Số request đang xử lý theo route', None),
+    'scan_db_statements_per_request': ('histogram', 'Số câu SQL mỗi request theo route', STATEMENT_BUCKETS),
+    'scan_db_seconds_per_request': ('histogram', 'Tổng thời gian chờ DB mỗi request theo route', LATENCY_BUCKETS),
+    'scan_db_statements_total': ('counter', 'Số câu SQL theo route (background = luồng nền/CLI)', None),
+    'scan_db_seconds_total': ('counter', 'Tổng thời gian thực thi SQL theo route', None),
+    'scan_db_pool_checkout_wait_seconds': ('histogram', 'Thời gian chờ lấy kết nối từ pool', WAIT_BUCKETS),
+    'scan_db_pool_size': ('gauge', 'Kích thước pool kết nối (cộng mọi worker)', None),
+    'scan_db_pool_checked_out': ('gauge', 'Số kết nối đang được dùng (cộng mọi worker)', None),
+    'scan_db_pool_overflow': ('gauge', 'Số kết nối vượt pool_size (cộng mọi worker)', None),
+    'scan_barcode_rejected_total': ('counter', 'Số mã vạch bị từ chối khi đọc (trước khi tra masterdata) theo lý do', None),
+    'scan_replays_total': ('counter', 'Số lần quét gửi lại (cùng scan_id) được trả kết quả cũ', None),
+    'scan_duplicates_total': ('counter', 'Số lần quét lại mã vạch đã scan trong job (bị chặn)', None),
+    'scan_queue_depth': ('gauge', 'Số scan trong hàng đợi chờ ghi vào DB chính (worker đang ghi báo)', None),
+    'scan_queue_oldest_seconds': ('gauge', 'Tuổi của scan chờ ghi lâu nhất', None),
+    'scan_queue_accepted_total': ('counter', 'Số scan nhận vào hàng đợi', None),
+    'scan_queue_refused_total': ('counter', 'Số scan bị từ chối vì hàng đợi đầy (máy quét gửi lại)', None),
+    'scan_queue_flushed_total': ('counter', 'Số scan đã gán thùng trong DB chính', None),
+    'scan_queue_rejected_total': ('counter', 'Số scan đã nhận nhưng không gán được khi ghi', None),
+    'scan_queue_flush_errors_total': ('counter', 'Số lần ghi lô thất bại (sẽ thử lại)', None),
+    'scan_queue_flush_size': ('histogram', 'Số scan mỗi lô ghi', BATCH_BUCKETS),
+    'scan_queue_flush_seconds': ('histogram', 'Thời gian ghi một lô (một transaction)', LATENCY_BUCKETS),
+    'scan_workers': ('gauge', 'Số worker có số liệu', None),
+}
+
+
+def _label_key(labels):
+    return json.dumps(sorted(labels.items()), ensure_ascii=False)
+
+
+class Registry:
+    """Bộ đếm/gauge/histogram của một worker. Nhãn lưu dạng chuỗi JSON để ghi/đọc file dễ dàng."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {name: {} for name in METRICS}
+
+    def inc(self, name, labels, amount=1):
+        key = _label_key(labels)
+        with self._lock:
+            series = self.values[name]
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name, labels, value):
+        with self._lock:
+            self.values[name][_label_key(labels)] = value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = _label_key(labels)
+        with self._lock:
+            series = self.values[name]
+            entry = series.get(key)
+            if entry is None:
+                # [số lần theo từng bucket..., +Inf, tổng, số lần]
+                entry = series[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+            entry[bisect_left(buckets, value)] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(self.values))
+
+
+def merge(snapshots):
+    """Cộng bản chụp của nhiều worker."""
+    total = {name: {} for name in METRICS}
+    for snapshot in snapshots:
+        for name, series in snapshot.items():
+            if name not in total:
+                continue
+            for key, value in series.items():
+                current = total[name].get(key)
+                if current is None:
+                    total[name][key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    total[name][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    total[name][key] = current + value
+    return total
+
+
+def _format_labels(key, extra=None):
+    pairs = json.loads(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def render(values):
+    """Văn bản Prometheus exposition format."""
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = values.get(name) or {}
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key in sorted(series):
+            value = series[key]
+            if kind != 'histogram':
+                lines.append(f"{name}{_format_labels(key)} {_format_number(value)}")
+                continue
+            cumulative = 0
+            for bound, n in zip(list(buckets) + ['+Inf'], value[:-2]):
+                cumulative += n
+                lines.append(f"{name}_bucket{_format_labels(key, ('le', bound))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(key)} {_format_number(value[-2])}")
+            lines.append(f"{name}_count{_format_labels(key)} {value[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+class WorkerMetrics:
+    """Số liệu của worker hiện tại + đồng bộ qua thư mục dùng chung giữa các worker."""
+
+    def __init__(self, directory, flush_interval=2.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.registry = Registry()
+        self._flushed_at = 0.0
+        self._pool = None
+        self._local = threading.local()
+
+    # --- REQUEST ---
+
+    def request_started(self, endpoint):
+        self._local.sql = [0, 0.0]
+        self._local.endpoint = endpoint
+        self.registry.inc('scan_http_requests_in_flight', {'endpoint': endpoint})
+
+    def request_finished(self, endpoint, method, status, seconds):
+        statements, db_seconds = getattr(self._local, 'sql', None) or (0, 0.0)
+        self._local.sql = None
+        self._local.endpoint = None
+        labels = {'endpoint': endpoint}
+        self.registry.inc('scan_http_requests_in_flight', labels, -1)
+        self.registry.inc('scan_http_requests_total', {'endpoint': endpoint, 'method': method, 'status': str(status)})
+        self.registry.observe('scan_http_request_duration_seconds', labels, seconds)
+        self.registry.observe('scan_db_statements_per_request', labels, statements)
+        self.registry.observe('scan_db_seconds_per_request', labels, db_seconds)
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    # --- SQLALCHEMY ---
+
+    def instrument(self, engine):
+        """Gắn event đếm câu SQL/thời gian DB và đo thời gian chờ pool cho engine."""
+        def before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+        def after(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info.get('metrics_started')
+            if not started:
+                return
+            elapsed = time.perf_counter() - started.pop()
+            sql = getattr(self._local, 'sql', None)
+            if sql is not None:
+                sql[0] += 1
+                sql[1] += elapsed
+            endpoint = getattr(self._local, 'endpoint', None) or 'background'
+            self.registry.inc('scan_db_statements_total', {'endpoint': endpoint})
+            self.registry.inc('scan_db_seconds_total', {'endpoint': endpoint}, elapsed)
+
+        def handle_error(context):
+            # Câu lỗi không tới after_cursor_execute -> bỏ mốc thời gian để không lệch cặp
+            started = context.connection.info.get('metrics_started') if context.connection is not None else None
+            if started:
+                started.pop()
+
+        event.listen(engine, 'before_cursor_execute', before)
+        event.listen(engine, 'after_cursor_execute', after)
+        event.listen(engine, 'handle_error', handle_error)
+
+        pool = engine.pool
+        self._pool = pool
+        do_get = getattr(pool, '_do_get', None)
+        if do_get is not None:
+            # Pool không có event "bắt đầu chờ" -> bọc hàm lấy kết nối của chính pool này
+            def timed_do_get():
+                started = time.perf_counter()
+                try:
+                    return do_get()
+                finally:
+                    self.registry.observe('scan_db_pool_checkout_wait_seconds', {}, time.perf_counter() - started)
+            pool._do_get = timed_do_get
+
+    def _pool_gauges(self):
+        pool = self._pool
+        for name, attr in (('scan_db_pool_size', 'size'), ('scan_db_pool_checked_out', 'checkedout'),
+                           ('scan_db_pool_overflow', 'overflow')):
+            method = getattr(pool, attr, None)
+            if method is not None:
+                self.registry.set(name, {}, max(0, method()))
+
+    # --- CHIA SẺ GIỮA CÁC WORKER ---
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def flush(self):
+        self._flushed_at = time.monotonic()
+        if self._pool is not None:
+            self._pool_gauges()
+        self.registry.set('scan_workers', {}, 1)
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(os.getpid())
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(tmp, path)
+
+    def collect(self):
+        """Bản chụp đã cộng của mọi worker còn sống (ghi bản của worker hiện tại trước)."""
+        self.flush()
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            pid = int(name[:-5]) if name[:-5].isdigit() else None
+            path = os.path.join(self.directory, name)
+            if pid is not None and pid != os.getpid() and not _alive(pid):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path, encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return merge(snapshots)
+
+    def render(self):
+        return render(self.collect())
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
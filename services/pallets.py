@@ -0,0 +1,160 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+from services import archive
+from services import jobs
+
+# Sổ pallet: pallet_registry (jobno_type, pallet_no) -> state, pallet_type, cartons.
+# Chỉ giữ pallet đang có thùng; pallet về 0 thùng bị xóa (= Trống).
+# Trạng thái: open (đang scan) -> finished (finish_pallet) -> printed (đã gán jobscan/in tem).
+# Scan thêm hoặc gỡ thùng khỏi pallet đã xong/đã in -> quay lại open (tem cũ không còn đúng).
+# Số pallet mỗi job: pallet_limits (jobno_type) -> pallet_count, mặc định Config.PALLETS_PER_JOB.
+
+OPEN = 'open'
+FINISHED = 'finished'
+PRINTED = 'printed'
+STATE_LABELS = {OPEN: 'Đang dùng', FINISHED: 'Đã xong', PRINTED: 'Đã in'}
+
+
+def _dialect(session):
+    return session.get_bind().dialect.name
+
+
+def add_cartons(session, job_type, pallet, pallet_type, n):
+    """Cộng n thùng vừa scan vào pallet (tạo pallet nếu chưa có). Không commit."""
+    if not n:
+        return
+    params = {'job_type': job_type, 'pallet': str(pallet), 'pallet_type': pallet_type or '',
+              'n': n, 'state': OPEN, 'now': datetime.now()}
+    if _dialect(session) == 'mysql':
+        sql = """
+            INSERT INTO pallet_registry (jobno_type, pallet_no, state, pallet_type, cartons, updated_at)
+            VALUES (:job_type, :pallet, :state, :pallet_type, :n, :now)
+            ON DUPLICATE KEY UPDATE cartons = cartons + VALUES(cartons), state = VALUES(state),
+                pallet_type = VALUES(pallet_type), updated_at = VALUES(updated_at)
+        """
+    else:
+        sql = """
+            INSERT INTO pallet_registry (jobno_type, pallet_no, state, pallet_type, cartons, updated_at)
+            VALUES (:job_type, :pallet, :state, :pallet_type, :n, :now)
+            ON CONFLICT (jobno_type, pallet_no) DO UPDATE SET cartons = pallet_registry.cartons + excluded.cartons,
+                state = excluded.state, pallet_type = excluded.pallet_type, updated_at = excluded.updated_at
+        """
+    session.execute(text(sql), params)
+
+
+def remove_cartons(session, job_type, pallet, n):
+    """Trừ n thùng bị gỡ khỏi pallet; pallet hết thùng bị xóa khỏi sổ. Không commit."""
+    if not n:
+        return
+    params = {'job_type': job_type, 'pallet': str(pallet), 'n': n, 'state': OPEN, 'now': datetime.now()}
+    session.execute(text("""
+        UPDATE pallet_registry SET cartons = cartons - :n, state = :state, updated_at = :now
+        WHERE jobno_type = :job_type AND pallet_no = :pallet
+    """), params)
+    session.execute(text("DELETE FROM pallet_registry WHERE jobno_type = :job_type AND pallet_no = :pallet AND cartons <= 0"), params)
+
+
+def set_state(session, job_type, state, pallet=None):
+    """Đổi trạng thái một pallet (hoặc mọi pallet của job khi pallet=None). Trả về số pallet đã đổi."""
+    pallet_sql = "AND pallet_no = :pallet" if pallet is not None else ""
+    result = session.execute(text(f"""
+        UPDATE pallet_registry SET state = :state, updated_at = :now
+        WHERE jobno_type = :job_type {pallet_sql} AND state != :state
+    """), {'job_type': job_type, 'pallet': str(pallet), 'state': state, 'now': datetime.now()})
+    return result.rowcount
+
+
+# --- ĐỌC (theo khóa chính) ---
+
+def job_pallets(session, job_type):
+    """{pallet_no: {'state', 'pallet_type', 'cartons'}} của các pallet đang có thùng."""
+    query = text("SELECT pallet_no, state, pallet_type, cartons FROM pallet_registry WHERE jobno_type = :job_type")
+    return {
+        str(row[0]): {'state': row[1], 'pallet_type': row[2], 'cartons': row[3]}
+        for row in session.execute(query, {'job_type': job_type})
+    }
+
+
+def used_anywhere(session):
+    """Số pallet đang có thùng ở các job chưa đóng (job đã đóng/lưu trữ không giữ số pallet)."""
+    query = text("""
+        SELECT DISTINCT pallet_no FROM pallet_registry
+        WHERE jobno_type NOT IN (SELECT jobno_type FROM jobs WHERE status != :active)
+    """)
+    return {str(row[0]) for row in session.execute(query, {'active': jobs.ACTIVE})}
+
+
+def pallet_limit(session, job_type, default):
+    row = session.execute(text("SELECT pallet_count FROM pallet_limits WHERE jobno_type = :job_type"),
+                          {'job_type': job_type}).fetchone()
+    return row[0] if row and row[0] else default
+
+
+def set_limit(session, job_type, count):
+    """Đặt số pallet cho job (None -> về mặc định). Không commit."""
+    session.execute(text("DELETE FROM pallet_limits WHERE jobno_type = :job_type"), {'job_type': job_type})
+    if count:
+        session.execute(text("INSERT INTO pallet_limits (jobno_type, pallet_count) VALUES (:job_type, :count)"),
+                        {'job_type': job_type, 'count': int(count)})
+
+
+def numbers(limit, used):
+    """Số pallet hiển thị: 1..limit, mở rộng tới pallet số lớn nhất đang dùng, rồi các pallet không phải số."""
+    numeric = [int(p) for p in used if p.isdigit()]
+    top = max([limit] + numeric)
+    return list(range(1, top + 1)) + sorted(p for p in used if not p.isdigit())
+
+
+def options(registry, limit):
+    """Danh sách chọn pallet cho màn hình scan: [{'no', 'label', 'state', 'cartons'}]."""
+    result = []
+    for no in numbers(limit, set(registry)):
+        info = registry.get(str(no))
+        if info:
+            label = f"{no} ({STATE_LABELS.get(info['state'], 'Đang dùng')})"
+            result.append({'no': no, 'label': label, 'state': info['state'], 'cartons': info['cartons']})
+        else:
+            result.append({'no': no, 'label': f"{no} (Trống)", 'state': None, 'cartons': 0})
+    return result
+
+
+# --- TÍNH LẠI ---
+
+def source_sql(source='scanfile', where=''):
+    # Pallet in xong khi mọi thùng đã có jobscan; trạng thái 'finished' không suy ra được từ scanfile
+    return f"""
+        SELECT jobno_type, pallet,
+               CASE WHEN SUM(CASE WHEN jobscan IS NOT NULL AND jobscan != '' THEN 1 ELSE 0 END) = COUNT(id)
+                    THEN '{PRINTED}' ELSE '{OPEN}' END,
+               COALESCE(MAX(pallet_type), ''), COUNT(id)
+        FROM {source}
+        WHERE jobno_type IS NOT NULL AND pallet IS NOT NULL AND pallet != '' {where}
+        GROUP BY jobno_type, pallet
+    """
+
+
+def rebuild(session, job_type=None):
+    """Tính lại sổ pallet từ scanfile (+ scanfile_archive), giữ trạng thái 'finished' của pallet chưa in. Không commit."""
+    job_sql = "AND jobno_type = :job_type" if job_type else ""
+    params = {'job_type': job_type, 'state': FINISHED}
+    finished = {
+        (row[0], row[1]) for row in session.execute(
+            text(f"SELECT jobno_type, pallet_no FROM pallet_registry WHERE state = :state {job_sql}"), params)
+    }
+    session.execute(text(f"DELETE FROM pallet_registry WHERE 1 = 1 {job_sql}"), params)
+    source = archive.all_rows(['id', 'jobno_type', 'pallet', 'pallet_type', 'jobscan'])
+    now = datetime.now()
+    rows = []
+    for name, pallet, state, pallet_type, cartons in session.execute(text(source_sql(source, job_sql)), params):
+        if state == OPEN and (name, str(pallet)) in finished:
+            state = FINISHED
+        rows.append({'job_type': name, 'pallet': str(pallet), 'state': state,
+                     'pallet_type': pallet_type, 'cartons': cartons, 'now': now})
+    if rows:
+        session.execute(text("""
+            INSERT INTO pallet_registry (jobno_type, pallet_no, state, pallet_type, cartons, updated_at)
+            VALUES (:job_type, :pallet, :state, :pallet_type, :cartons, :now)
+        """), rows)
+    return len(rows)
@@ -0,0 +1,140 @@
+import unicodedata
+import zlib
+
+# Trình ghi PDF tối giản: font chuẩn Helvetica (không nhúng font), chữ, đường kẻ, khung và vạch mã vạch.
+# Tọa độ tính bằng mm từ góc trên bên trái của trang.
+
+MM = 72.0 / 25.4
+
+FONTS = {False: 'F1', True: 'F2'}
+FONT_NAMES = {'F1': 'Helvetica', 'F2': 'Helvetica-Bold'}
+
+# Độ rộng ký tự Helvetica (AFM, đơn vị 1/1000 em) cho ASCII 32-126 - dùng để căn giữa/thu nhỏ chữ
+_HELVETICA = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+BOLD_FACTOR = 1.07
+
+
+def plain_text(value):
+    """Bỏ dấu tiếng Việt để hiển thị được bằng font chuẩn WinAnsi (không nhúng font)."""
+    value = '' if value is None else str(value)
+    value = value.replace('đ', 'd').replace('Đ', 'D')
+    value = unicodedata.normalize('NFKD', value)
+    value = ''.join(ch for ch in value if not unicodedata.combining(ch))
+    return value.encode('cp1252', errors='replace').decode('cp1252')
+
+
+def text_width(value, size, bold=False):
+    units = sum(_HELVETICA[ord(ch) - 32] if 32 <= ord(ch) <= 126 else 556 for ch in value)
+    width_pt = units * size / 1000.0 * (BOLD_FACTOR if bold else 1.0)
+    return width_pt / MM
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _num(value):
+    return f"{value:.2f}"
+
+
+class PageCanvas:
+    """Nội dung một trang. `content()` trả về stream đã nén (bytes, có thể gửi qua process pool)."""
+
+    def __init__(self, width_mm, height_mm):
+        self.width = width_mm
+        self.height = height_mm
+        self.ops = []
+
+    def _y(self, y_mm):
+        return (self.height - y_mm) * MM
+
+    def text(self, x, y, value, size=10, bold=False, align='left', max_width=None):
+        """Viết chữ với đường chân chữ tại y. max_width: thu nhỏ cỡ chữ cho vừa (mm)."""
+        value = plain_text(value)
+        if not value:
+            return
+        width = text_width(value, size, bold)
+        if max_width and width > max_width:
+            size = size * max_width / width
+            width = max_width
+        if align == 'center':
+            x -= width / 2
+        elif align == 'right':
+            x -= width
+        self.ops.append(f"BT /{FONTS[bold]} {_num(size)} Tf {_num(x * MM)} {_num(self._y(y))} Td ({_escape(value)}) Tj ET")
+
+    def rect(self, x, y, w, h, fill=False, gray=0.0, line_width=0.3):
+        box = f"{_num(x * MM)} {_num(self._y(y + h))} {_num(w * MM)} {_num(h * MM)} re"
+        if fill:
+            self.ops.append(f"{_num(gray)} g {box} f 0 g")
+        else:
+            self.ops.append(f"{_num(line_width * MM)} w {box} S")
+
+    def line(self, x1, y1, x2, y2, line_width=0.3):
+        self.ops.append(f"{_num(line_width * MM)} w {_num(x1 * MM)} {_num(self._y(y1))} m {_num(x2 * MM)} {_num(self._y(y2))} l S")
+
+    def bars(self, x, y, height, widths, module):
+        """Vẽ mã vạch: widths là độ rộng xen kẽ vạch/khoảng trắng (module), module tính bằng mm."""
+        ops = []
+        bottom = _num(self._y(y + height))
+        bar_height = _num(height * MM)
+        unit = module * MM
+        position = x * MM
+        for i, w in enumerate(widths):
+            if i % 2 == 0:
+                ops.append(f"{position:.2f} {bottom} {w * unit:.2f} {bar_height} re")
+            position += w * unit
+        # Gộp tất cả vạch vào một lệnh fill
+        self.ops.append(' '.join(ops) + ' f')
+
+    def content(self):
+        return zlib.compress('\n'.join(self.ops).encode('cp1252', errors='replace'))
+
+
+class PdfDocument:
+    def __init__(self):
+        self.pages = []
+
+    def add_page(self, width_mm, height_mm, content):
+        self.pages.append((width_mm, height_mm, content))
+
+    def to_bytes(self):
+        objects = []
+
+        def add(body):
+            objects.append(body)
+            return len(objects)
+
+        catalog = add(None)
+        pages = add(None)
+        fonts = {name: add(f"<< /Type /Font /Subtype /Type1 /BaseFont /{base} /Encoding /WinAnsiEncoding >>".encode())
+                 for name, base in FONT_NAMES.items()}
+        font_refs = ' '.join(f"/{name} {ref} 0 R" for name, ref in fonts.items())
+        kids = []
+        for width, height, content in self.pages:
+            stream = add(f"<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n".encode() + content + b"\nendstream")
+            kids.append(add(
+                f"<< /Type /Page /Parent {pages} 0 R /MediaBox [0 0 {_num(width * MM)} {_num(height * MM)}] "
+                f"/Resources << /Font << {font_refs} >> >> /Contents {stream} 0 R >>".encode()
+            ))
+        objects[catalog - 1] = f"<< /Type /Catalog /Pages {pages} 0 R >>".encode()
+        objects[pages - 1] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>".encode()
+
+        out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(out))
+            out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+        xref = len(out)
+        out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+        for offset in offsets:
+            out += f"{offset:010d} 00000 n \n".encode()
+        out += f"trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+        return bytes(out)
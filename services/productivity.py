@@ -0,0 +1,154 @@
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import bindparam, text
+
+from services import archive
+
+# Năng suất theo giờ: productivity_hourly (bucket 'YYYY-MM-DD HH:00', userscan, jobno_type) -> cartons.
+# Cập nhật cùng transaction với mỗi lần scan; báo cáo khoảng ngày chỉ đọc các bucket trong khoảng
+# (khóa chính bắt đầu bằng bucket) rồi gộp theo giờ/ngày/tuần trong Python.
+# Số liệu giống query cũ trên scanfile: mỗi thùng tính cho userscan + time_scan hiện tại của nó.
+
+GRANULARITIES = ('hour', 'day', 'week')
+
+# Biểu thức bucket giờ theo loại DB (dùng khi tính lại từ scanfile)
+BUCKET_SQL = {
+    'mysql': "DATE_FORMAT(time_scan, '%Y-%m-%d %H:00')",
+    'postgresql': "to_char(time_scan, 'YYYY-MM-DD HH24:00')",
+    'sqlite': "strftime('%Y-%m-%d %H:00', time_scan)",
+}
+
+
+def _dialect(session):
+    return session.get_bind().dialect.name
+
+
+def bucket_of(value):
+    """datetime (hoặc chuỗi từ SQLite) -> 'YYYY-MM-DD HH:00'. None nếu không có thời gian."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:00')
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d 00:00')
+    value = str(value)
+    return f"{value[:10]} {value[11:13] or '00'}:00"
+
+
+def _upsert(session, deltas):
+    rows = [
+        {'bucket': bucket, 'userscan': user, 'jobno_type': job_type, 'cartons': n}
+        for (bucket, user, job_type), n in sorted(deltas.items()) if n
+    ]
+    if not rows:
+        return
+    if _dialect(session) == 'mysql':
+        sql = """
+            INSERT INTO productivity_hourly (bucket, userscan, jobno_type, cartons)
+            VALUES (:bucket, :userscan, :jobno_type, :cartons)
+            ON DUPLICATE KEY UPDATE cartons = cartons + VALUES(cartons)
+        """
+    else:
+        sql = """
+            INSERT INTO productivity_hourly (bucket, userscan, jobno_type, cartons)
+            VALUES (:bucket, :userscan, :jobno_type, :cartons)
+            ON CONFLICT (bucket, userscan, jobno_type) DO UPDATE SET cartons = productivity_hourly.cartons + excluded.cartons
+        """
+    session.execute(text(sql), rows)
+
+
+def apply_claims(session, job_type, claimed):
+    """Ghi nhận các thùng vừa scan (claims.ClaimedRow): cộng vào bucket mới, trừ khỏi bucket cũ nếu scan lại."""
+    deltas = Counter()
+    for row in claimed:
+        new = (bucket_of(row.time_scan), row.userscan)
+        old = (bucket_of(row.prev_time), row.prev_user)
+        if new == old:
+            continue
+        if all(new):
+            deltas[new + (job_type,)] += 1
+        if all(old):
+            deltas[old + (job_type,)] -= 1
+    _upsert(session, deltas)
+
+
+def rebuild_sql(dialect, source='scanfile'):
+    return f"""
+        SELECT {BUCKET_SQL[dialect]}, userscan, COALESCE(jobno_type, ''), COUNT(id)
+        FROM {source}
+        WHERE userscan IS NOT NULL AND userscan != '' AND time_scan IS NOT NULL
+        GROUP BY {BUCKET_SQL[dialect]}, userscan, COALESCE(jobno_type, '')
+    """
+
+
+def rebuild(session):
+    """Tính lại toàn bộ từ scanfile + scanfile_archive (quét cả bảng). Không commit. Trả về số bucket."""
+    session.execute(text("DELETE FROM productivity_hourly"))
+    source = archive.all_rows(['id', 'jobno_type', 'userscan', 'time_scan'])
+    session.execute(text(f"INSERT INTO productivity_hourly (bucket, userscan, jobno_type, cartons) {rebuild_sql(_dialect(session), source)}"))
+    return session.execute(text("SELECT COUNT(*) FROM productivity_hourly")).scalar()
+
+
+# --- ĐỌC ---
+
+def parse_day(value):
+    return datetime.strptime(str(value).strip()[:10], '%Y-%m-%d').date()
+
+
+def period_of(bucket, granularity):
+    """Bucket giờ -> nhãn kỳ: giờ giữ nguyên, ngày 'YYYY-MM-DD', tuần = ngày thứ Hai đầu tuần."""
+    if granularity == 'hour':
+        return bucket
+    if granularity == 'day':
+        return bucket[:10]
+    day = parse_day(bucket)
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+
+def bucket_rows_sql(users=False, job_type=False):
+    where = ["bucket >= :start", "bucket < :end", "cartons != 0"]
+    if job_type:
+        where.append("jobno_type = :job_type")
+    if users:
+        where.append("userscan IN :users")
+    return f"SELECT bucket, userscan, jobno_type, cartons FROM productivity_hourly WHERE {' AND '.join(where)} ORDER BY bucket"
+
+
+def bucket_rows(session, start, end, users=None, job_type=None):
+    """Các bucket trong khoảng ngày [start, end] (cả hai đầu). Trả về list (bucket, userscan, jobno_type, cartons)."""
+    params = {
+        'start': f"{start.isoformat()} 00:00",
+        'end': f"{(end + timedelta(days=1)).isoformat()} 00:00",
+    }
+    if job_type:
+        params['job_type'] = job_type
+    if users:
+        params['users'] = list(users)
+    query = text(bucket_rows_sql(users=bool(users), job_type=bool(job_type)))
+    if users:
+        query = query.bindparams(bindparam('users', expanding=True))
+    return [tuple(row) for row in session.execute(query, params)]
+
+
+def series(session, start, end, granularity='day', users=None, job_type=None):
+    """Năng suất theo user: [{'username', 'total', 'points': [{'period', 'qty'}]}], sắp theo tổng giảm dần."""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity phải là một trong {', '.join(GRANULARITIES)}")
+    per_user = defaultdict(Counter)
+    for bucket, user, _, cartons in bucket_rows(session, start, end, users, job_type):
+        per_user[user][period_of(bucket, granularity)] += cartons
+    result = []
+    for user, periods in per_user.items():
+        points = [{'period': period, 'qty': qty} for period, qty in sorted(periods.items()) if qty]
+        result.append({'username': user, 'total': sum(periods.values()), 'points': points})
+    result.sort(key=lambda item: (-item['total'], item['username']))
+    return result
+
+
+def totals(session, start, end, job_type=None):
+    """Tổng số thùng theo user trong khoảng ngày: list (userscan, qty), giảm dần."""
+    per_user = Counter()
+    for _, user, _, cartons in bucket_rows(session, start, end, job_type=job_type):
+        per_user[user] += cartons
+    return sorted(((user, qty) for user, qty in per_user.items() if qty), key=lambda item: (-item[1], item[0]))
@@ -0,0 +1,232 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+try:
+    import redis
+except ImportError:  # Chỉ cần khi RESPONSE_CACHE_URL=redis://...
+    redis = None
+
+# Cache kết quả JSON của các API đọc nhiều (dữ liệu in tem, lịch sử, chi tiết SKU), dùng chung giữa các worker.
+# Khóa = endpoint + job_type (+ tham số) + phiên bản job (scan_counters.version, mọi luồng ghi đều tăng).
+# Dữ liệu đổi -> phiên bản mới -> khóa mới; bản cũ cùng phạm vi bị thay thế khi ghi, còn lại bị đẩy ra theo LRU.
+# Kho mặc định: file SQLite (WAL) trong instance/; hoặc Redis khi cấu hình URL redis://.
+# Lỗi kho cache không làm hỏng request: tính trực tiếp từ DB và đếm lỗi.
+# SQLite: lần hit chỉ đọc - số hit/miss đếm trong RAM rồi cộng vào file theo chu kỳ, thời điểm dùng (LRU)
+# chỉ ghi lại khi đã cũ hơn `touch_seconds`.
+
+
+class SqliteStore:
+    """Kho cache trong một file SQLite dùng chung giữa các worker trên cùng máy."""
+
+    def __init__(self, path, max_entries=2000, touch_seconds=60.0, counts_seconds=30.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_seconds = touch_seconds
+        self.counts_seconds = counts_seconds
+        self._local = threading.local()
+        self._counts = Counter()
+        self._counts_lock = threading.Lock()
+        self._counted_at = time.monotonic()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, scope TEXT NOT NULL, value TEXT NOT NULL, accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_entries_accessed ON entries (accessed);
+            CREATE INDEX IF NOT EXISTS ix_entries_scope ON entries (scope);
+            CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, n INTEGER NOT NULL);
+        """)
+
+    def _conn(self):
+        # Mỗi thread một kết nối (sqlite3 không chia sẻ kết nối giữa các thread)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name):
+        with self._counts_lock:
+            self._counts[name] += 1
+            due = time.monotonic() - self._counted_at >= self.counts_seconds
+        if due:
+            self.flush_counts()
+
+    def flush_counts(self):
+        """Cộng số hit/miss đếm trong RAM của worker này vào bảng counters (dùng chung)."""
+        with self._counts_lock:
+            counts, self._counts = self._counts, Counter()
+            self._counted_at = time.monotonic()
+        if not counts:
+            return
+        try:
+            with self._conn() as conn:
+                conn.executemany("INSERT INTO counters (name, n) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET n = n + excluded.n",
+                                 list(counts.items()))
+        except sqlite3.Error:
+            # File đang bận -> giữ lại, cộng ở lần sau
+            with self._counts_lock:
+                self._counts.update(counts)
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute("SELECT value, accessed FROM entries WHERE key = ?", (key,)).fetchone()
+        if row:
+            now = time.time()
+            if now - row[1] >= self.touch_seconds:
+                with conn:
+                    conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        self._count('hits' if row else 'misses')
+        return row[0] if row else None
+
+    def put(self, scope, key, value):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM entries WHERE scope = ? AND key != ?", (scope, key))
+            conn.execute("INSERT OR REPLACE INTO entries (key, scope, value, accessed) VALUES (?, ?, ?, ?)",
+                         (key, scope, value, time.time()))
+            extra = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+            if extra > 0:
+                conn.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed LIMIT ?)", (extra,))
+                conn.execute("INSERT INTO counters (name, n) VALUES ('evictions', ?) "
+                             "ON CONFLICT (name) DO UPDATE SET n = n + excluded.n", (extra,))
+
+    def stats(self):
+        self.flush_counts()
+        conn = self._conn()
+        result = {name: n for name, n in conn.execute("SELECT name, n FROM counters")}
+        result['entries'] = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return result
+
+    def clear(self):
+        with self._counts_lock:
+            self._counts.clear()
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM counters")
+
+
+class RedisStore:
+    """Kho cache trên Redis (hoặc server tương thích) cho nhiều máy chạy app."""
+
+    def __init__(self, url, max_entries=2000, prefix='scan:rc'):
+        if redis is None:
+            raise RuntimeError("Cần cài thư viện redis để dùng RESPONSE_CACHE_URL=redis://...")
+        self.client = redis.Redis.from_url(url)
+        self.max_entries = max_entries
+        self.prefix = prefix
+
+    def _k(self, name):
+        return f"{self.prefix}:{name}"
+
+    def get(self, key):
+        value = self.client.get(self._k(f"e:{key}"))
+        pipe = self.client.pipeline()
+        if value is not None:
+            pipe.zadd(self._k('lru'), {key: time.time()})
+        pipe.hincrby(self._k('counters'), 'hits' if value is not None else 'misses', 1)
+        pipe.execute()
+        return value.decode('utf-8') if value is not None else None
+
+    def put(self, scope, key, value):
+        old = self.client.hget(self._k('scopes'), scope)
+        pipe = self.client.pipeline()
+        if old is not None and old.decode('utf-8') != key:
+            pipe.delete(self._k(f"e:{old.decode('utf-8')}"))
+            pipe.zrem(self._k('lru'), old)
+        pipe.set(self._k(f"e:{key}"), value)
+        pipe.hset(self._k('scopes'), scope, key)
+        pipe.zadd(self._k('lru'), {key: time.time()})
+        pipe.execute()
+        extra = self.client.zcard(self._k('lru')) - self.max_entries
+        if extra > 0:
+            evicted = [member for member, _ in self.client.zpopmin(self._k('lru'), extra)]
+            if evicted:
+                self.client.delete(*[self._k(f"e:{member.decode('utf-8')}") for member in evicted])
+                self.client.hincrby(self._k('counters'), 'evictions', len(evicted))
+
+    def stats(self):
+        result = {name.decode('utf-8'): int(n) for name, n in self.client.hgetall(self._k('counters')).items()}
+        result['entries'] = self.client.zcard(self._k('lru'))
+        return result
+
+    def clear(self):
+        keys = [self._k(f"e:{member.decode('utf-8')}") for member in self.client.zrange(self._k('lru'), 0, -1)]
+        self.client.delete(*(keys + [self._k('lru'), self._k('scopes'), self._k('counters')]))
+
+
+def open_store(url, default_path, max_entries=2000):
+    """url: '' -> SQLite tại default_path, 'sqlite:///đường/dẫn' -> SQLite, 'redis://...' -> Redis, 'off' -> tắt."""
+    if url == 'off':
+        return None
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore(url, max_entries)
+    if url.startswith('sqlite:///'):
+        return SqliteStore(url[len('sqlite:///'):], max_entries)
+    return SqliteStore(url or default_path, max_entries)
+
+
+class ResponseCache:
+    """Lấy kết quả từ kho cache hoặc tính rồi lưu lại. Đếm hit/miss/lỗi của worker hiện tại."""
+
+    def __init__(self, store, log=print):
+        self.store = store
+        self.log = log
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def scope(endpoint, job_type, *parts):
+        return ':'.join(str(p) for p in (endpoint, job_type) + parts)
+
+    def get_or_compute(self, scope, version, compute):
+        """Trả về (payload, 'HIT' | 'MISS' | 'OFF'). version: phiên bản dữ liệu, đọc TRƯỚC khi tính."""
+        if self.store is None:
+            return compute(), 'OFF'
+        key = f"{scope}@{version}"
+        try:
+            cached = self.store.get(key)
+        except Exception as e:
+            self.errors += 1
+            self.log(f"Lỗi đọc cache {key}: {e}")
+            return compute(), 'OFF'
+        if cached is not None:
+            self.hits += 1
+            return json.loads(cached), 'HIT'
+        self.misses += 1
+        payload = compute()
+        try:
+            self.store.put(scope, key, json.dumps(payload, separators=(',', ':'), default=str))
+        except Exception as e:
+            self.errors += 1
+            self.log(f"Lỗi ghi cache {key}: {e}")
+        return payload, 'MISS'
+
+    def stats(self):
+        total = self.hits + self.misses
+        result = {
+            'backend': type(self.store).__name__ if self.store else 'off',
+            'worker': {'pid': os.getpid(), 'hits': self.hits, 'misses': self.misses, 'errors': self.errors,
+                       'hit_rate': round(self.hits / total, 3) if total else 0.0},
+        }
+        if self.store is not None:
+            shared = self.store.stats()
+            shared_total = shared.get('hits', 0) + shared.get('misses', 0)
+            shared['hit_rate'] = round(shared.get('hits', 0) / shared_total, 3) if shared_total else 0.0
+            result['shared'] = shared
+        return result
+
+    def clear(self):
+        if self.store is not None:
+            self.store.clear()
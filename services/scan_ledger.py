@@ -0,0 +1,68 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, text
+
+# Sổ chống trùng scan (bảng scan_ledger): máy scan gửi kèm scan_id tự sinh cho mỗi lần quét.
+# Lần quét gán được thùng ghi 1 dòng (scan_id -> kết quả đã trả) trong cùng transaction với việc gán,
+# nên request gửi lại sau khi mất mạng (server đã commit nhưng máy không nhận được phản hồi) chỉ đọc lại
+# kết quả cũ, không chạm scanfile. Lần quét lỗi (không có thùng chờ...) không ghi - gửi lại thì xử lý lại.
+# Dòng quá `ttl` giây bị xóa định kỳ (mỗi worker tối đa 1 lần/`purge_interval` giây).
+
+MAX_SCAN_ID = 64
+
+
+def valid_scan_id(scan_id):
+    return isinstance(scan_id, str) and 0 < len(scan_id) <= MAX_SCAN_ID
+
+
+def lookup(session, scan_ids):
+    """{scan_id: (userscan, kết quả)} của các scan_id đã ghi."""
+    if not scan_ids:
+        return {}
+    query = text("SELECT scan_id, userscan, result FROM scan_ledger WHERE scan_id IN :ids")
+    rows = session.execute(query.bindparams(bindparam('ids', expanding=True)), {'ids': list(scan_ids)})
+    return {row[0]: (row[1], json.loads(row[2])) for row in rows}
+
+
+def record(session, entries, job_type, userscan):
+    """Ghi [(scan_id, kết quả)] - không commit, caller commit cùng lần gán thùng.
+
+    scan_id đã có (request trùng chạy song song) -> lỗi IntegrityError khi ghi/commit, caller rollback
+    rồi đọc lại kết quả của request thắng.
+    """
+    if not entries:
+        return
+    now = datetime.now()
+    session.execute(
+        text("INSERT INTO scan_ledger (scan_id, jobno_type, userscan, result, created_at) VALUES (:scan_id, :job_type, :user, :result, :t)"),
+        [{'scan_id': scan_id, 'job_type': job_type, 'user': userscan, 't': now,
+          'result': json.dumps(result, ensure_ascii=False, separators=(',', ':'))}
+         for scan_id, result in entries]
+    )
+
+
+def purge(session, ttl):
+    """Xóa dòng cũ hơn `ttl` giây. Trả về số dòng đã xóa. Không commit."""
+    cutoff = datetime.now() - timedelta(seconds=ttl)
+    return session.execute(text("DELETE FROM scan_ledger WHERE created_at < :cutoff"), {'cutoff': cutoff}).rowcount
+
+
+class ScanLedger:
+    """Thời hạn giữ sổ + dọn định kỳ cho một worker."""
+
+    def __init__(self, ttl=86400, purge_interval=600):
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.replays = 0
+        self._purged_at = time.monotonic()
+
+    def purge_due(self):
+        if time.monotonic() - self._purged_at < self.purge_interval:
+            return False
+        self._purged_at = time.monotonic()
+        return True
+
+    def purge(self, session):
+        return purge(session, self.ttl)
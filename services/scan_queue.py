@@ -0,0 +1,497 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from services import scan_ledger, scanned_barcodes
+from services.claims import claim_cartons
+from services.scanned_barcodes import duplicate_message
+
+# Ghi scan qua hàng đợi (SCAN_WRITE_BEHIND=1): /api/scan kiểm tra mã với tồn chờ lưu cục bộ, ghi lần quét vào
+# file SQLite WAL trên máy chủ (dùng chung giữa các worker) rồi trả lời ngay; một luồng nền gom các lần quét
+# và gán thùng vào DB chính theo lô (một transaction mỗi `flush_ms`), thay vì mỗi thùng một lần commit qua mạng.
+#
+#   scan_queue        - lần quét đã nhận: pending (chờ ghi) -> done / rejected (không còn thùng khi ghi).
+#                       Dòng done giữ `keep_seconds` để trả lại kết quả khi máy quét gửi lại cùng scan_id.
+#   availability      - số thùng chờ theo (job, SKU) = DB chính - lần quét pending, nạp lại sau `refresh_seconds`
+#                       hoặc khi hết (thùng được gỡ/nạp thêm ở nơi khác). Trừ tồn + ghi hàng đợi cùng 1 transaction
+#                       SQLite nên các worker không nhận quá số thùng đang chờ.
+#
+# Chỉ một worker ghi vào DB chính tại một thời điểm (khóa file `<queue>.lock`); worker đó chết thì worker khác nhận
+# khóa và ghi tiếp các dòng pending. Mỗi lần quét được ghi vào scan_ledger cùng transaction với việc gán thùng,
+# nên dòng đã ghi nhưng chưa kịp đánh dấu done (crash giữa chừng) không bị gán lần hai.
+# Mã vạch của lần quét pending/done được giữ trong hàng đợi: quét lại cùng mã trước khi kịp ghi vẫn bị báo trùng.
+# Hàng đợi đầy (`max_depth` dòng pending) -> từ chối (HTTP 503), máy quét gửi lại cùng scan_id.
+
+PENDING, DONE, REJECTED = 'pending', 'done', 'rejected'
+
+BUSY_MESSAGE = 'Server đang bận (hàng đợi scan đầy), đang gửi lại...'
+
+QueuedScan = namedtuple('QueuedScan', ['id', 'scan_id', 'job_type', 'sku', 'pallet_no', 'pallet_type', 'userscan', 'time_scan',
+                                       'barcode'])
+
+
+def not_waiting_message(sku, job_type):
+    return f'Lỗi: Không tìm thấy dữ liệu chờ cho SKU {sku} (Job: {job_type})'
+
+
+class ScanQueue:
+    """File SQLite chứa hàng đợi scan và tồn chờ theo (job, SKU) của máy chủ này."""
+
+    def __init__(self, path, max_depth=5000, refresh_seconds=5.0, keep_seconds=86400, max_rejected=1000):
+        self.path = path
+        self.max_depth = max_depth
+        self.refresh_seconds = refresh_seconds
+        self.keep_seconds = keep_seconds
+        self.max_rejected = max_rejected
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS scan_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, scan_id TEXT NOT NULL UNIQUE, state TEXT NOT NULL,
+                job_type TEXT NOT NULL, sku TEXT NOT NULL, pallet_no TEXT NOT NULL, pallet_type TEXT NOT NULL,
+                userscan TEXT, time_scan TEXT NOT NULL, result TEXT NOT NULL, created_at REAL NOT NULL, finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS ix_scan_queue_state ON scan_queue (state, id);
+            CREATE TABLE IF NOT EXISTS availability (
+                job_type TEXT NOT NULL, sku TEXT NOT NULL, remaining INTEGER NOT NULL, PRIMARY KEY (job_type, sku)
+            );
+            CREATE TABLE IF NOT EXISTS availability_jobs (job_type TEXT PRIMARY KEY, loaded_at REAL NOT NULL);
+        """)
+        # File hàng đợi tạo từ bản trước chưa có cột barcode
+        if 'barcode' not in [row[1] for row in conn.execute("PRAGMA table_info(scan_queue)")]:
+            conn.execute("ALTER TABLE scan_queue ADD COLUMN barcode TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_scan_queue_barcode ON scan_queue (job_type, barcode)")
+
+    def _conn(self):
+        # Mỗi thread một kết nối (đường scan nóng không mở file mỗi request); transaction tự quản lý
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # fsync WAL mỗi commit: lần quét đã trả OK còn nguyên khi mất điện/crash
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # --- NHẬN SCAN (request) ---
+
+    def _stored(self, conn, scan_ids):
+        query = f"SELECT scan_id, userscan, result FROM scan_queue WHERE scan_id IN ({', '.join('?' * len(scan_ids))})"
+        return {row[0]: (row[1], json.loads(row[2])) for row in conn.execute(query, scan_ids)}
+
+    @staticmethod
+    def _replay(found, userscan):
+        user, result = found
+        if user != userscan:
+            return {'success': False, 'message': 'Lỗi: scan_id đã được dùng bởi tài khoản khác'}
+        return dict(result, replayed=True)
+
+    def _stale_jobs(self, conn, job_types, now):
+        loaded = dict(conn.execute(
+            f"SELECT job_type, loaded_at FROM availability_jobs WHERE job_type IN ({', '.join('?' * len(job_types))})",
+            list(job_types)
+        ))
+        return [job for job in job_types if now - loaded.get(job, 0) >= self.refresh_seconds]
+
+    def _reload_job(self, conn, job_type, waiting, now):
+        pending = dict(conn.execute(
+            "SELECT sku, COUNT(*) FROM scan_queue WHERE state = ? AND job_type = ? GROUP BY sku", (PENDING, job_type)
+        ))
+        conn.execute("DELETE FROM availability WHERE job_type = ?", (job_type,))
+        conn.executemany("INSERT INTO availability (job_type, sku, remaining) VALUES (?, ?, ?)",
+                         [(job_type, sku, max(0, n - pending.get(sku, 0))) for sku, n in waiting.items()])
+        conn.execute("INSERT OR REPLACE INTO availability_jobs (job_type, loaded_at) VALUES (?, ?)", (job_type, now))
+
+    def _queued_barcode(self, conn, job_type, barcode):
+        """Pallet của lần quét pending/done cùng mã trong job (chưa được gỡ), None nếu chưa có."""
+        row = conn.execute(
+            "SELECT pallet_no FROM scan_queue WHERE job_type = ? AND barcode = ? AND state IN (?, ?) LIMIT 1",
+            (job_type, barcode, PENDING, DONE)
+        ).fetchone()
+        return row[0] if row else None
+
+    def accept(self, items, load_waiting, find_scanned=None):
+        """Nhận các lần quét vào hàng đợi. Trả về list kết quả cùng thứ tự với `items`.
+
+        items: list dict(scan_id, job_type, sku, pallet_no, pallet_type, userscan, time_scan[, barcode]);
+        load_waiting(job_type) -> {sku: số thùng chờ trong DB chính}, gọi ngoài transaction SQLite
+        khi tồn của job đã cũ hoặc vừa hết.
+        find_scanned(job_type, barcodes) -> {barcode: pallet} mã đã scan trong DB chính (gọi sau khi loại
+        lần quét gửi lại, ngoài transaction SQLite).
+        """
+        results = [None] * len(items)
+        conn = self._conn()
+        known = self._stored(conn, [item['scan_id'] for item in items])
+        todo = []
+        for i, item in enumerate(items):
+            found = known.get(item['scan_id'])
+            if found:
+                results[i] = self._replay(found, item['userscan'])
+            else:
+                todo.append(i)
+
+        if find_scanned is not None and todo:
+            by_job = {}
+            for i in todo:
+                if items[i].get('barcode'):
+                    by_job.setdefault(items[i]['job_type'], []).append(items[i]['barcode'])
+            scanned = {job: find_scanned(job, barcodes) for job, barcodes in by_job.items()}
+            fresh = []
+            for i in todo:
+                pallet = scanned.get(items[i]['job_type'], {}).get(items[i].get('barcode'))
+                if pallet is not None:
+                    results[i] = {'success': False, 'duplicate': True, 'message': duplicate_message(items[i]['barcode'], pallet)}
+                else:
+                    fresh.append(i)
+            todo = fresh
+
+        reloaded = set()
+        for attempt in range(2):
+            if not todo:
+                break
+            now = time.time()
+            job_types = {items[i]['job_type'] for i in todo}
+            # Lượt 2: chỉ các job vừa hết tồn (có thể đã có thùng được gỡ/nạp thêm) -> đọc lại DB chính
+            stale = self._stale_jobs(conn, job_types, now) if attempt == 0 else [job for job in job_types if job not in reloaded]
+            waiting = {job: load_waiting(job) for job in stale}
+            retry = []
+            with self._transaction() as conn:
+                for job_type, skus in waiting.items():
+                    self._reload_job(conn, job_type, skus, now)
+                    reloaded.add(job_type)
+                depth = conn.execute("SELECT COUNT(*) FROM scan_queue WHERE state = ?", (PENDING,)).fetchone()[0]
+                for i in todo:
+                    item = items[i]
+                    if depth >= self.max_depth:
+                        results[i] = {'success': False, 'busy': True, 'message': BUSY_MESSAGE}
+                        continue
+                    barcode = item.get('barcode')
+                    if barcode:
+                        pallet = self._queued_barcode(conn, item['job_type'], barcode)
+                        if pallet is not None:
+                            results[i] = {'success': False, 'duplicate': True, 'message': duplicate_message(barcode, pallet)}
+                            continue
+                    taken = conn.execute(
+                        "UPDATE availability SET remaining = remaining - 1 WHERE job_type = ? AND sku = ? AND remaining > 0",
+                        (item['job_type'], item['sku'])
+                    ).rowcount
+                    if not taken:
+                        if item['job_type'] not in reloaded:
+                            retry.append(i)
+                        else:
+                            results[i] = {'success': False, 'message': not_waiting_message(item['sku'], item['job_type'])}
+                        continue
+                    result = {'success': True, 'sku': item['sku'], 'message': 'OK', 'queued': True}
+                    inserted = conn.execute("""
+                        INSERT OR IGNORE INTO scan_queue (scan_id, state, job_type, sku, pallet_no, pallet_type, userscan,
+                                                          time_scan, result, created_at, barcode)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, (item['scan_id'], PENDING, item['job_type'], item['sku'], str(item['pallet_no']),
+                          str(item['pallet_type']), item['userscan'], item['time_scan'].isoformat(),
+                          json.dumps(result, ensure_ascii=False), now, barcode)).rowcount
+                    if not inserted:
+                        # Cùng scan_id vừa được worker khác nhận -> hoàn tồn, trả kết quả đã lưu
+                        conn.execute("UPDATE availability SET remaining = remaining + 1 WHERE job_type = ? AND sku = ?",
+                                     (item['job_type'], item['sku']))
+                        results[i] = self._replay(self._stored(conn, [item['scan_id']])[item['scan_id']], item['userscan'])
+                        continue
+                    depth += 1
+                    results[i] = result
+            todo = retry
+        return results
+
+    # --- GHI VÀO DB CHÍNH (luồng nền) ---
+
+    def pending(self, limit):
+        rows = self._conn().execute("""
+            SELECT id, scan_id, job_type, sku, pallet_no, pallet_type, userscan, time_scan, barcode
+            FROM scan_queue WHERE state = ? ORDER BY id LIMIT ?
+        """, (PENDING, limit))
+        return [QueuedScan(*row) for row in rows]
+
+    def finish(self, done, rejected):
+        """done: [id] đã gán; rejected: {id: (job_type, thông báo)} không gán được -> nạp lại tồn của job."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany("UPDATE scan_queue SET state = ?, finished_at = ? WHERE id = ?",
+                             [(DONE, now, row_id) for row_id in done])
+            for row_id, (job_type, message) in rejected.items():
+                conn.execute("UPDATE scan_queue SET state = ?, result = ?, finished_at = ? WHERE id = ?",
+                             (REJECTED, json.dumps({'success': False, 'message': message}, ensure_ascii=False), now, row_id))
+                conn.execute("DELETE FROM availability_jobs WHERE job_type = ?", (job_type,))
+
+    def forget_barcodes(self, job_type, barcodes):
+        """Thùng đã được gỡ khỏi pallet (delete_scan) -> cho phép quét lại các mã này."""
+        if not barcodes:
+            return
+        with self._transaction() as conn:
+            conn.executemany("UPDATE scan_queue SET barcode = NULL WHERE job_type = ? AND barcode = ? AND state = ?",
+                             [(job_type, barcode, DONE) for barcode in barcodes])
+
+    def trim(self):
+        """Xóa dòng done quá hạn giữ và dòng rejected cũ (giữ `max_rejected` dòng mới nhất)."""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM scan_queue WHERE state = ? AND finished_at < ?", (DONE, time.time() - self.keep_seconds))
+            conn.execute("""
+                DELETE FROM scan_queue WHERE state = ? AND id NOT IN (
+                    SELECT id FROM scan_queue WHERE state = ? ORDER BY id DESC LIMIT ?)
+            """, (REJECTED, REJECTED, self.max_rejected))
+
+    def depth(self):
+        """(số dòng pending, tuổi dòng pending cũ nhất - giây)."""
+        row = self._conn().execute("SELECT COUNT(*), MIN(created_at) FROM scan_queue WHERE state = ?", (PENDING,)).fetchone()
+        return row[0], round(time.time() - row[1], 3) if row[1] else 0.0
+
+    def stats(self, limit=20):
+        conn = self._conn()
+        depth, oldest = self.depth()
+        counts = dict(conn.execute("SELECT state, COUNT(*) FROM scan_queue GROUP BY state"))
+        rejected = [
+            {'scan_id': row[0], 'job_type': row[1], 'sku': row[2], 'pallet_no': row[3], 'userscan': row[4],
+             'time_scan': row[5], 'message': json.loads(row[6]).get('message')}
+            for row in conn.execute("""
+                SELECT scan_id, job_type, sku, pallet_no, userscan, time_scan, result FROM scan_queue
+                WHERE state = ? ORDER BY id DESC LIMIT ?
+            """, (REJECTED, limit))
+        ]
+        return {'depth': depth, 'oldest_seconds': oldest, 'max_depth': self.max_depth,
+                'done': counts.get(DONE, 0), 'rejected': counts.get(REJECTED, 0), 'recent_rejected': rejected}
+
+
+class ScanWriter:
+    """Luồng nền gom scan pending và gán thùng vào DB chính theo lô (chỉ worker giữ khóa file mới ghi)."""
+
+    IDLE_SECONDS = 0.05
+    GAUGE_SECONDS = 1.0
+    TRIM_SECONDS = 60.0
+
+    def __init__(self, queue, session_scope, apply, flush_ms=5, batch_size=200, lock_path=None, registry=None, log=print):
+        """session_scope(): context manager trả về session DB chính; apply(job_type, pallet_no, claimed): cập nhật
+        bộ đếm/thống kê trong cùng transaction (như sau mỗi lần gán thùng ở API)."""
+        self.queue = queue
+        self.session_scope = session_scope
+        self.apply = apply
+        self.flush_ms = flush_ms
+        self.batch_size = batch_size
+        self.lock_path = lock_path or f"{queue.path}.lock"
+        self.registry = registry
+        self.log = log
+        self.leader = False
+        self.flushed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.last_error = None
+        self._isolate_until = 0
+        self._lock_file = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='scan-writer', daemon=True)
+                self._thread.start()
+
+    def notify(self):
+        """Gọi sau khi worker này nhận scan -> ghi ngay, không chờ chu kỳ rảnh."""
+        self._wake.set()
+
+    def _acquire(self, blocking=True):
+        try:
+            import fcntl
+        except ImportError:
+            # Windows (chạy local 1 process): không có khóa file, worker tự ghi
+            return True
+        lock_file = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _metric(self, kind, name, value=1):
+        if self.registry is not None:
+            getattr(self.registry, kind)(name, {}, value)
+
+    def _gauges(self):
+        depth, oldest = self.queue.depth()
+        self._metric('set', 'scan_queue_depth', depth)
+        self._metric('set', 'scan_queue_oldest_seconds', oldest)
+
+    def flush(self, entries):
+        """Gán thùng cho các lần quét trong một transaction DB chính rồi đánh dấu trong hàng đợi."""
+        started = time.perf_counter()
+        done, rejected = [], {}
+        with self.session_scope() as session:
+            try:
+                # Đã ghi ở lần trước (crash sau commit, trước khi đánh dấu done) -> không gán lại
+                applied = scan_ledger.lookup(session, [entry.scan_id for entry in entries])
+                # Mã đã có trong sổ (worker khác gán khi chưa bật hàng đợi, hoặc quét ở máy chủ khác) -> báo trùng
+                by_job = {}
+                for entry in entries:
+                    if entry.barcode and entry.scan_id not in applied:
+                        by_job.setdefault(entry.job_type, []).append(entry.barcode)
+                scanned = {job: scanned_barcodes.find(session, job, barcodes) for job, barcodes in by_job.items()}
+                groups = {}
+                for entry in entries:
+                    if entry.scan_id in applied:
+                        done.append(entry.id)
+                        continue
+                    pallet = scanned.get(entry.job_type, {}).get(entry.barcode)
+                    if pallet is not None:
+                        rejected[entry.id] = (entry.job_type, duplicate_message(entry.barcode, pallet))
+                        continue
+                    key = (entry.job_type, entry.sku, entry.pallet_no, entry.pallet_type, entry.userscan, entry.time_scan)
+                    groups.setdefault(key, []).append(entry)
+                for (job_type, sku, pallet_no, pallet_type, userscan, time_scan), group in groups.items():
+                    claimed = claim_cartons(session, job_type, sku, len(group), pallet_no, pallet_type,
+                                            userscan=userscan, time_scan=datetime.fromisoformat(time_scan))
+                    self.apply(job_type, pallet_no, claimed)
+                    accepted = group[:len(claimed)]
+                    scan_ledger.record(session, [(entry.scan_id, {'success': True, 'sku': sku, 'message': 'OK'})
+                                                 for entry in accepted], job_type, userscan)
+                    scanned_barcodes.record(session, job_type, [
+                        (entry.barcode, sku, pallet_no, userscan, datetime.fromisoformat(time_scan))
+                        for entry in accepted if entry.barcode
+                    ])
+                    done.extend(entry.id for entry in accepted)
+                    for entry in group[len(claimed):]:
+                        rejected[entry.id] = (job_type, not_waiting_message(sku, job_type))
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+        self.queue.finish(done, rejected)
+        self.flushed += len(done)
+        self.rejected += len(rejected)
+        self._metric('inc', 'scan_queue_flushed_total', len(done))
+        if rejected:
+            self._metric('inc', 'scan_queue_rejected_total', len(rejected))
+            self.log(f"Hàng đợi scan: {len(rejected)} lần quét không còn thùng chờ khi ghi")
+        self._metric('observe', 'scan_queue_flush_size', len(entries))
+        self._metric('observe', 'scan_queue_flush_seconds', time.perf_counter() - started)
+        return len(done)
+
+    def _applied(self, entry):
+        with self.session_scope() as session:
+            return entry.scan_id in scan_ledger.lookup(session, [entry.scan_id])
+
+    def step(self):
+        """Ghi một lô. Trả về số dòng đã xử lý (0 = hàng đợi trống); lỗi kết nối -> raise để caller chờ rồi thử lại."""
+        entries = self.queue.pending(self.batch_size)
+        if not entries:
+            return 0
+        if self._isolate_until >= entries[0].id:
+            # Lô trước lỗi dữ liệu -> ghi từng dòng để tìm và loại dòng lỗi
+            entries = entries[:1]
+        else:
+            self._isolate_until = 0
+        try:
+            self.flush(entries)
+        except OperationalError:
+            # Mất kết nối/DB bận: giữ nguyên, lần sau thử lại
+            raise
+        except Exception as e:
+            # Lỗi dữ liệu, kể cả IntegrityError từ scan_ledger/scanned_barcodes: thử lại cả lô sẽ lỗi mãi
+            self.errors += 1
+            self.last_error = str(e)
+            self._metric('inc', 'scan_queue_flush_errors_total')
+            if len(entries) > 1:
+                self._isolate_until = entries[-1].id
+            elif isinstance(e, IntegrityError) and self._applied(entries[0]):
+                # Worker khác (không có khóa file) vừa ghi cùng scan_id -> đã gán, không phải dòng lỗi
+                self.queue.finish([entries[0].id], {})
+            else:
+                entry = entries[0]
+                self.queue.finish([], {entry.id: (entry.job_type, f'Lỗi ghi scan: {e}')})
+                self.rejected += 1
+                self._metric('inc', 'scan_queue_rejected_total')
+                self.log(f"Hàng đợi scan: bỏ scan {entry.scan_id}: {e}")
+        return len(entries)
+
+    def _run(self):
+        # Chờ tới khi giữ khóa (worker đang ghi chết -> worker này tiếp quản các dòng pending còn lại)
+        self._acquire(blocking=True)
+        self.leader = True
+        self.log(f"Worker {os.getpid()} ghi hàng đợi scan vào DB chính")
+        failures = 0
+        gauges_at = trimmed_at = 0.0
+        while True:
+            now = time.monotonic()
+            if now - gauges_at >= self.GAUGE_SECONDS:
+                gauges_at = now
+                try:
+                    self._gauges()
+                except Exception as e:
+                    self.log(f"Lỗi đọc hàng đợi scan: {e}")
+            try:
+                if now - trimmed_at >= self.TRIM_SECONDS:
+                    trimmed_at = now
+                    self.queue.trim()
+                processed = self.step()
+                failures = 0
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                self._metric('inc', 'scan_queue_flush_errors_total')
+                failures += 1
+                time.sleep(min(5.0, 0.1 * 2 ** failures))
+                continue
+            if processed:
+                # Nghỉ flush_ms để các lần quét tới sau gom vào lô kế tiếp (group commit)
+                time.sleep(self.flush_ms / 1000)
+            else:
+                self._wake.wait(self.IDLE_SECONDS)
+                self._wake.clear()
+
+    def drain(self, timeout=60):
+        """Ghi hết hàng đợi (CLI, khi server đã dừng). None nếu worker khác đang giữ khóa ghi."""
+        if not self._acquire(blocking=False):
+            return None
+        total = 0
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            processed = self.step()
+            if not processed:
+                break
+            total += processed
+        return total
+
+    def wait_drained(self, timeout=30):
+        """Chờ hàng đợi trống (kiểm tra tải đọc kết quả sau khi mọi lần quét đã ghi)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.queue.depth()[0] == 0:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def stats(self):
+        return {'leader': self.leader, 'flushed': self.flushed, 'rejected': self.rejected, 'errors': self.errors,
+                'last_error': self.last_error, 'flush_ms': self.flush_ms, 'batch_size': self.batch_size}
@@ -0,0 +1,151 @@
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import bindparam, text
+
+# Sổ mã vạch đã scan theo job (bảng scanned_barcodes, khóa chính (jobno_type, barcode)): một thùng vật lý
+# chỉ được gán một lần. Mỗi worker giữ một Bloom filter cho các job đang scan (nạp lại từ bảng khi gặp job lần đầu
+# sau khi khởi động): mã chưa từng thấy -> đi thẳng; mã "có thể đã scan" -> xác nhận bằng 1 lần đọc theo khóa chính
+# (mã đã bị gỡ khỏi pallet hoặc trùng giả của filter thì cho qua). Dòng sổ được ghi trong cùng transaction với việc
+# gán thùng, nên hai worker cùng nhận một mã thì request sau lỗi khóa chính và bị báo trùng.
+# Gỡ thùng khỏi pallet (delete_scan) xóa các mã scan gần nhất của pallet + SKU đó để thùng được scan lại.
+
+ERROR_RATE = 0.01
+MIN_CAPACITY = 10000
+# Độ dài cột barcode
+MAX_BARCODE = 100
+
+
+def duplicate_message(barcode, pallet):
+    return f'Lỗi: Mã vạch {barcode} đã được scan (duplicate) - Pallet {pallet}'
+
+
+def find(session, job_type, barcodes):
+    """{barcode: pallet} của các mã đã có trong sổ của job."""
+    if not barcodes:
+        return {}
+    query = text("SELECT barcode, pallet FROM scanned_barcodes WHERE jobno_type = :job_type AND barcode IN :barcodes")
+    rows = session.execute(query.bindparams(bindparam('barcodes', expanding=True)),
+                           {'job_type': job_type, 'barcodes': list(barcodes)})
+    return {row[0]: row[1] for row in rows}
+
+
+def record(session, job_type, rows):
+    """Ghi [(barcode, sku, pallet, userscan, scanned_at)]. Không commit; mã đã có -> IntegrityError."""
+    if not rows:
+        return
+    session.execute(
+        text("""
+            INSERT INTO scanned_barcodes (jobno_type, barcode, sku, pallet, userscan, scanned_at)
+            VALUES (:job_type, :barcode, :sku, :pallet, :userscan, :scanned_at)
+        """),
+        [{'job_type': job_type, 'barcode': barcode, 'sku': sku, 'pallet': str(pallet), 'userscan': userscan,
+          'scanned_at': scanned_at} for barcode, sku, pallet, userscan, scanned_at in rows]
+    )
+
+
+def release(session, job_type, pallet, sku, qty):
+    """Xóa `qty` mã scan gần nhất của pallet + SKU (thùng bị gỡ). Trả về danh sách mã đã xóa. Không commit."""
+    if not qty:
+        return []
+    params = {'job_type': job_type, 'pallet': str(pallet), 'sku': sku, 'limit': int(qty)}
+    barcodes = [row[0] for row in session.execute(text("""
+        SELECT barcode FROM scanned_barcodes WHERE jobno_type = :job_type AND pallet = :pallet AND sku = :sku
+        ORDER BY scanned_at DESC LIMIT :limit
+    """), params)]
+    if barcodes:
+        query = text("DELETE FROM scanned_barcodes WHERE jobno_type = :job_type AND barcode IN :barcodes")
+        session.execute(query.bindparams(bindparam('barcodes', expanding=True)), {'job_type': job_type, 'barcodes': barcodes})
+    return barcodes
+
+
+class BloomFilter:
+    """Tập xấp xỉ: không bao giờ báo thiếu mã đã thêm, báo nhầm "có" với xác suất ~error_rate."""
+
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class BarcodeFilters:
+    """Bloom filter theo job trong một worker (tối đa `max_jobs` job dùng gần nhất)."""
+
+    def __init__(self, max_jobs=20, error_rate=ERROR_RATE):
+        self.max_jobs = max_jobs
+        self.error_rate = error_rate
+        self.loads = 0
+        self.confirms = 0
+        self._filters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, session, job_type):
+        barcodes = [row[0] for row in session.execute(
+            text("SELECT barcode FROM scanned_barcodes WHERE jobno_type = :job_type"), {'job_type': job_type})]
+        # Dư gấp đôi để job đang scan tiếp không phải nạp lại sớm
+        bloom = BloomFilter(max(MIN_CAPACITY, 2 * len(barcodes)), self.error_rate)
+        for barcode in barcodes:
+            bloom.add(barcode)
+        self.loads += 1
+        return bloom
+
+    def _get(self, session, job_type):
+        with self._lock:
+            bloom = self._filters.get(job_type)
+            if bloom is not None and bloom.count <= bloom.capacity:
+                self._filters.move_to_end(job_type)
+                return bloom
+        # Chưa có hoặc đã đầy (tỉ lệ báo nhầm tăng) -> nạp lại từ sổ với dung lượng lớn hơn
+        bloom = self._load(session, job_type)
+        with self._lock:
+            self._filters[job_type] = bloom
+            self._filters.move_to_end(job_type)
+            while len(self._filters) > self.max_jobs:
+                self._filters.popitem(last=False)
+        return bloom
+
+    def scanned(self, session, job_type, barcodes):
+        """{barcode: pallet} của các mã đã scan: lọc bằng Bloom filter, chỉ mã "có thể đã scan" mới đọc DB."""
+        bloom = self._get(session, job_type)
+        maybe = [barcode for barcode in barcodes if barcode in bloom]
+        if not maybe:
+            return {}
+        self.confirms += len(maybe)
+        return find(session, job_type, maybe)
+
+    def add(self, job_type, barcodes):
+        """Thêm mã vừa scan (sau commit). Job chưa nạp thì bỏ qua - lần dùng đầu sẽ nạp từ sổ."""
+        with self._lock:
+            bloom = self._filters.get(job_type)
+            if bloom is not None:
+                for barcode in barcodes:
+                    bloom.add(barcode)
+
+    def forget(self, job_type):
+        with self._lock:
+            self._filters.pop(job_type, None)
+
+    def stats(self):
+        with self._lock:
+            jobs = {job: {'barcodes': bloom.count, 'capacity': bloom.capacity, 'bytes': len(bloom.bits)}
+                    for job, bloom in self._filters.items()}
+        return {'jobs': jobs, 'loads': self.loads, 'confirms': self.confirms}
+
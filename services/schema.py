@@ -0,0 +1,431 @@
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from services import claims, counters, productivity, stats
+
+# Kiểu dữ liệu theo từng loại DB cho các cột thêm bằng migration
+COLUMN_TYPES = {
+    'timestamp': {'mysql': 'DATETIME(6) NULL', 'postgresql': 'TIMESTAMP NULL', 'sqlite': 'TIMESTAMP'},
+    'real': {'mysql': 'DOUBLE NULL', 'postgresql': 'DOUBLE PRECISION NULL', 'sqlite': 'REAL'},
+    'integer': {'mysql': 'INT NULL', 'postgresql': 'INTEGER NULL', 'sqlite': 'INTEGER'},
+    'text': {'mysql': 'VARCHAR(255) NULL', 'postgresql': 'VARCHAR(255) NULL', 'sqlite': 'TEXT'},
+    'counter': {'mysql': 'INT NOT NULL DEFAULT 0', 'postgresql': 'INTEGER NOT NULL DEFAULT 0', 'sqlite': 'INTEGER NOT NULL DEFAULT 0'},
+}
+
+
+def _dialect(conn):
+    return conn.engine.dialect.name
+
+
+def _add_column(conn, table, column, kind):
+    if column in {c['name'] for c in inspect(conn).get_columns(table)}:
+        return False
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {COLUMN_TYPES[kind][_dialect(conn)]}"))
+    return True
+
+
+def _create_index(conn, name, table, columns, unique=False):
+    # MySQL không hỗ trợ CREATE INDEX IF NOT EXISTS -> kiểm tra qua inspector cho mọi DB
+    if name in {ix['name'] for ix in inspect(conn).get_indexes(table)}:
+        return False
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+    conn.execute(text(f"CREATE {kind} {name} ON {table} ({', '.join(columns)})"))
+    return True
+
+
+# --- DANH SÁCH MIGRATION (chỉ thêm mới ở cuối, không sửa migration đã chạy) ---
+# SQL viết cố định trong migration, không gọi hàm của services: code đổi sau này không làm đổi migration cũ.
+
+def _m001_masterdata_watermark(conn):
+    # Watermark cho chỉ mục masterdata trong RAM
+    _add_column(conn, 'masterdata', 'updated_at', 'timestamp')
+    for column in ('length', 'width', 'height', 'cbm'):
+        _add_column(conn, 'masterdata', column, 'real')
+    _add_column(conn, 'masterdata', 'cartonperpallet', 'integer')
+
+
+def _m002_scanfile_hot_indexes(conn):
+    # process_scan/check_barcode/bulk_update/sku_details/get_remain_skus: lọc theo job + sku, rồi pallet
+    _create_index(conn, 'ix_scanfile_job_sku_pallet', 'scanfile', ['jobno_type', 'sku', 'pallet'])
+    # job_stats/get_history/pallet_details/get_sscc_data/finish_pallet: lọc theo job + pallet
+    _create_index(conn, 'ix_scanfile_job_pallet_sku', 'scanfile', ['jobno_type', 'pallet', 'sku'])
+
+
+def _m003_masterdata_refix_index(conn):
+    # Tra cứu dự phòng khi chỉ mục RAM chưa nạp + JOIN masterdata theo sku khi in tem
+    _create_index(conn, 'ix_masterdata_refix', 'masterdata', ['refix'])
+    _create_index(conn, 'ix_masterdata_sku', 'masterdata', ['sku'])
+
+
+def _m004_logs_unread_index(conn):
+    _create_index(conn, 'ix_logs_is_read', 'logs', ['is_read'])
+
+
+def _m005_scan_counters(conn):
+    # Bộ đếm job/pallet/SKU cập nhật cùng transaction với mỗi lần scan (services/counters.py)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS scan_counters (
+            jobno_type VARCHAR(255) NOT NULL,
+            pallet VARCHAR(50) NOT NULL DEFAULT '',
+            sku VARCHAR(255) NOT NULL DEFAULT '',
+            total INTEGER NOT NULL DEFAULT 0,
+            scanned INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (jobno_type, pallet, sku)
+        )
+    """))
+
+
+def _m006_job_version(conn):
+    # Phiên bản dữ liệu theo job (dòng job trong scan_counters) cho ETag của /api/job_snapshot
+    _add_column(conn, 'scan_counters', 'version', 'counter')
+
+
+AUTO_ID = {
+    'mysql': 'INT AUTO_INCREMENT PRIMARY KEY',
+    'postgresql': 'SERIAL PRIMARY KEY',
+    'sqlite': 'INTEGER PRIMARY KEY AUTOINCREMENT',
+}
+
+
+def _m007_events(conn):
+    # Outbox sự kiện cho /api/events (SSE) - services/events.py
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS events (
+            id {AUTO_ID[_dialect(conn)]},
+            kind VARCHAR(50) NOT NULL,
+            payload TEXT,
+            created_at TIMESTAMP NULL
+        )
+    """))
+
+
+def _m008_data_versions(conn):
+    # Phiên bản dữ liệu dùng chung (vd. 'masterdata') để cache phía sau biết khi nào cần làm mới
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name VARCHAR(50) NOT NULL PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NULL
+        )
+    """))
+
+
+def _m009_stats_rollups(conn):
+    # Bảng tổng hợp cho /stats (services/stats.py), điền ngay từ dữ liệu hiện có
+    # SQLite local tạo từ bản cũ chưa có cột userscan
+    _add_column(conn, 'scanfile', 'userscan', 'text')
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS stats_job_pallets (
+            jobno VARCHAR(255) NOT NULL DEFAULT '',
+            jobno_type VARCHAR(255) NOT NULL DEFAULT '',
+            pallet_type VARCHAR(50) NOT NULL DEFAULT '',
+            pallet VARCHAR(50) NOT NULL DEFAULT '',
+            cartons INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (jobno, jobno_type, pallet_type, pallet)
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS stats_users (
+            userscan VARCHAR(255) NOT NULL PRIMARY KEY,
+            cartons INTEGER NOT NULL DEFAULT 0
+        )
+    """))
+    conn.execute(text("DELETE FROM stats_job_pallets"))
+    conn.execute(text("DELETE FROM stats_users"))
+    conn.execute(text("""
+        INSERT INTO stats_job_pallets (jobno, jobno_type, pallet_type, pallet, cartons)
+        SELECT COALESCE(jobno, ''), COALESCE(jobno_type, ''),
+               CASE WHEN pallet IS NULL OR pallet = '' THEN '' ELSE COALESCE(pallet_type, '') END,
+               COALESCE(pallet, ''), COUNT(id)
+        FROM scanfile
+        GROUP BY COALESCE(jobno, ''), COALESCE(jobno_type, ''),
+                 CASE WHEN pallet IS NULL OR pallet = '' THEN '' ELSE COALESCE(pallet_type, '') END,
+                 COALESCE(pallet, '')
+    """))
+    conn.execute(text("""
+        INSERT INTO stats_users (userscan, cartons)
+        SELECT userscan, COUNT(id) FROM scanfile
+        WHERE userscan IS NOT NULL AND userscan != ''
+        GROUP BY userscan
+    """))
+
+
+def _m010_productivity_hourly(conn):
+    # Năng suất theo user/giờ/job (services/productivity.py) thay cho lọc DATE(time_scan) trên scanfile
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS productivity_hourly (
+            bucket VARCHAR(16) NOT NULL,
+            userscan VARCHAR(255) NOT NULL,
+            jobno_type VARCHAR(255) NOT NULL DEFAULT '',
+            cartons INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, userscan, jobno_type)
+        )
+    """))
+    # Báo cáo một user trong khoảng ngày
+    _create_index(conn, 'ix_productivity_user_bucket', 'productivity_hourly', ['userscan', 'bucket'])
+    conn.execute(text("DELETE FROM productivity_hourly"))
+    bucket = {
+        'mysql': "DATE_FORMAT(time_scan, '%Y-%m-%d %H:00')",
+        'postgresql': "to_char(time_scan, 'YYYY-MM-DD HH24:00')",
+        'sqlite': "strftime('%Y-%m-%d %H:00', time_scan)",
+    }[_dialect(conn)]
+    conn.execute(text(f"""
+        INSERT INTO productivity_hourly (bucket, userscan, jobno_type, cartons)
+        SELECT {bucket}, userscan, COALESCE(jobno_type, ''), COUNT(id)
+        FROM scanfile
+        WHERE userscan IS NOT NULL AND userscan != '' AND time_scan IS NOT NULL
+        GROUP BY {bucket}, userscan, COALESCE(jobno_type, '')
+    """))
+
+
+def _m011_scanfile_archive(conn):
+    # Bảng lưu trữ job đã xong (services/archive.py), phân vùng theo tháng trên Postgres/MySQL
+    dialect = _dialect(conn)
+    if dialect == 'postgresql':
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS scanfile_archive (LIKE scanfile, archived_at TIMESTAMP NOT NULL)
+            PARTITION BY RANGE (archived_at)
+        """))
+        # Dự phòng cho dòng ngoài các phân vùng tháng (ensure_partition luôn tạo tháng hiện tại trước khi ghi)
+        conn.execute(text("CREATE TABLE IF NOT EXISTS scanfile_archive_default PARTITION OF scanfile_archive DEFAULT"))
+    elif dialect == 'mysql':
+        conn.execute(text("CREATE TABLE IF NOT EXISTS scanfile_archive LIKE scanfile"))
+        if 'archived_at' not in {c['name'] for c in inspect(conn).get_columns('scanfile_archive')}:
+            # Khóa chính phải chứa cột phân vùng
+            conn.execute(text("""
+                ALTER TABLE scanfile_archive
+                ADD COLUMN archived_at DATETIME NOT NULL DEFAULT '2000-01-01 00:00:00',
+                DROP PRIMARY KEY, ADD PRIMARY KEY (id, archived_at)
+            """))
+        unique = [ix['name'] for ix in inspect(conn).get_indexes('scanfile_archive') if ix.get('unique')]
+        if unique:
+            print(f"scanfile_archive: có unique index {', '.join(unique)} -> không phân vùng theo tháng")
+        else:
+            conn.execute(text("""
+                ALTER TABLE scanfile_archive PARTITION BY RANGE (TO_DAYS(archived_at))
+                (PARTITION pmax VALUES LESS THAN MAXVALUE)
+            """))
+    else:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS scanfile_archive AS SELECT * FROM scanfile WHERE 1 = 0"))
+        _add_column(conn, 'scanfile_archive', 'archived_at', 'timestamp')
+
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS archived_jobs (
+            jobno_type VARCHAR(255) NOT NULL PRIMARY KEY,
+            row_count INTEGER NOT NULL DEFAULT 0,
+            archived_at TIMESTAMP NULL
+        )
+    """))
+    if dialect != 'mysql':
+        # MySQL: CREATE TABLE ... LIKE đã chép các index của scanfile
+        _create_index(conn, 'ix_scanfile_archive_job_pallet', 'scanfile_archive', ['jobno_type', 'pallet', 'sku'])
+
+
+def _m012_pallet_registry(conn):
+    # Sổ pallet theo job (services/pallets.py) thay cho SELECT DISTINCT pallet trên scanfile
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS pallet_registry (
+            jobno_type VARCHAR(255) NOT NULL,
+            pallet_no VARCHAR(50) NOT NULL,
+            state VARCHAR(20) NOT NULL DEFAULT 'open',
+            pallet_type VARCHAR(50) NOT NULL DEFAULT '',
+            cartons INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NULL,
+            PRIMARY KEY (jobno_type, pallet_no)
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS pallet_limits (
+            jobno_type VARCHAR(255) NOT NULL PRIMARY KEY,
+            pallet_count INTEGER NOT NULL
+        )
+    """))
+    conn.execute(text("DELETE FROM pallet_registry"))
+    # Pallet in xong khi mọi thùng đã có jobscan (gồm cả job đã lưu trữ)
+    conn.execute(text("""
+        INSERT INTO pallet_registry (jobno_type, pallet_no, state, pallet_type, cartons)
+        SELECT jobno_type, pallet,
+               CASE WHEN SUM(CASE WHEN jobscan IS NOT NULL AND jobscan != '' THEN 1 ELSE 0 END) = COUNT(id)
+                    THEN 'printed' ELSE 'open' END,
+               COALESCE(MAX(pallet_type), ''), COUNT(id)
+        FROM (SELECT id, jobno_type, pallet, pallet_type, jobscan FROM scanfile
+              UNION ALL SELECT id, jobno_type, pallet, pallet_type, jobscan FROM scanfile_archive) AS s
+        WHERE jobno_type IS NOT NULL AND pallet IS NOT NULL AND pallet != ''
+        GROUP BY jobno_type, pallet
+    """))
+
+
+def _m013_jobs(conn):
+    # Bảng job (services/jobs.py) thay cho SELECT DISTINCT jobno_type trên scanfile ở mỗi trang
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            jobno_type VARCHAR(255) NOT NULL PRIMARY KEY,
+            jobno VARCHAR(255) NOT NULL DEFAULT '',
+            status VARCHAR(20) NOT NULL DEFAULT 'active',
+            total_cartons INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP NULL,
+            closed_at TIMESTAMP NULL
+        )
+    """))
+    _create_index(conn, 'ix_jobs_status', 'jobs', ['status', 'created_at'])
+    conn.execute(text("""
+        INSERT INTO jobs (jobno_type, jobno, total_cartons)
+        SELECT jobno_type, COALESCE(MAX(jobno), ''), COUNT(id)
+        FROM (SELECT id, jobno, jobno_type FROM scanfile
+              UNION ALL SELECT id, jobno, jobno_type FROM scanfile_archive) AS s
+        WHERE jobno_type IS NOT NULL AND jobno_type != ''
+        GROUP BY jobno_type
+    """))
+    now = datetime.now()
+    conn.execute(text("UPDATE jobs SET created_at = :now WHERE created_at IS NULL"), {'now': now})
+    conn.execute(text(
+        "UPDATE jobs SET status = 'closed', closed_at = :now WHERE jobno_type IN (SELECT jobno_type FROM archived_jobs)"
+    ), {'now': now})
+
+
+def _m014_scan_ledger(conn):
+    # Sổ chống trùng scan theo scan_id của máy quét (services/scan_ledger.py)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS scan_ledger (
+            scan_id VARCHAR(64) NOT NULL PRIMARY KEY,
+            jobno_type VARCHAR(255) NOT NULL,
+            userscan VARCHAR(255) NULL,
+            result TEXT NOT NULL,
+            created_at TIMESTAMP NULL
+        )
+    """))
+    _create_index(conn, 'ix_scan_ledger_created', 'scan_ledger', ['created_at'])
+
+
+def _m015_scanned_barcodes(conn):
+    # Sổ mã vạch đã scan theo job (services/scanned_barcodes.py): chặn scan lại cùng một thùng
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS scanned_barcodes (
+            jobno_type VARCHAR(255) NOT NULL,
+            barcode VARCHAR(100) NOT NULL,
+            sku VARCHAR(255) NOT NULL,
+            pallet VARCHAR(50) NOT NULL,
+            userscan VARCHAR(255) NULL,
+            scanned_at TIMESTAMP NULL,
+            PRIMARY KEY (jobno_type, barcode)
+        )
+    """))
+    # delete_scan: mã scan gần nhất của pallet + SKU
+    _create_index(conn, 'ix_scanned_barcodes_pallet', 'scanned_barcodes', ['jobno_type', 'pallet', 'sku', 'scanned_at'])
+
+
+def _m016_archived_job_state(conn):
+    # archiving/restoring trong lúc chuyển dữ liệu job (services/archive.py), dòng cũ = archived
+    _add_column(conn, 'archived_jobs', 'state', 'text')
+    conn.execute(text("UPDATE archived_jobs SET state = 'archived' WHERE state IS NULL"))
+
+
+MIGRATIONS = [
+    (1, 'masterdata_watermark', _m001_masterdata_watermark),
+    (2, 'scanfile_hot_indexes', _m002_scanfile_hot_indexes),
+    (3, 'masterdata_refix_index', _m003_masterdata_refix_index),
+    (4, 'logs_unread_index', _m004_logs_unread_index),
+    (5, 'scan_counters', _m005_scan_counters),
+    (6, 'job_version', _m006_job_version),
+    (7, 'events', _m007_events),
+    (8, 'data_versions', _m008_data_versions),
+    (9, 'stats_rollups', _m009_stats_rollups),
+    (10, 'productivity_hourly', _m010_productivity_hourly),
+    (11, 'scanfile_archive', _m011_scanfile_archive),
+    (12, 'pallet_registry', _m012_pallet_registry),
+    (13, 'jobs', _m013_jobs),
+    (14, 'scan_ledger', _m014_scan_ledger),
+    (15, 'scanned_barcodes', _m015_scanned_barcodes),
+    (16, 'archived_job_state', _m016_archived_job_state),
+]
+
+
+def _ensure_migrations_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NULL
+        )
+    """))
+
+
+def current_version(conn):
+    _ensure_migrations_table(conn)
+    row = conn.execute(text("SELECT MAX(version) FROM schema_migrations")).fetchone()
+    return row[0] or 0
+
+
+def upgrade(engine, log=print):
+    """Chạy các migration chưa áp dụng theo thứ tự version. Trả về danh sách version đã chạy."""
+    applied = []
+    with engine.begin() as conn:
+        done = current_version(conn)
+    for version, name, migrate in MIGRATIONS:
+        if version <= done:
+            continue
+        # Mỗi migration một transaction (MySQL tự commit DDL, nên migration phải idempotent)
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {'v': version, 'n': name, 't': datetime.now()}
+            )
+        log(f"Migration {version:03d} {name}: OK")
+        applied.append(version)
+    return applied
+
+
+# --- KIỂM TRA EXPLAIN CHO CÁC QUERY NÓNG ---
+
+# Câu SQL lấy từ chính module chạy query (không chép lại - sửa query là EXPLAIN đúng câu mới).
+# Phần tử: (tên, SQL hoặc hàm dialect -> SQL). Query nằm trong app.py được app truyền thêm qua `queries`.
+HOT_QUERIES = [
+    ('claim', lambda dialect: claims.claim_sql(dialect, ['pallet', 'pallet_type', 'userscan', 'time_scan'], 'LIMIT :limit')),
+    ('counters.scan_summary', counters.SCAN_SUMMARY_SQL),
+    ('counters.remaining_skus', counters.REMAINING_SKUS_SQL),
+    ('counters.rebuild', counters.AGGREGATE_SQL),
+    ('stats.pallets', stats.PALLET_ROWS_SQL),
+    ('stats.remain', stats.REMAINING_ROWS_SQL),
+    ('stats.users', stats.USER_ROWS_SQL),
+    ('productivity.range', productivity.bucket_rows_sql()),
+]
+
+
+def _explain(conn, sql, params):
+    dialect = _dialect(conn)
+    if dialect == 'sqlite':
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).fetchall()
+        lines = [row[-1] for row in rows]
+        # "SCAN <bảng>" (không qua index) = đọc toàn bảng
+        full_scan = any(line.startswith('SCAN ') and 'INDEX' not in line for line in lines)
+    elif dialect == 'mysql':
+        result = conn.execute(text(f"EXPLAIN {sql}"), params)
+        keys = list(result.keys())
+        rows = [dict(zip(keys, row)) for row in result]
+        lines = [f"{r.get('table')}: type={r.get('type')} key={r.get('key')} rows={r.get('rows')} {r.get('Extra') or ''}" for r in rows]
+        full_scan = any(r.get('type') == 'ALL' for r in rows)
+    else:
+        rows = conn.execute(text(f"EXPLAIN {sql}"), params).fetchall()
+        lines = [row[0] for row in rows]
+        full_scan = any('Seq Scan' in line for line in lines)
+    return lines, full_scan
+
+
+def explain_hot_queries(engine, job_type='', sku='', pallet='1', queries=(), log=print):
+    """In EXPLAIN của HOT_QUERIES + `queries`; trả về tên các query còn quét toàn bảng."""
+    params = {'job_type': job_type, 'sku': sku, 'pallet': pallet, 'pallet_no': pallet, 'pallet_type': '', 'userscan': '',
+              'time_scan': None, 'limit': 1, 'start': '2024-01-01 00:00', 'end': '2024-02-01 00:00'}
+    offenders = []
+    with engine.connect() as conn:
+        for name, sql in HOT_QUERIES + list(queries):
+            if callable(sql):
+                sql = sql(_dialect(conn))
+            lines, full_scan = _explain(conn, sql, params)
+            log(f"[{'FULL SCAN' if full_scan else 'OK'}] {name}")
+            for line in lines:
+                log(f"    {line}")
+            if full_scan:
+                offenders.append(name)
+    return offenders
@@ -0,0 +1,128 @@
+import math
+import os
+from collections import namedtuple
+
+# Cấu hình chạy production (gunicorn.conf.py đọc ở đây): loại worker, số worker/thread và kích thước
+# pool kết nối DB của mỗi worker, tính từ số CPU và giới hạn kết nối của DB (Aiven: max_connections thấp).
+#
+# Loại worker (GUNICORN_WORKER_CLASS):
+#   sync    - 1 request/worker. Một request chậm (/stats, xuất file) hoặc một kết nối SSE giữ cả worker.
+#             Chỉ dùng khi cần tương thích tuyệt đối.
+#   gthread - (mặc định) nhiều thread/worker. Request chờ DB nhả GIL -> các trạm scan khác vẫn chạy.
+#   gevent  - greenlet, hàng trăm kết nối mở (SSE) mỗi worker. Cần `pip install gevent`; PyMySQL chạy được,
+#             psycopg2 cần thêm psycogreen. Số request chạm DB cùng lúc vẫn bị giới hạn bởi pool.
+#
+# Ngân sách kết nối: DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS (CLI, migration, admin) chia đều cho các worker.
+# Mỗi worker cần 1 kết nối cho luồng EventBus (SSE) + pool cho request; thiếu ngân sách thì giảm số worker
+# chứ không vượt giới hạn. pool_size + max_overflow của mỗi worker = phần ngân sách của worker đó.
+#
+# Thời gian chờ (từ trong ra ngoài, mỗi tầng ngắn hơn tầng ngoài để request lỗi rõ ràng trước khi worker bị kill):
+#   DB_STATEMENT_TIMEOUT (1 câu query) < DB_POOL_TIMEOUT + query (chờ kết nối rảnh) < timeout của gunicorn.
+#   DB_LATENCY_MS (độ trễ 1 lượt tới DB) cộng thêm vào timeout cho các request nhiều lượt query,
+#   và tăng số thread mặc định: thread chờ mạng lâu hơn -> cần nhiều thread hơn để giữ CPU bận.
+#
+# Sức chứa mỗi instance (request đồng thời / kết nối DB tối đa) tính theo công thức của build(), không phải số đo,
+# với DB_MAX_CONNECTIONS=20, DB_LATENCY_MS=20:
+#   CPU  sync                 gthread                  gevent
+#   1    3 worker: 3 / 6      2 worker x 6: 12 / 14    1 worker x 100: 100 / 17
+#   2    5 worker: 5 / 10     3 worker x 6: 18 / 15    2 worker x 100: 200 / 16
+#   4    8 worker: 8 / 16     5 worker x 6: 30 / 15    4 worker x 100: 400 / 16
+# (4 CPU sync bị giới hạn bởi ngân sách kết nối; gthread 4 CPU: pool 2+1/worker, thread dư chờ kết nối)
+# Chưa đo thông lượng của các profile sync/gthread/gevent: chưa so sánh profile nào nhanh hơn.
+# Đo bằng `flask --app app load-test --url` tới gunicorn với từng GUNICORN_WORKER_CLASS và DB thật
+# (loadtest/docker-compose.yml) trước khi chọn profile cho mùa cao điểm.
+
+WORKER_CLASSES = ('sync', 'gthread', 'gevent')
+
+ServerProfile = namedtuple('ServerProfile', [
+    'worker_class', 'workers', 'threads', 'worker_connections',
+    'pool_size', 'max_overflow', 'pool_timeout',
+    'statement_timeout', 'timeout', 'graceful_timeout', 'keepalive',
+])
+
+
+def _env_int(env, name, default):
+    value = env.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _env_float(env, name, default):
+    value = env.get(name)
+    return float(value) if value not in (None, '') else default
+
+
+def default_threads(latency_ms):
+    """Thread mỗi worker gthread: 4 khi DB cùng máy, tăng theo độ trễ mạng, tối đa 16."""
+    return max(4, min(16, 4 + math.ceil(latency_ms / 10)))
+
+
+def build(env=None, cpu_count=None):
+    """Tính cấu hình từ biến môi trường (mặc định os.environ). Trả về ServerProfile."""
+    env = os.environ if env is None else env
+    cpus = cpu_count or os.cpu_count() or 1
+    worker_class = env.get('GUNICORN_WORKER_CLASS', 'gthread')
+    if worker_class not in WORKER_CLASSES:
+        raise ValueError(f"GUNICORN_WORKER_CLASS phải là một trong {', '.join(WORKER_CLASSES)}")
+    latency_ms = _env_float(env, 'DB_LATENCY_MS', 20)
+
+    if worker_class == 'sync':
+        workers, threads, connections = 2 * cpus + 1, 1, 1
+    elif worker_class == 'gthread':
+        workers = cpus + 1
+        threads = _env_int(env, 'GUNICORN_THREADS', default_threads(latency_ms))
+        connections = threads
+    else:
+        workers, threads = cpus, 1
+        connections = _env_int(env, 'GUNICORN_WORKER_CONNECTIONS', 100)
+    workers = _env_int(env, 'WEB_CONCURRENCY', workers)
+
+    # Chia ngân sách kết nối: mỗi worker tối thiểu 2 (1 request + EventBus)
+    budget = _env_int(env, 'DB_MAX_CONNECTIONS', 20) - _env_int(env, 'DB_RESERVED_CONNECTIONS', 3)
+    workers = max(1, min(workers, budget // 2))
+    per_worker = max(2, budget // workers)
+    pool_size = max(1, min(connections, per_worker - 1))
+    max_overflow = max(0, min(connections + 1, per_worker) - pool_size)
+
+    statement_timeout = _env_float(env, 'DB_STATEMENT_TIMEOUT', 20)
+    pool_timeout = _env_float(env, 'DB_POOL_TIMEOUT', 10)
+    sse_seconds = _env_float(env, 'SSE_STREAM_SECONDS', 25)
+    # Request dài nhất: chờ kết nối + 1 query chậm + ~200 lượt query ngắn (xuất file, in cả job)
+    request_budget = pool_timeout + statement_timeout + 200 * latency_ms / 1000
+    timeout = _env_int(env, 'GUNICORN_TIMEOUT', math.ceil(max(30, request_budget, sse_seconds) + 5))
+
+    return ServerProfile(
+        worker_class=worker_class, workers=workers, threads=threads, worker_connections=connections,
+        pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout,
+        statement_timeout=statement_timeout, timeout=timeout, graceful_timeout=timeout, keepalive=5,
+    )
+
+
+def export_env(profile, env=None):
+    """Ghi kích thước pool/timeout vào biến môi trường để Config của app trong worker đọc lại."""
+    env = os.environ if env is None else env
+    env['DB_POOL_SIZE'] = str(profile.pool_size)
+    env['DB_MAX_OVERFLOW'] = str(profile.max_overflow)
+    env['DB_POOL_TIMEOUT'] = str(profile.pool_timeout)
+    env['DB_STATEMENT_TIMEOUT'] = str(profile.statement_timeout)
+
+
+def engine_options(dialect, pool_size=None, max_overflow=None, pool_timeout=None, statement_timeout=None):
+    """Tùy chọn create_engine cho pool/timeout. SQLite bỏ qua (không dùng pool kết nối mạng)."""
+    if dialect == 'sqlite':
+        return {}, {}
+    options = {}
+    if pool_size:
+        options['pool_size'] = pool_size
+    if max_overflow is not None:
+        options['max_overflow'] = max_overflow
+    if pool_timeout:
+        options['pool_timeout'] = pool_timeout
+    connect_args = {}
+    if statement_timeout:
+        if dialect == 'postgresql':
+            connect_args['options'] = f"-c statement_timeout={int(statement_timeout * 1000)}"
+        elif dialect == 'mysql':
+            # PyMySQL: timeout đọc/ghi socket (giây) - query vượt quá bị ngắt phía client
+            connect_args['read_timeout'] = int(math.ceil(statement_timeout))
+            connect_args['write_timeout'] = int(math.ceil(statement_timeout))
+    return options, connect_args
@@ -0,0 +1,265 @@
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+# Nhật ký query chậm: câu SQL chạy lâu hơn ngưỡng được ghi (dạng chuẩn hóa, kiểu tham số, route gọi tới)
+# cùng kế hoạch thực thi EXPLAIN lấy tự động. Ghi và EXPLAIN chạy ở luồng nền của worker (không cộng vào
+# thời gian request), lưu trong file SQLite dùng chung giữa các worker:
+#   slow_query_stats  - mỗi dạng câu (fingerprint) một dòng: số lần, tổng/lớn nhất ms, mẫu gần nhất, plan
+#   slow_query_samples - từng lần chậm, giữ tối đa `max_samples` dòng mới nhất (xoay vòng)
+
+_WHITESPACE = re.compile(r'\s+')
+_IN_LIST = re.compile(r'\(\s*(?:%s|\?|%\(\w+\)s|:\w+)(?:\s*,\s*(?:%s|\?|%\(\w+\)s|:\w+))+\s*\)')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_REPEATED_ROWS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+
+# Câu có thể EXPLAIN mà không chạy thật
+EXPLAINABLE = ('select', 'update', 'delete', 'insert', 'with')
+
+
+def fingerprint(statement):
+    """Dạng chuẩn của câu SQL: gộp khoảng trắng, danh sách IN (...) và hằng số -> cùng dạng gộp một dòng."""
+    text_ = _WHITESPACE.sub(' ', statement).strip()
+    text_ = _LITERAL.sub('?', text_)
+    text_ = _IN_LIST.sub('(...)', text_)
+    return _REPEATED_ROWS.sub('(...)', text_)
+
+
+def param_shape(parameters, executemany=False):
+    """Kiểu của tham số (không lưu giá trị): {'job_type': 'str', 'ids': 'list[120]'} hoặc ['str', 'int']."""
+    if executemany:
+        rows = list(parameters or [])
+        return {'executemany': len(rows), 'row': param_shape(rows[0]) if rows else None}
+
+    def shape(value):
+        if isinstance(value, (list, tuple)):
+            return f"{type(value).__name__}[{len(value)}]"
+        return type(value).__name__
+
+    if isinstance(parameters, dict):
+        return {key: shape(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [shape(value) for value in parameters]
+    return None
+
+
+def explain_sql(dialect, statement):
+    if dialect == 'sqlite':
+        return f"EXPLAIN QUERY PLAN {statement}"
+    if dialect == 'postgresql':
+        return f"EXPLAIN (FORMAT TEXT) {statement}"
+    return f"EXPLAIN {statement}"
+
+
+class SlowQueryStore:
+    """File SQLite lưu query chậm (dùng chung giữa các worker)."""
+
+    def __init__(self, path, max_samples=2000, max_fingerprints=500):
+        self.path = path
+        self.max_samples = max_samples
+        self.max_fingerprints = max_fingerprints
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS slow_query_stats (
+                    fingerprint TEXT PRIMARY KEY, calls INTEGER NOT NULL, total_ms REAL NOT NULL, max_ms REAL NOT NULL,
+                    routes TEXT NOT NULL, statement TEXT NOT NULL, params TEXT, plan TEXT, plan_at TEXT, last_seen TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_slow_query_stats_total ON slow_query_stats (total_ms);
+                CREATE TABLE IF NOT EXISTS slow_query_samples (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, fingerprint TEXT NOT NULL, route TEXT, ms REAL NOT NULL,
+                    params TEXT, created_at TEXT NOT NULL
+                );
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def plan_age(self, conn, key):
+        row = conn.execute("SELECT plan_at FROM slow_query_stats WHERE fingerprint = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def record(self, conn, entry, plan=None):
+        key = entry['fingerprint']
+        params = json.dumps(entry['params'], ensure_ascii=False)
+        now = entry['at']
+        row = conn.execute("SELECT routes FROM slow_query_stats WHERE fingerprint = ?", (key,)).fetchone()
+        if row:
+            routes = sorted(set(json.loads(row[0])) | {entry['route']})
+            conn.execute("""
+                UPDATE slow_query_stats SET calls = calls + 1, total_ms = total_ms + ?, max_ms = MAX(max_ms, ?),
+                    routes = ?, statement = ?, params = ?, last_seen = ?,
+                    plan = COALESCE(?, plan), plan_at = CASE WHEN ? IS NULL THEN plan_at ELSE ? END
+                WHERE fingerprint = ?
+            """, (entry['ms'], entry['ms'], json.dumps(routes), entry['statement'], params, now, plan, plan, now, key))
+        else:
+            conn.execute("""
+                INSERT INTO slow_query_stats (fingerprint, calls, total_ms, max_ms, routes, statement, params, plan, plan_at, last_seen)
+                VALUES (?, 1, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (key, entry['ms'], entry['ms'], json.dumps([entry['route']]), entry['statement'], params, plan,
+                  now if plan else None, now))
+        cursor = conn.execute("INSERT INTO slow_query_samples (fingerprint, route, ms, params, created_at) VALUES (?, ?, ?, ?, ?)",
+                              (key, entry['route'], entry['ms'], params, now))
+        # Xoay vòng: giữ max_samples mẫu mới nhất và max_fingerprints dạng câu tốn nhiều thời gian nhất
+        conn.execute("DELETE FROM slow_query_samples WHERE id <= ?", (cursor.lastrowid - self.max_samples,))
+        extra = conn.execute("SELECT COUNT(*) FROM slow_query_stats").fetchone()[0] - self.max_fingerprints
+        if extra > 0:
+            conn.execute("""
+                DELETE FROM slow_query_stats WHERE fingerprint IN (
+                    SELECT fingerprint FROM slow_query_stats WHERE fingerprint != ? ORDER BY total_ms LIMIT ?)
+            """, (key, extra))
+
+    def worst(self, limit=50):
+        """Dạng câu xếp theo tổng thời gian giảm dần."""
+        columns = ('fingerprint', 'calls', 'total_ms', 'max_ms', 'routes', 'statement', 'params', 'plan', 'plan_at', 'last_seen')
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT {', '.join(columns)} FROM slow_query_stats ORDER BY total_ms DESC LIMIT ?", (limit,))
+            result = []
+            for row in rows:
+                item = dict(zip(columns, row))
+                item['routes'] = json.loads(item['routes'])
+                item['params'] = json.loads(item['params']) if item['params'] else None
+                item['avg_ms'] = round(item['total_ms'] / item['calls'], 2)
+                item['total_ms'] = round(item['total_ms'], 2)
+                item['max_ms'] = round(item['max_ms'], 2)
+                result.append(item)
+            return result
+
+    def recent(self, fingerprint_, limit=20):
+        with self._connect() as conn:
+            rows = conn.execute("""
+                SELECT route, ms, params, created_at FROM slow_query_samples
+                WHERE fingerprint = ? ORDER BY id DESC LIMIT ?
+            """, (fingerprint_, limit))
+            return [{'route': r[0], 'ms': round(r[1], 2), 'params': json.loads(r[2]) if r[2] else None, 'at': r[3]} for r in rows]
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM slow_query_stats")
+            conn.execute("DELETE FROM slow_query_samples")
+
+
+class SlowQueryLog:
+    """Bắt câu SQL chậm qua event của SQLAlchemy; ghi + EXPLAIN ở luồng nền."""
+
+    def __init__(self, store, threshold_ms=200, explain=True, plan_ttl=3600, route=None, log=print):
+        self.store = store
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self.plan_ttl = plan_ttl
+        self.route = route or (lambda: 'background')
+        self.log = log
+        self.engine = None
+        self.captured = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=1000)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def instrument(self, engine):
+        self.engine = engine
+
+        def before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('slow_query_started', []).append(time.perf_counter())
+
+        def after(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info.get('slow_query_started')
+            if not started:
+                return
+            ms = (time.perf_counter() - started.pop()) * 1000
+            if ms >= self.threshold_ms:
+                self._capture(statement, parameters, executemany, ms)
+
+        def handle_error(context):
+            started = context.connection.info.get('slow_query_started') if context.connection is not None else None
+            if started:
+                started.pop()
+
+        event.listen(engine, 'before_cursor_execute', before)
+        event.listen(engine, 'after_cursor_execute', after)
+        event.listen(engine, 'handle_error', handle_error)
+
+    def _capture(self, statement, parameters, executemany, ms):
+        entry = {
+            'fingerprint': fingerprint(statement),
+            'statement': statement,
+            # Tham số thật chỉ giữ trong hàng đợi để EXPLAIN, không ghi ra file
+            'raw_params': None if executemany else parameters,
+            'params': param_shape(parameters, executemany),
+            'route': self.route(),
+            'ms': ms,
+            'at': datetime.now().isoformat(sep=' ', timespec='seconds'),
+        }
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.captured += 1
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='slow-query-log', daemon=True)
+                self._thread.start()
+
+    def _plan(self, entry):
+        """EXPLAIN trên kết nối DBAPI riêng (không qua event, không ảnh hưởng transaction của request)."""
+        if entry['raw_params'] is None and entry['params'] is not None:
+            return None
+        if not entry['statement'].lstrip().lower().startswith(EXPLAINABLE):
+            return None
+        raw = self.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            sql = explain_sql(self.engine.dialect.name, entry['statement'])
+            if entry['raw_params']:
+                cursor.execute(sql, entry['raw_params'])
+            else:
+                cursor.execute(sql)
+            lines = [' | '.join(str(value) for value in row) for row in cursor.fetchall()]
+            cursor.close()
+            return '\n'.join(lines)
+        finally:
+            # Không commit gì: EXPLAIN (không ANALYZE) không thay đổi dữ liệu
+            raw.rollback()
+            raw.close()
+
+    def _needs_plan(self, conn, key):
+        plan_at = self.store.plan_age(conn, key)
+        if plan_at is None:
+            return True
+        return (datetime.now() - datetime.fromisoformat(plan_at)).total_seconds() >= self.plan_ttl
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            try:
+                with self.store._connect() as conn:
+                    plan = None
+                    if self.explain and self._needs_plan(conn, entry['fingerprint']):
+                        try:
+                            plan = self._plan(entry)
+                        except Exception as e:
+                            plan = f"(EXPLAIN lỗi: {e})"
+                    self.store.record(conn, entry, plan)
+            except Exception as e:
+                self.log(f"Lỗi ghi query chậm: {e}")
+
+    def stats(self):
+        return {'threshold_ms': self.threshold_ms, 'captured': self.captured, 'dropped': self.dropped,
+                'pending': self._queue.qsize()}
@@ -0,0 +1,187 @@
+from collections import Counter
+
+from sqlalchemy import bindparam, text
+
+from services import archive
+
+# Bảng tổng hợp cho trang /stats, cập nhật cùng transaction với mỗi lần scan/gỡ/nạp:
+#   stats_job_pallets (jobno, jobno_type, pallet_type, pallet) -> cartons
+#       pallet = '' và pallet_type = '' là số thùng còn chờ scan của job
+#   stats_users (userscan) -> cartons đã scan (theo userscan hiện tại của thùng)
+# Dòng về 0 được giữ lại (phần đọc lọc cartons > 0); `rebuild` tính lại toàn bộ từ scanfile.
+
+WAITING = ('', '')
+
+
+def _dialect(session):
+    return session.get_bind().dialect.name
+
+
+def _key(value):
+    return '' if value is None else str(value)
+
+
+def _upsert(session, table, keys, rows):
+    """Cộng dồn cartons theo khóa. rows: list dict(keys..., cartons)."""
+    rows = [row for row in rows if row['cartons']]
+    if not rows:
+        return
+    # Khóa dòng theo thứ tự cố định để tránh deadlock giữa các transaction
+    rows.sort(key=lambda r: tuple(r[k] for k in keys))
+    columns = ', '.join(keys + ['cartons'])
+    values = ', '.join(f":{k}" for k in keys + ['cartons'])
+    if _dialect(session) == 'mysql':
+        sql = f"INSERT INTO {table} ({columns}) VALUES ({values}) ON DUPLICATE KEY UPDATE cartons = cartons + VALUES(cartons)"
+    else:
+        sql = (f"INSERT INTO {table} ({columns}) VALUES ({values}) "
+               f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET cartons = {table}.cartons + excluded.cartons")
+    session.execute(text(sql), rows)
+
+
+def _add_pallets(session, deltas):
+    """deltas: {(jobno, jobno_type, pallet_type, pallet): cartons}."""
+    _upsert(session, 'stats_job_pallets', ['jobno', 'jobno_type', 'pallet_type', 'pallet'], [
+        {'jobno': jobno, 'jobno_type': job_type, 'pallet_type': pallet_type, 'pallet': pallet, 'cartons': n}
+        for (jobno, job_type, pallet_type, pallet), n in deltas.items()
+    ])
+
+
+def _add_users(session, deltas):
+    _upsert(session, 'stats_users', ['userscan'], [
+        {'userscan': user, 'cartons': n} for user, n in deltas.items() if user
+    ])
+
+
+def apply_claims(session, job_type, pallet, claimed):
+    """Chuyển các thùng vừa gán (claims.ClaimedRow) từ 'chờ scan' sang pallet; cập nhật người scan."""
+    pallets = Counter()
+    users = Counter()
+    pallet = _key(pallet)
+    for row in claimed:
+        jobno = _key(row.jobno)
+        pallets[(jobno, job_type) + WAITING] -= 1
+        pallets[(jobno, job_type, _key(row.pallet_type), pallet)] += 1
+        if row.userscan != row.prev_user:
+            users[_key(row.userscan)] += 1
+            users[_key(row.prev_user)] -= 1
+    _add_pallets(session, pallets)
+    _add_users(session, users)
+
+
+def apply_releases(session, job_type, pallet, released):
+    """Trả thùng bị gỡ khỏi pallet về 'chờ scan'. released: {(jobno, pallet_type): số thùng}.
+
+    Gỡ thùng không xóa userscan nên thống kê theo user không đổi.
+    """
+    deltas = Counter()
+    pallet = _key(pallet)
+    for (jobno, pallet_type), n in released.items():
+        deltas[(_key(jobno), job_type, _key(pallet_type), pallet)] -= n
+        deltas[(_key(jobno), job_type) + WAITING] += n
+    _add_pallets(session, deltas)
+
+
+def add_waiting(session, jobno_counts):
+    """Cộng thùng mới nạp vào 'chờ scan'. jobno_counts: {(jobno, jobno_type): số thùng}."""
+    _add_pallets(session, Counter({(_key(jobno), _key(job_type)) + WAITING: n for (jobno, job_type), n in jobno_counts.items()}))
+
+
+def rebuild(session):
+    """Tính lại toàn bộ bảng tổng hợp từ scanfile (quét cả bảng - chỉ chạy khi cần). Không commit."""
+    session.execute(text("DELETE FROM stats_job_pallets"))
+    session.execute(text("DELETE FROM stats_users"))
+    # Gồm cả job đã lưu trữ (services/archive.py) - trang /stats vẫn hiện job cũ
+    source = archive.all_rows(['id', 'jobno', 'jobno_type', 'pallet', 'pallet_type', 'userscan'])
+    session.execute(text(f"INSERT INTO stats_job_pallets (jobno, jobno_type, pallet_type, pallet, cartons) {pallets_source(source)}"))
+    session.execute(text(f"INSERT INTO stats_users (userscan, cartons) {users_source(source)}"))
+    pallets = session.execute(text("SELECT COUNT(*) FROM stats_job_pallets")).scalar()
+    users = session.execute(text("SELECT COUNT(*) FROM stats_users")).scalar()
+    return pallets, users
+
+
+def resync_pallet(session, job_type, pallet, jobnos):
+    """Ghi lại số thùng thực tế của pallet và phần 'chờ scan' của các jobno trong job. Không commit.
+
+    Dùng khi gỡ thùng bị lệch với số đọc trước (bị gỡ đồng thời): chỉ đọc các dòng của job/pallet
+    (index jobno_type + pallet) và chỉ ghi các dòng tổng hợp theo khóa (jobno, jobno_type) - không quét
+    cả bảng. Gỡ thùng không đổi userscan nên stats_users giữ nguyên.
+    """
+    pallet = _key(pallet)
+    params = {'job_type': job_type, 'pallet': pallet}
+    on_pallet = session.execute(text("""
+        SELECT jobno, pallet_type, COUNT(id) FROM scanfile
+        WHERE jobno_type = :job_type AND pallet = :pallet
+        GROUP BY jobno, pallet_type
+    """), params).fetchall()
+    waiting = session.execute(text("""
+        SELECT jobno, COUNT(id) FROM scanfile
+        WHERE jobno_type = :job_type AND (pallet IS NULL OR pallet = '')
+        GROUP BY jobno
+    """), params).fetchall()
+    jobnos = {_key(jobno) for jobno in jobnos} | {_key(row[0]) for row in on_pallet}
+    if not jobnos:
+        return
+    delete = text("""
+        DELETE FROM stats_job_pallets
+        WHERE jobno IN :jobnos AND jobno_type = :job_type AND pallet IN ('', :pallet)
+    """).bindparams(bindparam('jobnos', expanding=True))
+    session.execute(delete, dict(params, jobnos=sorted(jobnos)))
+    fresh = Counter()
+    for jobno, pallet_type, n in on_pallet:
+        fresh[(_key(jobno), job_type, _key(pallet_type), pallet)] += n
+    for jobno, n in waiting:
+        if _key(jobno) in jobnos:
+            fresh[(_key(jobno), job_type) + WAITING] += n
+    _add_pallets(session, fresh)
+
+
+# Nguồn tính lại cho rebuild. source: bảng hoặc subquery có alias
+def pallets_source(source='scanfile'):
+    return f"""
+    SELECT COALESCE(jobno, ''), COALESCE(jobno_type, ''),
+           CASE WHEN pallet IS NULL OR pallet = '' THEN '' ELSE COALESCE(pallet_type, '') END,
+           COALESCE(pallet, ''), COUNT(id)
+    FROM {source}
+    GROUP BY COALESCE(jobno, ''), COALESCE(jobno_type, ''),
+             CASE WHEN pallet IS NULL OR pallet = '' THEN '' ELSE COALESCE(pallet_type, '') END,
+             COALESCE(pallet, '')
+"""
+
+
+def users_source(source='scanfile'):
+    return f"""
+    SELECT userscan, COUNT(id) FROM {source}
+    WHERE userscan IS NOT NULL AND userscan != ''
+    GROUP BY userscan
+"""
+
+
+# --- ĐỌC (chỉ bảng tổng hợp) ---
+
+PALLET_ROWS_SQL = """
+    SELECT jobno, jobno_type, pallet_type, SUM(CASE WHEN cartons > 0 THEN 1 ELSE 0 END), SUM(cartons)
+    FROM stats_job_pallets
+    WHERE pallet != ''
+    GROUP BY jobno, jobno_type, pallet_type
+    HAVING SUM(cartons) > 0
+    ORDER BY jobno
+"""
+REMAINING_ROWS_SQL = """
+    SELECT jobno, jobno_type, cartons FROM stats_job_pallets
+    WHERE pallet = '' AND cartons > 0
+    ORDER BY jobno
+"""
+USER_ROWS_SQL = "SELECT userscan, cartons FROM stats_users WHERE cartons > 0 ORDER BY userscan"
+
+
+def pallet_rows(session):
+    """(jobno, jobno_type, pallet_type, số pallet, số thùng) - cùng dạng query GROUP BY cũ của /stats."""
+    return [tuple(row) for row in session.execute(text(PALLET_ROWS_SQL))]
+
+
+def remaining_rows(session):
+    return [tuple(row) for row in session.execute(text(REMAINING_ROWS_SQL))]
+
+
+def user_rows(session):
+    return [tuple(row) for row in session.execute(text(USER_ROWS_SQL))]
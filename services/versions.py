@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+# Bộ đếm phiên bản theo tên tập dữ liệu (bảng data_versions). Tăng trong cùng transaction
+# với thay đổi dữ liệu; cache đọc lại khi phiên bản khác với lúc nạp.
+
+
+def get(session, name):
+    row = session.execute(text("SELECT version FROM data_versions WHERE name = :name"), {'name': name}).fetchone()
+    return row[0] if row else 0
+
+
+def bump(session, name):
+    """Tăng phiên bản của `name` và trả về giá trị mới. Không commit."""
+    now = datetime.now()
+    updated = session.execute(
+        text("UPDATE data_versions SET version = version + 1, updated_at = :t WHERE name = :name"),
+        {'name': name, 't': now}
+    ).rowcount
+    if not updated:
+        session.execute(
+            text("INSERT INTO data_versions (name, version, updated_at) VALUES (:name, 1, :t)"),
+            {'name': name, 't': now}
+        )
+    return get(session, name)
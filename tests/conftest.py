@@ -0,0 +1,85 @@
+import io
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+# DB SQLite tạm cho app - phải đặt trước khi import app (app tạo engine + chạy migration khi import)
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'scan_test.db')}"
+os.environ['SCAN_WRITE_BEHIND'] = '0'
+os.environ['RESPONSE_CACHE_URL'] = 'off'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine, text
+
+# scanfile như models/scanfile.py trên DB production: mọi cột NOT NULL, time_scan kiểu DATE
+# (+ userscan do migration 007 thêm, cho phép NULL)
+STRICT_SCANFILE = """
+    CREATE TABLE scanfile (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        release_key VARCHAR(255) NOT NULL, sscc VARCHAR(255) NOT NULL, master_delivery VARCHAR(255) NOT NULL,
+        qty INTEGER NOT NULL, master_ctl VARCHAR(255) NOT NULL, master_st_company VARCHAR(255) NOT NULL,
+        master_add1 VARCHAR(255) NOT NULL, master_add2 VARCHAR(255) NOT NULL, master_add3 VARCHAR(255) NOT NULL,
+        master_add4 VARCHAR(255) NOT NULL, ship_to VARCHAR(255) NOT NULL, st_zip VARCHAR(255) NOT NULL,
+        barcode VARCHAR(255) NOT NULL, sku VARCHAR(255) NOT NULL, jobno VARCHAR(255) NOT NULL,
+        jobno_type VARCHAR(255) NOT NULL, tag_label VARCHAR(255) NOT NULL, pallet VARCHAR(255) NOT NULL,
+        time_scan DATE NOT NULL, pallet_type VARCHAR(255) NOT NULL, jobscan VARCHAR(255) NOT NULL,
+        userscan VARCHAR(255) NULL
+    )
+"""
+
+
+@pytest.fixture
+def strict_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'strict.db'}", connect_args={'timeout': 30})
+    with engine.begin() as conn:
+        conn.execute(text(STRICT_SCANFILE))
+    yield engine
+    engine.dispose()
+
+
+# Bảng app dùng chung giữa các test -> xóa sạch trước mỗi test dùng client
+APP_TABLES = ('scanfile', 'masterdata', 'scan_counters', 'pallet_registry', 'jobs', 'scan_ledger', 'scanned_barcodes',
+              'stats_job_pallets', 'stats_users', 'productivity_hourly', 'archived_jobs', 'scanfile_archive', 'logs', 'events',
+              'pallet_limits', 'data_versions')
+
+
+def login(client, role='admin', user='tester'):
+    with client.session_transaction() as session:
+        session['user'] = user
+        session['role'] = role
+
+
+@pytest.fixture
+def scan_app():
+    import app as scan_app
+    from services import counters
+
+    with scan_app.app.app_context():
+        for table in APP_TABLES:
+            scan_app.db.session.execute(text(f"DELETE FROM {table}"))
+        scan_app.db.session.execute(
+            text("INSERT INTO masterdata (sku, refix, weight, updated_at) VALUES ('SKU1', '12345', 1, :t), ('SKU2', '22222', 2, :t)"),
+            {'t': datetime.now()})
+        scan_app.db.session.commit()
+        scan_app.masterdata_index.load(scan_app.db.session)
+    counters._ready.clear()
+    scan_app.job_list_cache.invalidate()
+    return scan_app
+
+
+def add_cartons(scan_app, job_type, skus, jobno='J1'):
+    """Nạp thùng chờ scan cho job qua đường nạp file thật: skus = {sku: số thùng}."""
+    lines = ['sscc,sku,jobno,jobno_type'] + [f"{job_type}-{sku}-{i},{sku},{jobno},{job_type}"
+                                             for sku, count in skus.items() for i in range(count)]
+    with scan_app.app.app_context():
+        summary = scan_app.run_import(io.BytesIO('\n'.join(lines).encode()), 'job.csv')
+    assert summary['inserted'] == sum(skus.values())
+
+
+@pytest.fixture
+def client(scan_app):
+    client = scan_app.app.test_client()
+    login(client)
+    return client
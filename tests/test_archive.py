@@ -0,0 +1,100 @@
+import pytest
+from sqlalchemy import text
+
+from conftest import add_cartons
+from services import archive, jobs
+from services.archive import JobArchiver
+
+
+@pytest.fixture
+def finished_job(scan_app, client):
+    # 5 thùng đã scan + in tem (đủ điều kiện lưu trữ)
+    add_cartons(scan_app, 'JT', {'SKU1': 5})
+    for i in range(5):
+        assert client.post('/api/scan', json={'barcode': f"{i + 1}000123450", 'job_type': 'JT', 'pallet_no': '1',
+                                              'pallet_type': '1.2'}).get_json()['success']
+    assert client.post('/api/labels/assign_jobscan', json={'job_type': 'JT'}).get_json()['success']
+    return 'JT'
+
+
+def _split(session, job_type):
+    live = session.execute(text("SELECT COUNT(*) FROM scanfile WHERE jobno_type = :j"), {'j': job_type}).scalar()
+    archived = session.execute(text(f"SELECT COUNT(*) FROM {archive.ARCHIVE_TABLE} WHERE jobno_type = :j"), {'j': job_type}).scalar()
+    return live, archived
+
+
+def _interrupt_after(archiver, batches):
+    move = archiver._move
+    calls = []
+
+    def interrupted(*args, **kwargs):
+        if len(calls) == batches:
+            raise RuntimeError("mất kết nối DB")
+        calls.append(1)
+        return move(*args, **kwargs)
+
+    archiver._move = interrupted
+
+
+def _history(client, job_type):
+    return client.post('/api/get_history', json={'job_type': job_type}).get_json()
+
+
+def test_interrupted_archive_is_marked_and_resumed(scan_app, client, finished_job):
+    db = scan_app.db
+    with scan_app.app.app_context():
+        archiver = JobArchiver(db.session, batch_size=2, log=lambda line: None)
+        _interrupt_after(archiver, 1)
+        with pytest.raises(RuntimeError):
+            archiver.archive(finished_job)
+        db.session.rollback()
+        assert archive.job_state(db.session, finished_job) == archive.ARCHIVING
+        assert _split(db.session, finished_job) == (3, 2)
+        assert archive.interrupted_jobs(db.session) == [(finished_job, 0)]
+        with pytest.raises(archive.JobMoving):
+            archive.table_for(db.session, finished_job)
+
+    # Đọc trong lúc job nằm ở hai bảng -> từ chối, không trả dữ liệu thiếu
+    history = _history(client, finished_job)
+    assert not history['success'] and 'đang được lưu trữ' in history['message']
+
+    with scan_app.app.app_context():
+        result = JobArchiver(db.session, batch_size=2, log=lambda line: None).archive(finished_job)
+        assert result['status'] == 'archived' and result['rows'] == 5
+        assert archive.job_state(db.session, finished_job) == archive.ARCHIVED
+        assert _split(db.session, finished_job) == (0, 5)
+        assert archive.interrupted_jobs(db.session) == []
+    history = _history(client, finished_job)
+    assert history['success'] and sum(item['qty'] for item in history['history']) == 5
+
+
+def test_interrupted_restore_is_marked_and_resumed(scan_app, client, finished_job):
+    db = scan_app.db
+    with scan_app.app.app_context():
+        assert JobArchiver(db.session, batch_size=2, log=lambda line: None).archive(finished_job)['status'] == 'archived'
+
+        archiver = JobArchiver(db.session, batch_size=2, log=lambda line: None)
+        _interrupt_after(archiver, 2)
+        with pytest.raises(RuntimeError):
+            archiver.restore(finished_job)
+        db.session.rollback()
+        assert archive.job_state(db.session, finished_job) == archive.RESTORING
+        assert _split(db.session, finished_job) == (4, 1)
+        with pytest.raises(archive.JobMoving):
+            archive.table_for(db.session, finished_job)
+        # archive-jobs không lưu trữ lại job đang khôi phục dở
+        assert JobArchiver(db.session).archive(finished_job)['status'] == 'skipped'
+
+    history = _history(client, finished_job)
+    assert not history['success'] and 'đang được khôi phục' in history['message']
+
+    with scan_app.app.app_context():
+        assert archive.is_archived(db.session, finished_job)
+        JobArchiver(db.session, batch_size=2, log=lambda line: None).restore(finished_job)
+        assert archive.job_state(db.session, finished_job) is None
+        assert _split(db.session, finished_job) == (5, 0)
+        assert archive.table_for(db.session, finished_job) == 'scanfile'
+        status = db.session.execute(text("SELECT status FROM jobs WHERE jobno_type = :j"), {'j': finished_job}).scalar()
+        assert status == jobs.ACTIVE
+    history = _history(client, finished_job)
+    assert history['success'] and sum(item['qty'] for item in history['history']) == 5
@@ -0,0 +1,24 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.barcode_parser import GS, BarcodeParser
+
+
+def test_default_rule_keeps_legacy_slice():
+    parsed = BarcodeParser().parse('0000123450')
+    assert parsed.error is None and parsed.prefix == '12345'
+
+
+def test_check_digits_off_by_default():
+    assert BarcodeParser().parse('000000000000000019').error is None
+    assert BarcodeParser(check_digits=True).parse('000000000000000019').reason == 'check_digit'
+
+
+def test_max_length_applies_to_normalized_gs1():
+    # 99 ký tự khi quét, dài hơn 100 sau khi chuẩn hóa sang dạng (AI)giá trị
+    raw = ']C1' + '0108931234567897' + GS.join(['10' + 'A' * 20, '21' + 'B' * 20, '240' + 'C' * 25]) + GS + '91' + 'D'
+    assert len(raw) - 3 <= 100
+    parsed = BarcodeParser(max_length=100).parse(raw)
+    assert parsed.reason == 'length'
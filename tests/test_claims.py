@@ -0,0 +1,82 @@
+import os
+import sys
+import threading
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from services.claims import claim_cartons, run_stress
+
+
+def _seed(engine, job_type, skus):
+    rows = [
+        {'sscc': f"{sku}-{i}", 'sku': sku, 'jobno': 'J1', 'jobno_type': job_type}
+        for sku, count in skus.items() for i in range(count)
+    ]
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO scanfile (release_key, sscc, master_delivery, qty, master_ctl, master_st_company, master_add1,
+                                  master_add2, master_add3, master_add4, ship_to, st_zip, barcode, sku, jobno, jobno_type,
+                                  tag_label, pallet, time_scan, pallet_type, jobscan)
+            VALUES ('', :sscc, '', 1, '', '', '', '', '', '', '', '', '', :sku, :jobno, :jobno_type, '', '', '1970-01-01', '', '')
+        """), rows)
+
+
+def test_run_stress_on_not_null_scanfile(strict_engine):
+    report = run_stress(strict_engine, threads=4, cartons=60, batch=3, log=lambda report: None)
+    assert report['claims'] == 60
+    assert report['double_claims'] == 0
+    assert report['unclaimed'] == 0
+    with strict_engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM scanfile")).scalar() == 0
+
+
+def test_claim_cartons_limit_and_previous_values(strict_engine):
+    _seed(strict_engine, 'JT', {'SKU1': 3, 'SKU2': 1})
+    now = datetime(2024, 5, 1, 8, 30)
+    with Session(strict_engine) as session:
+        first = claim_cartons(session, 'JT', 'SKU1', 2, pallet='1', pallet_type='1.2', userscan='u1', time_scan=now)
+        rest = claim_cartons(session, 'JT', 'SKU1', None, pallet='2', pallet_type='1.2', userscan='u2', time_scan=now)
+        empty = claim_cartons(session, 'JT', 'SKU1', 5, pallet='3', pallet_type='1.2')
+        session.commit()
+    assert len(first) == 2 and len(rest) == 1 and empty == []
+    assert {row.userscan for row in first} == {'u1'} and first[0].prev_user is None
+    assert first[0].time_scan == now
+    with strict_engine.connect() as conn:
+        pallets = dict(conn.execute(text("SELECT pallet, COUNT(*) FROM scanfile GROUP BY pallet")).fetchall())
+    # SKU2 vẫn chờ scan
+    assert pallets == {'1': 2, '2': 1, '': 1}
+
+
+def test_concurrent_claims_never_share_a_row(strict_engine):
+    _seed(strict_engine, 'JT', {'SKU1': 40})
+    claimed = []
+    lock = threading.Lock()
+
+    def worker(n):
+        with Session(strict_engine) as session:
+            while True:
+                try:
+                    rows = claim_cartons(session, 'JT', 'SKU1', 2, pallet=str(n), pallet_type='1.2', userscan=f"u{n}")
+                    session.commit()
+                except OperationalError:
+                    session.rollback()
+                    continue
+                if not rows:
+                    return
+                with lock:
+                    claimed.extend(row.id for row in rows)
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    assert len(claimed) == 40 and len(set(claimed)) == 40
+    with strict_engine.connect() as conn:
+        per_pallet = conn.execute(text("SELECT pallet, COUNT(*) FROM scanfile GROUP BY pallet")).fetchall()
+    assert sum(count for _, count in per_pallet) == 40 and '' not in dict(per_pallet)
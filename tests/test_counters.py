@@ -0,0 +1,94 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from services import counters, schema
+from services.claims import claim_cartons
+
+from test_claims import _seed
+
+
+@pytest.fixture
+def engine(strict_engine):
+    with strict_engine.begin() as conn:
+        schema._m005_scan_counters(conn)
+        schema._m006_job_version(conn)
+    _seed(strict_engine, 'JT', {'SKU1': 3, 'SKU2': 2})
+    counters._ready.clear()
+    yield strict_engine
+    counters._ready.clear()
+
+
+def _scan(session, sku, limit, pallet):
+    rows = claim_cartons(session, 'JT', sku, limit, pallet=pallet, pallet_type='1.2', userscan='u1')
+    counters.apply_claims(session, 'JT', pallet, [row.sku for row in rows])
+    return rows
+
+
+def test_rebuild_marks_job_ready_only_after_commit(engine):
+    with Session(engine) as session:
+        assert counters.ensure_job(session, 'JT')
+        assert 'JT' not in counters._ready
+        session.commit()
+    assert 'JT' in counters._ready
+
+
+def test_rolled_back_rebuild_is_not_trusted(engine):
+    with Session(engine) as session:
+        _scan(session, 'SKU1', 2, '1')
+        # vd. IntegrityError ở scan_ledger -> cả transaction (kể cả dòng đếm vừa tạo) bị rollback
+        session.rollback()
+    assert 'JT' not in counters._ready
+
+    with Session(engine) as session:
+        _scan(session, 'SKU1', 1, '1')
+        session.commit()
+        assert counters.job_counts(session, 'JT') == (5, 1)
+        assert counters.sku_remaining(session, 'JT', 'SKU1') == 2
+        assert counters.rebuild_job(session, 'JT') == []
+
+
+def test_closed_session_without_commit_is_not_trusted(engine):
+    with Session(engine) as session:
+        counters.ensure_job(session, 'JT')
+    assert 'JT' not in counters._ready
+    with Session(engine) as session:
+        assert counters.ensure_job(session, 'JT')
+
+
+def test_incremental_counts_match_rebuild(engine):
+    with Session(engine) as session:
+        _scan(session, 'SKU1', 2, '1')
+        session.commit()
+        _scan(session, 'SKU2', None, '1')
+        _scan(session, 'SKU1', 1, '2')
+        session.commit()
+        released = session.execute(text("UPDATE scanfile SET pallet = '' WHERE id = (SELECT MIN(id) FROM scanfile WHERE pallet = '2')")).rowcount
+        counters.apply_releases(session, 'JT', '2', 'SKU1', released)
+        session.commit()
+
+        assert counters.job_counts(session, 'JT') == (5, 4)
+        assert counters.scan_summary(session, 'JT', '1') == (4, 5, 4)
+        assert counters.remaining_skus(session, 'JT') == [('SKU1', 1)]
+        assert counters.used_pallets(session, 'JT') == {'1'}
+        assert counters.rebuild_job(session, 'JT') == []
+
+
+def test_reconcile_reports_and_repairs_drift(engine):
+    with Session(engine) as session:
+        counters.ensure_job(session, 'JT')
+        session.commit()
+        # Ghi scanfile không qua bộ đếm -> lệch
+        session.execute(text("UPDATE scanfile SET pallet = '7' WHERE sku = 'SKU2'"))
+        session.commit()
+        report = counters.reconcile(session, job_type='JT', log=lambda line: None)
+        session.commit()
+        drifted = {(item['pallet'], item['sku']) for item in report['JT']}
+        assert {('', ''), ('', 'SKU2'), ('7', ''), ('7', 'SKU2')} <= drifted
+        assert counters.pallet_count(session, 'JT', '7') == 2
+        assert counters.rebuild_job(session, 'JT') == []
@@ -0,0 +1,108 @@
+import os
+import queue
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from services import events, schema
+from services.events import Cursor, EventBus
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'events.db'}")
+    with engine.begin() as conn:
+        schema._m007_events(conn)
+    yield engine
+    engine.dispose()
+
+
+def _insert(engine, event_id, kind='log', created_at=None):
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO events (id, kind, payload, created_at) VALUES (:id, :kind, '{}', :t)"),
+                     {'id': event_id, 'kind': kind, 't': created_at or datetime.now()})
+
+
+def test_late_commit_with_lower_id_is_not_lost(engine):
+    # id 2 được cấp trước nhưng commit sau id 3
+    _insert(engine, 1)
+    _insert(engine, 3)
+    cursor = Cursor(0)
+    with engine.connect() as conn:
+        assert [e[0] for e in cursor.advance(events.fetch_since(conn, cursor))] == [1, 3]
+    assert str(cursor) == '3:2'
+
+    _insert(engine, 2)
+    _insert(engine, 4)
+    with engine.connect() as conn:
+        assert [e[0] for e in cursor.advance(events.fetch_since(conn, cursor))] == [2, 4]
+        # Không gửi lại
+        assert cursor.advance(events.fetch_since(conn, cursor)) == []
+    assert str(cursor) == '4'
+
+
+def test_cursor_parse_round_trip_and_gap_expiry(monkeypatch):
+    cursor = Cursor.parse('120:117,118')
+    assert cursor.last_id == 120 and set(cursor.gaps) == {117, 118}
+    assert str(Cursor.parse(str(cursor))) == '120:117,118'
+    assert str(Cursor.parse('42')) == '42'
+
+    # id không bao giờ xuất hiện (transaction rollback) -> bỏ sau GAP_SECONDS
+    monkeypatch.setattr(events, 'GAP_SECONDS', 0)
+    cursor = Cursor(0)
+    cursor.advance([(1, 'log', '{}'), (3, 'log', '{}')])
+    assert not cursor.gaps
+
+
+def test_stream_resume_sends_missing_ids(engine):
+    for event_id in (5, 6, 7):
+        _insert(engine, event_id)
+    bus = EventBus(engine, poll_interval=60)
+    cursor = Cursor.parse('6:5')
+    with engine.connect() as conn:
+        backlog = events.fetch_since(conn, cursor)
+    stream = bus.stream(backlog, cursor, max_seconds=0)
+    chunks = list(stream)
+    ids = [line.split(': ', 1)[1] for chunk in chunks for line in chunk.splitlines() if line.startswith('id: ')]
+    assert ids == ['6', '7']
+    assert not bus._subscribers
+
+
+def test_bus_backs_off_when_idle_and_delivers_on_notify(engine):
+    bus = EventBus(engine, poll_interval=0.01, max_interval=0.08)
+    q = bus.subscribe()
+    try:
+        time.sleep(0.5)
+        idle_polls = bus.polls
+        assert bus.interval == 0.08
+        time.sleep(0.3)
+        # Yên lặng: tối đa ~1 query / max_interval
+        assert bus.polls - idle_polls <= 6
+
+        with Session(engine) as session:
+            events.publish(session, 'log', {'message': 'xong pallet 1'})
+            session.commit()
+        bus.notify()
+        event_id, kind, payload = q.get(timeout=2)
+        assert kind == 'log' and 'xong pallet 1' in payload
+    finally:
+        bus.unsubscribe(q)
+
+
+def test_publish_purges_old_events(engine, monkeypatch):
+    _insert(engine, 1, created_at=datetime.now() - timedelta(hours=30))
+    _insert(engine, 2, created_at=datetime.now() - timedelta(hours=1))
+    monkeypatch.setattr(events, '_last_purge', 0.0)
+    with Session(engine) as session:
+        events.publish(session, 'read', {'id': 2}, retention_hours=24)
+        # Lần ghi tiếp theo trong PURGE_EVERY giây không xóa lại
+        events.publish(session, 'read', {'id': 3}, retention_hours=24)
+        session.commit()
+    with engine.connect() as conn:
+        assert [row[0] for row in conn.execute(text("SELECT id FROM events ORDER BY id"))] == [2, 3, 4]
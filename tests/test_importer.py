@@ -0,0 +1,61 @@
+import csv
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from services.importer import ScanfileImporter, copy_csv, copy_sql, iter_file_rows
+
+CSV_FILE = (
+    "SSCC,SKU,JOBNO,JOBNO_TYPE,QTY,BARCODE,TAG_LABEL\n"
+    "S1,SKU1,J1,JT,1,,\n"
+    "S2,SKU1,J1,JT,,8930001,T\n"
+    "S3,SKU2,J1,JT,2,,\n"
+)
+
+
+def test_import_fills_not_null_columns(strict_engine):
+    with Session(strict_engine) as session:
+        importer = ScanfileImporter(session, chunk_size=2)
+        summary = importer.run(iter_file_rows(io.BytesIO(CSV_FILE.encode()), 'job.csv'))
+        session.commit()
+    assert summary['inserted'] == 3 and summary['rejected'] == 0
+    with strict_engine.connect() as conn:
+        rows = conn.execute(text("SELECT sscc, qty, barcode, pallet, pallet_type, master_add1, time_scan FROM scanfile ORDER BY sscc")).fetchall()
+    assert [tuple(row) for row in rows] == [
+        ('S1', 1, '', '', '', '', '1970-01-01'),
+        ('S2', 0, '8930001', '', '', '', '1970-01-01'),
+        ('S3', 2, '', '', '', '', '1970-01-01'),
+    ]
+
+
+def test_copy_csv_quotes_empty_strings():
+    # COPY (FORMAT csv) chỉ coi ô rỗng KHÔNG có dấu nháy là NULL
+    payload = copy_csv([['S1', '', None, 0], ['a"b', 'x,y', '', '']])
+    assert payload == '"S1","",,"0"\n"a""b","x,y","",""\n'
+    assert list(csv.reader(io.StringIO(payload))) == [['S1', '', '', '0'], ['a"b', 'x,y', '', '']]
+    assert copy_csv([]) == ''
+
+
+def test_copy_round_trips_empty_strings_on_postgres():
+    url = os.getenv('TEST_POSTGRES_URL')
+    if not url:
+        pytest.skip("Đặt TEST_POSTGRES_URL để chạy COPY trên Postgres thật")
+    pytest.importorskip('psycopg2')
+    engine = create_engine(url)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("CREATE TEMPORARY TABLE copy_check (a VARCHAR(10) NOT NULL, b VARCHAR(10) NOT NULL, c VARCHAR(10))"))
+            raw = conn.connection.dbapi_connection
+            with raw.cursor() as cursor:
+                cursor.copy_expert(copy_sql('copy_check', ['a', 'b', 'c']), io.StringIO(copy_csv([['S1', '', None]])))
+            row = conn.execute(text("SELECT a, b, c FROM copy_check")).fetchone()
+            conn.rollback()
+    finally:
+        engine.dispose()
+    assert tuple(row) == ('S1', '', None)
@@ -0,0 +1,63 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+from conftest import add_cartons, login
+from services import labels
+
+
+def _sscc_rows(n):
+    return [{'pallet': '1', 'sku': 'SKU1', 'sscc': f"00089300000000{i:04d}", 'qty': 1, 'master_delivery': 'PO1',
+             'ship_to': 'KH', 'tag_label': ''} for i in range(n)]
+
+
+def test_pool_uses_spawn_and_matches_inline_render():
+    pool = labels.LabelPool(workers=2, min_pages=3)
+    assert pool.for_jobs(2) is None
+    executor = pool.for_jobs(5)
+    try:
+        # fork từ worker nhiều luồng có thể chép lock đang bị giữ sang process con
+        assert executor._mp_context.get_start_method() == 'spawn'
+        jobs = labels.sscc_jobs(_sscc_rows(5))
+        pooled, pages = labels.render_pdf('sscc', jobs, pool=executor, chunk_size=2)
+        inline, _ = labels.render_pdf('sscc', jobs)
+    finally:
+        executor.shutdown()
+    assert pages == 5
+    assert pooled == inline
+
+
+def _jobscan_state(scan_app, job_type):
+    with scan_app.app.app_context():
+        jobscans = {row[0] for row in scan_app.db.session.execute(
+            text("SELECT jobscan FROM scanfile WHERE jobno_type = :job_type AND pallet != ''"), {'job_type': job_type})}
+        states = {row[0] for row in scan_app.db.session.execute(
+            text("SELECT state FROM pallet_registry WHERE jobno_type = :job_type"), {'job_type': job_type})}
+    return jobscans, states
+
+
+def test_pallet_pdf_get_is_read_only(scan_app, client):
+    add_cartons(scan_app, 'JT', {'SKU1': 2})
+    assert client.post('/api/scan', json={'barcode': '1000123450', 'job_type': 'JT', 'pallet_no': '1',
+                                          'pallet_type': '1.2'}).get_json()['success']
+
+    response = client.get('/api/labels/pallet.pdf?job_type=JT&pallet=1')
+    assert response.status_code == 200 and response.data.startswith(b'%PDF')
+    jobscans, states = _jobscan_state(scan_app, 'JT')
+    assert not any(jobscans) and states == {'open'}
+
+    assigned = client.post('/api/labels/assign_jobscan', json={'job_type': 'JT', 'pallet_no': '1'}).get_json()
+    assert assigned == {'success': True, 'changed': True}
+    jobscans, states = _jobscan_state(scan_app, 'JT')
+    assert len(jobscans) == 1 and all(jobscans) and states == {'printed'}
+    # Gán lại không đổi JobScan đã có
+    assert client.post('/api/labels/assign_jobscan', json={'job_type': 'JT', 'pallet_no': '1'}).get_json()['changed'] is False
+
+
+def test_assign_jobscan_requires_printer_role(scan_app, client):
+    login(client, role='scanner')
+    response = client.post('/api/labels/assign_jobscan', json={'job_type': 'JT', 'pallet_no': '1'})
+    assert response.status_code in (302, 403)
@@ -0,0 +1,100 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+from services.masterdata_import import MasterdataImporter
+
+HEADER = ['sku', 'refix', 'weight', 'length', 'width', 'height']
+
+
+def _import(scan_app, rows, **kwargs):
+    with scan_app.app.app_context():
+        session = scan_app.db.session
+        summary = MasterdataImporter(session, **kwargs).run([HEADER] + rows)
+        session.commit()
+        masterdata = {row[0]: (row[1], row[2], row[3]) for row in session.execute(text("SELECT sku, refix, weight, cbm FROM masterdata"))}
+    return summary, masterdata
+
+
+def _add_sku(scan_app, sku, refix):
+    with scan_app.app.app_context():
+        scan_app.db.session.execute(text("INSERT INTO masterdata (sku, refix, weight, updated_at) VALUES (:sku, :refix, 1, :t)"),
+                                    {'sku': sku, 'refix': refix, 't': datetime.now()})
+        scan_app.db.session.commit()
+
+
+def test_existing_collision_does_not_block_other_rows(scan_app):
+    # SKU3 trùng prefix với SKU1 từ trước (dữ liệu cũ)
+    _add_sku(scan_app, 'SKU3', '12345')
+    summary, masterdata = _import(scan_app, [
+        ['SKU2', '22222', '2.5', '', '', ''],
+        ['SKU4', '44444', '1', '', '', ''],
+        ['SKU1', '12345', '3', '', '', ''],
+    ])
+    assert (summary['updated'], summary['inserted'], summary['rejected']) == (2, 1, 0)
+    assert summary['collisions'] == []
+    assert masterdata['SKU2'][1] == 2.5 and masterdata['SKU4'][0] == '44444' and masterdata['SKU1'][1] == 3
+
+    # Dòng sửa lại prefix cũ được nhận
+    summary, masterdata = _import(scan_app, [['SKU3', '33333', '1', '', '', '']])
+    assert summary['updated'] == 1 and masterdata['SKU3'][0] == '33333'
+
+
+def test_only_rows_introducing_a_collision_are_rejected(scan_app):
+    summary, masterdata = _import(scan_app, [
+        ['SKU5', '22222', '1', '', '', ''],
+        ['SKU6', '66666', '1', '', '', ''],
+        ['SKU7', '66666', '1', '', '', ''],
+    ])
+    assert (summary['inserted'], summary['rejected']) == (1, 2)
+    assert {item['refix']: item['skus'] for item in summary['collisions']} == {
+        '22222': ['SKU2', 'SKU5'], '66666': ['SKU6', 'SKU7']}
+    assert 'SKU5' not in masterdata and 'SKU7' not in masterdata and masterdata['SKU6'][0] == '66666'
+    assert masterdata['SKU2'][0] == '22222'
+
+
+def test_held_row_is_accepted_when_a_later_row_frees_the_prefix(scan_app):
+    summary, masterdata = _import(scan_app, [
+        ['SKU5', '22222', '1', '', '', ''],
+        ['SKU2', '99999', '2', '', '', ''],
+    ], chunk_size=1)
+    assert (summary['inserted'], summary['updated'], summary['rejected']) == (1, 1, 0)
+    assert masterdata['SKU5'][0] == '22222' and masterdata['SKU2'][0] == '99999'
+
+
+def test_file_is_read_in_batches(scan_app, monkeypatch):
+    consumed = []
+
+    def rows():
+        yield HEADER
+        for i in range(10):
+            consumed.append(i)
+            yield [f"NEW{i}", f"7{i:04d}", '1', '', '', '']
+
+    writes = []
+    original = MasterdataImporter._write_inserts
+
+    def record_write(self, names, records, now):
+        if records:
+            writes.append((len(consumed), len(records)))
+        return original(self, names, records, now)
+
+    monkeypatch.setattr(MasterdataImporter, '_write_inserts', record_write)
+    with scan_app.app.app_context():
+        summary = MasterdataImporter(scan_app.db.session, chunk_size=3).run(rows())
+        scan_app.db.session.rollback()
+    assert summary['inserted'] == 10
+    # Mỗi lô được ghi trước khi đọc tiếp file
+    assert writes == [(3, 3), (6, 3), (9, 3), (10, 1)]
+
+
+def test_duplicate_sku_across_batches_keeps_the_later_row_and_computes_cbm(scan_app):
+    summary, masterdata = _import(scan_app, [
+        ['SKU8', '88888', '1', '10', '20', '30'],
+        ['SKU9', '99999', '1', '', '', ''],
+        ['SKU8', '88888', '4', '100', '50', '40'],
+    ], chunk_size=2)
+    assert (summary['inserted'], summary['updated'], summary['rejected']) == (2, 0, 1)
+    assert summary['errors'][0]['line'] == 2 and 'dùng dòng 4' in summary['errors'][0]['message']
+    assert masterdata['SKU8'][1:] == (4, 0.2)
+    assert summary['cbm_computed'] == 2
@@ -0,0 +1,53 @@
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from services import jobs, pallets, productivity, schema, stats
+
+TABLES = {
+    'stats_job_pallets': "SELECT jobno, jobno_type, pallet_type, pallet, cartons FROM stats_job_pallets",
+    'stats_users': "SELECT userscan, cartons FROM stats_users",
+    'productivity_hourly': "SELECT bucket, userscan, jobno_type, cartons FROM productivity_hourly",
+    'pallet_registry': "SELECT jobno_type, pallet_no, state, pallet_type, cartons FROM pallet_registry",
+    'jobs': "SELECT jobno_type, jobno, total_cartons FROM jobs",
+}
+
+
+def _snapshot(conn):
+    return {table: sorted(tuple(row) for row in conn.execute(text(sql))) for table, sql in TABLES.items()}
+
+
+def test_frozen_migrations_match_service_rebuilds(strict_engine):
+    # DB production trước migration 001: scanfile có dữ liệu, masterdata + logs chưa có cột/index mới
+    with strict_engine.begin() as conn:
+        conn.execute(text("CREATE TABLE masterdata (sku VARCHAR(255), refix VARCHAR(255), weight REAL)"))
+        conn.execute(text("CREATE TABLE logs (id INTEGER PRIMARY KEY, is_read BOOLEAN)"))
+        rows = [('J1', 'JT', 'SKU1', '1', '1.2', 'op1', '20240101', datetime(2024, 1, 1, 8, 15)),
+                ('J1', 'JT', 'SKU1', '1', '1.2', 'op2', '', datetime(2024, 1, 1, 9, 5)),
+                ('J1', 'JT', 'SKU2', '', '', '', '', datetime(2024, 1, 1)),
+                ('J2', 'JX', 'SKU2', '3', '1.6', 'op1', '20240102', datetime(2024, 1, 2, 10, 0))]
+        conn.execute(text("""
+            INSERT INTO scanfile (release_key, sscc, master_delivery, qty, master_ctl, master_st_company, master_add1,
+                                  master_add2, master_add3, master_add4, ship_to, st_zip, barcode, sku, jobno, jobno_type,
+                                  tag_label, pallet, time_scan, pallet_type, jobscan, userscan)
+            VALUES ('', :sscc, '', 1, '', '', '', '', '', '', '', '', '', :sku, :jobno, :job_type, '', :pallet, :time_scan,
+                    :pallet_type, :jobscan, :userscan)
+        """), [{'sscc': f"S{i}", 'jobno': jobno, 'job_type': job_type, 'sku': sku, 'pallet': pallet, 'pallet_type': pallet_type,
+                'userscan': userscan, 'jobscan': jobscan, 'time_scan': time_scan}
+               for i, (jobno, job_type, sku, pallet, pallet_type, userscan, jobscan, time_scan) in enumerate(rows)])
+
+    assert schema.upgrade(strict_engine, log=lambda line: None) == [version for version, _, _ in schema.MIGRATIONS]
+    with strict_engine.connect() as conn:
+        migrated = _snapshot(conn)
+    assert migrated['stats_users'] == [('op1', 2), ('op2', 1)]
+
+    # SQL chép cố định trong migration cho cùng kết quả với code tính lại hiện tại
+    with Session(strict_engine) as session:
+        stats.rebuild(session)
+        productivity.rebuild(session)
+        pallets.rebuild(session)
+        assert jobs.sync(session) == (0, 0)
+        session.commit()
+    with strict_engine.connect() as conn:
+        assert _snapshot(conn) == migrated
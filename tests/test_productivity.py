@@ -0,0 +1,19 @@
+from datetime import date
+
+from conftest import add_cartons, login
+
+
+def test_productivity_is_admin_only(scan_app, client):
+    add_cartons(scan_app, 'JT', {'SKU1': 2})
+    login(client, role='scanner', user='op1')
+    assert client.post('/api/scan', json={'barcode': '1000123450', 'job_type': 'JT', 'pallet_no': '1',
+                                          'pallet_type': '1.2'}).get_json()['success']
+    today = date.today().isoformat()
+    for role in ('scanner', 'printer'):
+        login(client, role=role)
+        assert client.get(f'/api/productivity?start={today}').status_code == 403
+
+    login(client, role='admin')
+    data = client.get(f'/api/productivity?start={today}&granularity=day').get_json()
+    assert data['success']
+    assert [(user['username'], user['total']) for user in data['users']] == [('op1', 1)]
@@ -0,0 +1,58 @@
+import time
+
+from services.response_cache import ResponseCache, SqliteStore
+
+
+def _store(tmp_path, **kwargs):
+    return SqliteStore(str(tmp_path / 'response_cache.db'), **kwargs)
+
+
+def test_cache_hit_does_not_write(tmp_path):
+    store = _store(tmp_path)
+    store.put('get_history:JT', 'get_history:JT@1', '{"success":true}')
+    conn = store._conn()
+    changes = conn.total_changes
+    for _ in range(50):
+        assert store.get('get_history:JT@1') == '{"success":true}'
+    assert store.get('get_history:JT@2') is None
+    # Chỉ đọc: không UPDATE accessed, không upsert counters
+    assert conn.total_changes == changes
+    assert conn.execute("SELECT COUNT(*) FROM counters").fetchone()[0] == 0
+
+
+def test_stale_entry_is_touched_once(tmp_path):
+    store = _store(tmp_path, touch_seconds=10)
+    store.put('scope', 'scope@1', '1')
+    store._conn().execute("UPDATE entries SET accessed = ?", (time.time() - 60,))
+    store._conn().commit()
+    changes = store._conn().total_changes
+    store.get('scope@1')
+    store.get('scope@1')
+    assert store._conn().total_changes == changes + 1
+    assert time.time() - store._conn().execute("SELECT accessed FROM entries").fetchone()[0] < 5
+
+
+def test_counts_from_every_worker_reach_shared_stats(tmp_path):
+    first, second = _store(tmp_path), _store(tmp_path, counts_seconds=0)
+    first.put('scope', 'scope@1', '1')
+    for _ in range(3):
+        first.get('scope@1')
+    second.get('scope@1')
+    second.get('scope@2')
+    # second cộng ngay (counts_seconds=0); first cộng khi đọc thống kê
+    assert first.stats() == {'hits': 4, 'misses': 1, 'entries': 1}
+
+
+def test_response_cache_hit_and_miss(tmp_path):
+    cache = ResponseCache(_store(tmp_path), log=lambda line: None)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'success': True, 'items': [1, 2]}
+
+    assert cache.get_or_compute('get_print_data:JT', 3, compute) == ({'success': True, 'items': [1, 2]}, 'MISS')
+    assert cache.get_or_compute('get_print_data:JT', 3, compute) == ({'success': True, 'items': [1, 2]}, 'HIT')
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert stats['worker']['hits'] == 1 and stats['shared']['hits'] == 1 and stats['shared']['misses'] == 1
@@ -0,0 +1,15 @@
+from conftest import add_cartons
+
+
+def test_scan_batch_unknown_prefix_is_per_item_error(scan_app, client):
+    add_cartons(scan_app, 'JT', {'SKU1': 1})
+    response = client.post('/api/scan_batch', json={
+        'barcodes': ['1000123450', '1000999990'], 'job_type': 'JT', 'pallet_no': '1', 'pallet_type': '1.2'})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['success']
+    ok, unknown = data['results']
+    assert ok['success'] and ok['sku'] == 'SKU1'
+    assert not unknown['success']
+    assert unknown['barcode'] == '1000999990'
+    assert 'Prefix 99999' in unknown['message']
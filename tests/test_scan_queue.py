@@ -0,0 +1,91 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+
+from conftest import add_cartons
+from services.scan_queue import DONE, PENDING, REJECTED, ScanQueue, ScanWriter
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return ScanQueue(str(tmp_path / 'scan_queue.db'))
+
+
+def _writer(scan_app, queue, batch_size=200):
+    return ScanWriter(queue, scan_app.writer_session, scan_app.record_claims, batch_size=batch_size, log=lambda line: None)
+
+
+def _accept(scan_app, queue, barcodes, job_type='JT'):
+    items = [{'scan_id': f"s{i}", 'job_type': job_type, 'sku': 'SKU1', 'pallet_no': '1', 'pallet_type': '1.2',
+              'userscan': 'op1', 'time_scan': datetime.now(), 'barcode': barcode} for i, barcode in enumerate(barcodes)]
+    with scan_app.app.app_context():
+        results = queue.accept(items, scan_app.queue_waiting, find_scanned=scan_app.find_scanned)
+    assert all(result['success'] for result in results)
+
+
+def _states(queue):
+    return dict(queue._conn().execute("SELECT scan_id, state FROM scan_queue"))
+
+
+def _on_pallet(scan_app, job_type='JT'):
+    with scan_app.app.app_context():
+        return scan_app.db.session.execute(
+            text("SELECT COUNT(*) FROM scanfile WHERE jobno_type = :j AND pallet = '1'"), {'j': job_type}).scalar()
+
+
+def test_crash_after_commit_is_replayed_without_double_claim(scan_app, queue, monkeypatch):
+    add_cartons(scan_app, 'JT', {'SKU1': 5})
+    _accept(scan_app, queue, ['1000123450', '2000123450', '3000123450'])
+
+    # Worker chết sau khi commit DB chính, trước khi đánh dấu done
+    def crash(done, rejected):
+        raise SystemExit
+    monkeypatch.setattr(queue, 'finish', crash)
+    with pytest.raises(SystemExit):
+        _writer(scan_app, queue).flush(queue.pending(10))
+    monkeypatch.undo()
+    assert set(_states(queue).values()) == {PENDING}
+    assert _on_pallet(scan_app) == 3
+
+    # Worker tiếp quản: scan_ledger đã có scan_id -> chỉ đánh dấu done
+    assert _writer(scan_app, queue).step() == 3
+    assert set(_states(queue).values()) == {DONE}
+    assert _on_pallet(scan_app) == 3
+
+
+def test_integrity_error_is_isolated_and_offending_scan_rejected(scan_app, queue):
+    add_cartons(scan_app, 'JT', {'SKU1': 5})
+    _accept(scan_app, queue, ['1000123450', '2000123450', '3000123450'])
+    # Hàng đợi từ bản cũ: hai lần quét pending cùng mã -> scanned_barcodes.record lỗi khóa chính cả lô
+    queue._conn().execute("UPDATE scan_queue SET barcode = '1000123450' WHERE scan_id = 's1'")
+
+    writer = _writer(scan_app, queue)
+    assert writer.step() == 3
+    assert writer._isolate_until and _on_pallet(scan_app) == 0
+    # Ghi từng dòng: dòng hợp lệ vào pallet, dòng trùng mã bị từ chối thay vì thử lại mãi
+    while writer.step():
+        pass
+    assert _states(queue) == {'s0': DONE, 's1': REJECTED, 's2': DONE}
+    assert _on_pallet(scan_app) == 2
+    assert writer.rejected == 1
+
+
+def test_integrity_error_on_single_scan_is_rejected(scan_app, queue, monkeypatch):
+    from sqlalchemy.exc import IntegrityError
+    from services import scan_ledger
+
+    add_cartons(scan_app, 'JT', {'SKU1': 2})
+    _accept(scan_app, queue, ['1000123450'])
+    record = scan_ledger.record
+
+    def broken(session, entries, job_type, userscan):
+        record(session, entries, job_type, userscan)
+        raise IntegrityError('INSERT INTO scan_ledger', {}, Exception('UNIQUE constraint failed'))
+
+    monkeypatch.setattr(scan_ledger, 'record', broken)
+    writer = _writer(scan_app, queue)
+    assert writer.step() == 1
+    assert _states(queue) == {'s0': REJECTED}
+    assert writer.step() == 0
+    assert _on_pallet(scan_app) == 0
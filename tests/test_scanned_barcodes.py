@@ -0,0 +1,90 @@
+from datetime import datetime
+
+from sqlalchemy import event, text
+
+from conftest import add_cartons
+from services.scanned_barcodes import BarcodeFilters, BloomFilter
+
+
+def _scan(client, barcode, pallet_no='1'):
+    return client.post('/api/scan', json={'barcode': barcode, 'job_type': 'JT', 'pallet_no': pallet_no,
+                                          'pallet_type': '1.2'}).get_json()
+
+
+def test_bloom_filter_has_no_false_negatives_and_bounded_false_positives():
+    bloom = BloomFilter(10000, error_rate=0.01)
+    added = [f"0089300000{i:08d}" for i in range(10000)]
+    for barcode in added:
+        bloom.add(barcode)
+    assert all(barcode in bloom for barcode in added)
+    false_positives = sum(1 for i in range(20000) if f"0099300000{i:08d}" in bloom)
+    assert false_positives / 20000 < 0.02
+
+
+def test_repeat_scan_is_rejected_before_any_scanfile_query(scan_app, client):
+    add_cartons(scan_app, 'JT', {'SKU1': 3})
+    assert _scan(client, '1000123450')['success']
+
+    statements = []
+
+    def capture(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with scan_app.app.app_context():
+        engine = scan_app.db.engine
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        result = _scan(client, '1000123450', pallet_no='2')
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+    # Cờ duplicate -> scan.html phát âm báo trùng
+    assert result['duplicate'] and not result['success'] and 'Pallet 1' in result['message']
+    assert statements and not any('scanfile' in statement for statement in statements)
+
+    with scan_app.app.app_context():
+        assert scan_app.db.session.execute(
+            text("SELECT COUNT(*) FROM scanfile WHERE jobno_type = 'JT' AND pallet != ''")).scalar() == 1
+
+
+def test_released_carton_can_be_scanned_again(scan_app, client):
+    add_cartons(scan_app, 'JT', {'SKU1': 3})
+    assert _scan(client, '1000123450')['success']
+    assert client.post('/api/delete_scan', json={'job_type': 'JT', 'pallet': '1', 'sku': 'SKU1',
+                                                 'quantity': 1}).get_json()['success']
+    assert _scan(client, '1000123450', pallet_no='2')['success']
+
+
+def test_concurrent_duplicate_hits_ledger_primary_key(scan_app, client):
+    add_cartons(scan_app, 'JT', {'SKU1': 3})
+    scan_app.barcode_filters.forget('JT')
+    assert _scan(client, '1000123450')['success']
+    # Worker khác vừa ghi mã này (filter của worker này chưa biết) -> khóa chính của sổ chặn lại
+    with scan_app.app.app_context():
+        scan_app.db.session.execute(text("""
+            INSERT INTO scanned_barcodes (jobno_type, barcode, sku, pallet, userscan, scanned_at)
+            VALUES ('JT', '2000123450', 'SKU1', '7', 'op2', :t)
+        """), {'t': datetime.now()})
+        scan_app.db.session.commit()
+    result = _scan(client, '2000123450')
+    assert result['duplicate'] and 'Pallet 7' in result['message']
+    with scan_app.app.app_context():
+        # Thùng đã gán trong request bị lỗi được hoàn lại
+        assert scan_app.db.session.execute(
+            text("SELECT COUNT(*) FROM scanfile WHERE jobno_type = 'JT' AND pallet != ''")).scalar() == 1
+
+
+def test_filters_rebuild_from_ledger_on_worker_start(scan_app, client):
+    add_cartons(scan_app, 'JT', {'SKU1': 3})
+    for barcode in ('1000123450', '2000123450'):
+        assert _scan(client, barcode)['success']
+    # Worker mới: filter rỗng, nạp lại từ bảng khi gặp job lần đầu
+    filters = BarcodeFilters()
+    with scan_app.app.app_context():
+        session = scan_app.db.session
+        assert filters.scanned(session, 'JT', ['1000123450', '2000123450', '3000123450']) == {
+            '1000123450': '1', '2000123450': '1'}
+        assert filters.loads == 1
+        # Mã chưa scan không cần đọc DB xác nhận (trừ khi filter báo nhầm)
+        confirms = filters.confirms
+        filters.scanned(session, 'JT', ['3000123450'])
+        assert filters.confirms - confirms <= 1 and filters.loads == 1
@@ -0,0 +1,30 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from services import schema
+from services.claims import claim_cartons
+from test_claims import _seed
+
+
+def _normalize(sql):
+    return ' '.join(sql.split())
+
+
+def test_hot_claim_query_is_the_statement_claim_cartons_runs(strict_engine):
+    _seed(strict_engine, 'JT', {'SKU1': 2})
+    statements = []
+    event.listen(strict_engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+    with Session(strict_engine) as session:
+        assert len(claim_cartons(session, 'JT', 'SKU1', 1, '1', '1.2', userscan='op1')) == 1
+    claim = dict(schema.HOT_QUERIES)['claim']('sqlite')
+    # SQL đã biên dịch: :param -> ?
+    assert _normalize(claim).replace(':job_type', '?').replace(':sku', '?').replace(':limit', '?') in \
+        [_normalize(statement) for statement in statements]
+
+
+def test_explain_hot_covers_service_and_app_queries(scan_app):
+    result = scan_app.app.test_cli_runner().invoke(args=['explain-hot', '--job-type', 'JT', '--sku', 'SKU1'])
+    assert result.exit_code == 0, result.output
+    explained = [line.split('] ', 1)[1] for line in result.output.splitlines() if line.startswith('[')]
+    assert explained == [name for name, _ in schema.HOT_QUERIES] + ['delete_scan', 'get_history', 'get_print_data', 'get_sscc_data']
+    assert 'Không có query nào quét toàn bảng.' in result.output
@@ -0,0 +1,48 @@
+from sqlalchemy import text
+
+from conftest import add_cartons
+from services import stats
+
+
+def _scan(client, n, pallet='1'):
+    # Mã khác nhau cho từng thùng (cùng prefix 12345) - mã trùng bị chặn
+    for i in range(n):
+        assert client.post('/api/scan', json={'barcode': f"{i + 1}000123450", 'job_type': 'JT', 'pallet_no': pallet,
+                                              'pallet_type': '1.2'}).get_json()['success']
+
+
+def _rollups(session):
+    return stats.pallet_rows(session), stats.remaining_rows(session), stats.user_rows(session)
+
+
+def test_concurrent_release_resyncs_only_the_pallet(scan_app, client, monkeypatch):
+    add_cartons(scan_app, 'JT', {'SKU1': 4})
+    add_cartons(scan_app, 'OTHER', {'SKU1': 2}, jobno='J2')
+    _scan(client, 3)
+    db = scan_app.db
+    with scan_app.app.app_context():
+        # Request A đọc 2 thùng định gỡ...
+        ids = [row[0] for row in db.session.execute(text(
+            "SELECT id FROM scanfile WHERE jobno_type = 'JT' AND pallet = '1' AND sku = 'SKU1' ORDER BY id LIMIT 2"))]
+        db.session.rollback()
+    # ...request B gỡ mất 1 thùng trong đó
+    assert client.post('/api/delete_scan', json={'job_type': 'JT', 'pallet': '1', 'sku': 'SKU1', 'quantity': 1}).get_json()['success']
+
+    def full_rebuild(session):
+        raise AssertionError("không được tính lại toàn bộ bảng tổng hợp trong request gỡ thùng")
+
+    with scan_app.app.app_context():
+        monkeypatch.setattr(stats, 'rebuild', full_rebuild)
+        rowcount = db.session.execute(text("UPDATE scanfile SET pallet = '', pallet_type = '' WHERE id IN (:a, :b) AND pallet = '1'"),
+                                      {'a': ids[0], 'b': ids[1]}).rowcount
+        assert rowcount == 1
+        scan_app.record_releases('JT', '1', 'SKU1', rowcount, {('J1', '1.2'): 2})
+        db.session.commit()
+        incremental = _rollups(db.session)
+        monkeypatch.undo()
+        stats.rebuild(db.session)
+        assert incremental == _rollups(db.session)
+        db.session.rollback()
+    pallet_rows, remaining, _ = incremental
+    assert ('J1', 'JT', '1.2', 1, 1) in pallet_rows
+    assert ('J1', 'JT', 3) in remaining and ('J2', 'OTHER', 2) in remaining